@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare the two-color separation methods on the test fixtures.
+
+The known target boxes from test/test_targets.py are cropped out of the
+fixture images and segmented, then each method is timed and compared
+against agglomerative clustering on the same pixels.
+
+Usage:
+    python benchmarks/bench_colors.py [max_pixels]
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from target_finder.color_separation import (METHODS, color_agreement,
+                                            label_colors)
+from target_finder.preprocessing import extract_contour
+
+
+TEST_DIR = os.path.join(os.path.dirname(__file__), '..', 'test')
+sys.path.insert(0, TEST_DIR)
+
+from test_targets import IMAGE_DIR, TESTS  # noqa: E402
+
+
+def target_pixels(padding=15):
+    """Get the masked pixels of every fixture target"""
+    for fn, targets in TESTS:
+        image = cv2.imread(os.path.join(IMAGE_DIR, fn))
+
+        for target in targets:
+            x = target.x - padding
+            y = target.y - padding
+            w = target.width + padding * 2
+            h = target.height + padding * 2
+            blob = image[y:y + h, x:x + w]
+
+            # Targets too small for GrabCut are skipped, like they are
+            # when finding targets.
+            try:
+                contour = extract_contour(blob)
+            except cv2.error:
+                continue
+
+            if contour is None:
+                continue
+
+            mask = np.zeros(blob.shape[:2], dtype=np.uint8)
+            cv2.drawContours(mask, [contour], -1, 255, -1)
+
+            yield '{:s} @ {:d},{:d}'.format(fn, target.x, target.y), \
+                blob[mask > 0]
+
+
+def main(max_pixels=None):
+    targets = list(target_pixels())
+    times = {method: 0.0 for method in METHODS}
+
+    print('{:28s} {:>7s}  {:>18s}  {:>18s}'
+          .format('target', 'pixels', 'kmeans', 'histogram'))
+
+    for name, pixels in targets:
+        row = []
+
+        for method in METHODS:
+            start = time.perf_counter()
+            label_colors(pixels, method, max_pixels)
+            times[method] += time.perf_counter() - start
+
+            if method != 'agglomerative':
+                result = color_agreement(pixels, method, max_pixels)
+                row.append('{:5.1f}% / {:5.1f}'.format(
+                    result['label_agreement'] * 100,
+                    result['color_distance']))
+
+        print('{:28s} {:7d}  {:>18s}  {:>18s}'
+              .format(name, len(pixels), *row))
+
+    print()
+    print('Agreement is the % of pixels labeled the same as agglomerative '
+          'clustering / the distance between the mean colors.')
+    print()
+
+    for method, total in times.items():
+        print('{:14s} {:8.2f} ms total'.format(method, total * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vectorized YOLO output decoding against the original
+per-row Python loop from Yolo3Detector.detect_all.
+
+The detector output is synthesized, so no model weights are needed.
+
+Usage:
+    python benchmarks/bench_decode.py [num_crops] [num_runs]
+"""
+import sys
+import timeit
+
+import cv2
+import numpy as np
+import target_finder_model as tfm
+
+from target_finder.darknet import decode_yolo_output
+
+
+# Rows per YOLO layer for a 608x608 input (19x19 and 38x38 grids).
+LAYER_ROWS = (3 * 19 * 19, 3 * 38 * 38)
+
+
+def make_output(n, classes, hit_rate=0.002, seed=0):
+    """Create fake YOLO layer outputs with a few confident rows"""
+    rng = np.random.RandomState(seed)
+    net_out = []
+
+    for rows in LAYER_ROWS:
+        layer = rng.uniform(0, 0.04, (n, rows, 5 + len(classes)))
+        layer[:, :, :4] = rng.uniform(0, 1, (n, rows, 4))
+
+        hits = rng.uniform(size=(n, rows)) < hit_rate
+        hit_classes = rng.randint(0, len(classes), hits.sum())
+        layer[hits, 5 + hit_classes] = rng.uniform(0.3, 1, hits.sum())
+
+        net_out.append(layer.astype(np.float32))
+
+    return net_out
+
+
+def decode_loop(net_out, classes, size, threshold=0.05, nms_thresh=.40):
+    """The original per-row decoding loop, kept as a reference"""
+    w, h = size
+    n = net_out[0].shape[0]
+    num_classes = len(classes)
+    detections = []
+
+    for k in range(n):
+
+        shape_boxes = []
+        shape_confidences = []
+        shape_classes = []
+
+        alpha_boxes = []
+        alpha_confidences = []
+        alpha_classes = []
+
+        local_detects = []
+
+        for out_layer in net_out:
+
+            for detection in out_layer[k]:
+
+                scores = detection[5:]
+                class_idx = np.argmax(scores)
+                conf = float(scores[class_idx])
+
+                if conf > threshold and class_idx < num_classes:
+
+                    center_x = int(detection[0] * w)
+                    center_y = int(detection[1] * h)
+                    width = int(detection[2] * w)
+                    height = int(detection[3] * h)
+                    left = int(center_x - width / 2)
+                    top = int(center_y - height / 2)
+
+                    class_name = classes[class_idx]
+                    dims = [left, top, width, height]
+
+                    if len(class_name) != 1:
+                        shape_classes.append(class_name)
+                        shape_confidences.append(conf)
+                        shape_boxes.append(dims)
+                    else:
+                        alpha_classes.append(class_name)
+                        alpha_confidences.append(conf)
+                        alpha_boxes.append(dims)
+
+        for names, confs, boxes in ((shape_classes, shape_confidences,
+                                     shape_boxes),
+                                    (alpha_classes, alpha_confidences,
+                                     alpha_boxes)):
+            best_idxs = cv2.dnn.NMSBoxes(boxes, confs, 0.05, nms_thresh)
+            for i in np.asarray(best_idxs, dtype=np.int64).reshape(-1):
+                local_detects.append((names[i], confs[i], boxes[i]))
+
+        detections.append(local_detects)
+
+    return detections
+
+
+def main(num_crops=20, num_runs=5):
+    classes = tfm.YOLO_CLASSES
+    net_out = make_output(num_crops, classes)
+
+    expected = decode_loop(net_out, classes, tfm.DETECTOR_SIZE)
+    actual = decode_yolo_output(net_out, classes, tfm.DETECTOR_SIZE)
+
+    if actual != expected:
+        print('Vectorized output does not match the reference loop.')
+        sys.exit(1)
+
+    loop_time = min(timeit.repeat(
+        lambda: decode_loop(net_out, classes, tfm.DETECTOR_SIZE),
+        number=1, repeat=num_runs))
+    vec_time = min(timeit.repeat(
+        lambda: decode_yolo_output(net_out, classes, tfm.DETECTOR_SIZE),
+        number=1, repeat=num_runs))
+
+    rows = num_crops * sum(LAYER_ROWS)
+    detects = sum(len(d) for d in expected)
+
+    print('Decoded {:d} crops ({:d} rows, {:d} detections)'
+          .format(num_crops, rows, detects))
+    print('  loop:       {:8.2f} ms'.format(loop_time * 1000))
+    print('  vectorized: {:8.2f} ms'.format(vec_time * 1000))
+    print('  speedup:    {:8.1f}x'.format(loop_time / vec_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Compare GrabCut settings on the test fixtures.
+
+The known target boxes from test/test_targets.py are cropped out of the
+fixture images and segmented with each of the settings below. The
+per-target latency is reported along with how much of the full
+resolution mask is kept.
+
+Usage:
+    python benchmarks/bench_grabcut.py
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from target_finder.preprocessing import SegmentationSettings, extract_contour
+
+
+TEST_DIR = os.path.join(os.path.dirname(__file__), '..', 'test')
+sys.path.insert(0, TEST_DIR)
+
+from test_targets import IMAGE_DIR, TESTS  # noqa: E402
+
+
+SETTINGS = [
+    ('default', SegmentationSettings()),
+    ('3 iterations', SegmentationSettings(iterations=3)),
+    ('early exit', SegmentationSettings(tolerance=0.002)),
+    ('half scale', SegmentationSettings(scale=0.5)),
+    ('half + refine', SegmentationSettings(scale=0.5, refine_iterations=1)),
+    ('10k pixels', SegmentationSettings(max_pixels=10000, tolerance=0.002))
+]
+
+
+def target_crops(padding=15):
+    """Get the padded crop of every fixture target"""
+    for fn, targets in TESTS:
+        image = cv2.imread(os.path.join(IMAGE_DIR, fn))
+
+        for target in targets:
+            x = target.x - padding
+            y = target.y - padding
+            w = target.width + padding * 2
+            h = target.height + padding * 2
+
+            yield image[y:y + h, x:x + w]
+
+
+def contour_mask(shape, contour):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+
+    if contour is not None:
+        cv2.drawContours(mask, [contour], -1, 1, -1)
+
+    return mask.astype(bool)
+
+
+def main():
+    crops = list(target_crops())
+    expected = {}
+
+    print('{:14s} {:>9s} {:>9s} {:>9s} {:>7s}'
+          .format('settings', 'mean ms', 'max ms', 'iters', 'IoU'))
+
+    for name, settings in SETTINGS:
+        times, iterations, ious = [], [], []
+
+        for i, crop in enumerate(crops):
+            stats = {}
+
+            # Targets too small for GrabCut are skipped, like they are
+            # when finding targets.
+            try:
+                contour = extract_contour(crop, settings, stats)
+            except cv2.error:
+                continue
+
+            mask = contour_mask(crop.shape, contour)
+            expected.setdefault(i, mask)
+
+            union = np.sum(mask | expected[i])
+            ious.append(np.sum(mask & expected[i]) / union if union else 1)
+            times.append(stats['grabcut_time'] * 1000)
+            iterations.append(stats['grabcut_iterations'])
+
+        print('{:14s} {:9.2f} {:9.2f} {:9.2f} {:7.3f}'
+              .format(name, np.mean(times), np.max(times),
+                      np.mean(iterations), np.mean(ious)))
+
+    print()
+    print('IoU is the overlap with the default settings\' mask.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Time each stage of finding targets on synthetic full size frames.
+
+Frames are made with the shape generator from target-finder-model
+(generate/create_full_images.py), so its assets need to be pulled first
+with generate/pull_assets.py. The frames only depend on the seed, the
+number of frames and the number of targets, so runs can be compared
+against each other.
+
+Each stage is timed on its own, given the output of the stage before
+it, then the whole find_targets(...) call.
+The results are printed as JSON with the images/sec and the p50/p95
+latency of each stage.
+
+Usage:
+    python benchmarks/bench_stages.py [--frames N] [--targets N]
+        [--seed N] [--output FILE]
+
+The generator is looked for next to this repository, GENERATE_DIR can
+be set to use another copy.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+import target_finder_model as tfm
+
+import target_finder
+from target_finder import classification
+from target_finder.preprocessing import extract_crops, resize_all
+
+
+GENERATE_DIR = os.environ.get('GENERATE_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..',
+    'target-finder-model', 'generate'
+))
+
+STAGES = ('extract_crops', 'resize_all', 'classify_all', 'detect_all',
+          'merge_boxes', 'identify_properties', 'find_targets')
+
+
+def synthetic_frames(num_frames, num_targets, seed=0):
+    """Make full size frames with the target-finder-model generator
+
+    This picks the shape parameters the same way generate_all_shapes()
+    does, but with a fixed number of targets, and keeps the frames in
+    memory instead of saving them.
+
+    Returns:
+        List[PIL.Image]: The RGB frames.
+    """
+    sys.path.insert(0, GENERATE_DIR)
+
+    import config
+    import create_full_images as gen
+
+    r_state = random.getstate()
+    random.seed(seed)
+
+    backgrounds = gen._get_backgrounds()
+    base_shapes = {shape: gen._get_base_shapes(shape)
+                   for shape in config.SHAPE_TYPES}
+
+    if not backgrounds:
+        raise RuntimeError('No backgrounds found in "{:s}", pull the assets '
+                           'with generate/pull_assets.py'
+                           .format(config.BACKGROUNDS_DIR))
+
+    frames = []
+
+    for _ in range(num_frames):
+        n = num_targets
+
+        shape_names = gen._random_list(config.SHAPE_TYPES, n)
+        bases = [random.choice(base_shapes[shape]) for shape in shape_names]
+        alphas = gen._random_list(config.ALPHAS, n)
+        font_files = gen._random_list(config.ALPHA_FONTS, n)
+
+        target_colors = gen._random_list(config.TARGET_COLORS, n)
+        alpha_colors = gen._random_list(config.ALPHA_COLORS, n)
+
+        for i, target_color in enumerate(target_colors):
+            if alpha_colors[i] == target_color:
+                alpha_colors[i] = 'white'
+
+        target_rgbs = [random.choice(config.COLORS[color])
+                       for color in target_colors]
+        alpha_rgbs = [random.choice(config.COLORS[color])
+                      for color in alpha_colors]
+
+        sizes = gen._random_list(range(35, 55), n)
+        angles = gen._random_list(range(0, 360), n)
+
+        xs = gen._random_list(range(200, tfm.FULL_SIZE[0] - 200, 50), n)
+        ys = gen._random_list(range(200, tfm.FULL_SIZE[1] - 200, 50), n)
+
+        shape_params = list(zip(shape_names, bases, alphas, font_files,
+                                sizes, angles, target_colors, target_rgbs,
+                                alpha_colors, alpha_rgbs, xs, ys))
+
+        background = random.choice(backgrounds).copy()
+        shape_imgs = [gen._create_shape(*params) for params in shape_params]
+
+        _, frame = gen._add_shapes(background, shape_imgs, shape_params, 1)
+        frames.append(frame)
+
+    random.setstate(r_state)
+
+    return frames
+
+
+def time_frame(pil_image, timings):
+    """Time each stage on a single frame"""
+    image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage].append(time.perf_counter() - start)
+        return result
+
+    crops = timed('extract_crops', extract_crops, image, tfm.CROP_SIZE,
+                  tfm.CROP_OVERLAP)
+    resized = timed('resize_all', resize_all, crops, tfm.PRECLF_SIZE)
+
+    # The tiles are already the pre-classifier's size, so this only times
+    # the model.
+    regions = timed('classify_all', classification.get_model('clf')
+                    .classify_all, resized.images)
+    crops = [crop for crop, region in zip(crops, regions)
+             if region == 'shape_target']
+
+    raw_bboxes = timed('detect_all', classification._detect_bboxes, crops)
+
+    # Merging changes the boxes, so it gets its own copy.
+    timed('merge_boxes', classification._merge_boxes,
+          [_copy_box(box) for box in raw_bboxes])
+
+    targets = classification._bboxes_to_targets(raw_bboxes)
+    targets.sort(key=lambda t: t.confidence, reverse=True)
+    timed('identify_properties', classification._identify_properties,
+          targets[:20], image)
+
+    timed('find_targets', target_finder.find_targets, pil_image)
+
+
+def summarize(times):
+    """Get the throughput and latency percentiles for a stage"""
+    times_ms = np.array(times) * 1000
+
+    return {
+        'runs': len(times),
+        'images_per_sec': len(times) / sum(times) if sum(times) else None,
+        'mean_ms': float(np.mean(times_ms)),
+        'p50_ms': float(np.percentile(times_ms, 50)),
+        'p95_ms': float(np.percentile(times_ms, 95))
+    }
+
+
+def _copy_box(box):
+    box = copy.copy(box)
+    box.meta = dict(box.meta)
+    return box
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--frames', type=int, default=10,
+                        help='the number of frames to time')
+    parser.add_argument('--targets', type=int, default=10,
+                        help='the number of targets in each frame')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed for generating the frames')
+    parser.add_argument('--output', help='a file to write the JSON to')
+    args = parser.parse_args(args)
+
+    frames = synthetic_frames(args.frames, args.targets, args.seed)
+
+    # Loading the models and warming them up isn't counted.
+    target_finder.preload()
+    time_frame(frames[0], {stage: [] for stage in STAGES})
+
+    timings = {stage: [] for stage in STAGES}
+    for frame in frames:
+        time_frame(frame, timings)
+
+    results = {
+        'config': {
+            'frames': args.frames,
+            'targets': args.targets,
+            'seed': args.seed,
+            'full_size': list(tfm.FULL_SIZE)
+        },
+        'versions': {
+            'target_finder': target_finder.__version__,
+            'target_finder_model': tfm.__version__,
+            'opencv': cv2.__version__,
+            'python': platform.python_version()
+        },
+        'stages': {stage: summarize(timings[stage]) for stage in STAGES}
+    }
+
+    output = json.dumps(results, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -48,6 +48,9 @@ setup(
         'webcolors>=1.7',
         'scikit-learn'
     ],
+    extras_require={
+        'onnx': ['onnx', 'onnxruntime']
+    },
     entry_points='''
         [console_scripts]
         target-finder-cli=target_finder.cli:run
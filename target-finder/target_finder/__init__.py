@@ -1,5 +1,9 @@
 """Entrypoint for the target_finder library."""
 
-from .classification import find_targets
-from .types import Color, Shape, Target
+from .classification import find_targets, find_targets_batch, preload
+from .metrics import Metrics
+from .pipeline import Pipeline, find_targets_stream
+from .sequence import FrameSequenceFinder
+from .tile_cache import TileCache
+from .types import Color, Shape, Target, TargetBatch
 from .version import __version__
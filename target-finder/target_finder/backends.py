@@ -0,0 +1,237 @@
+"""Contains the inference backends the darknet models can run on.
+
+A backend takes the filled (n, 3, height, width) input blob and returns
+the output of each output layer. The darknet models work the same on
+any of them, so the engine can be picked for the machine:
+
+    opencv: OpenCV's DNN module on the CPU (the default).
+    opencv-fp16: OpenCV on the CPU with half precision weights.
+    opencv-opencl, opencv-opencl-fp16: OpenCV on an OpenCL device.
+    opencv-openvino: OpenCV with its OpenVINO (Inference Engine)
+        backend, if OpenCV was built with it.
+    onnxruntime: ONNX Runtime on the CPU, with the darknet model
+        exported to ONNX (see onnx_export.py). This needs the onnx and
+        onnxruntime packages.
+
+The backend defaults to the TARGET_FINDER_BACKEND environment variable
+if set, or opencv otherwise.
+"""
+
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+
+BACKEND_ENV = 'TARGET_FINDER_BACKEND'
+
+DEFAULT_BACKEND = 'opencv'
+
+# The OpenCV backend and target constant names for each OpenCV variant.
+# They're looked up when used since older versions lack some of them.
+_OPENCV_BACKENDS = {
+    'opencv': ('DNN_BACKEND_OPENCV', 'DNN_TARGET_CPU'),
+    'opencv-fp16': ('DNN_BACKEND_OPENCV', 'DNN_TARGET_CPU_FP16'),
+    'opencv-opencl': ('DNN_BACKEND_OPENCV', 'DNN_TARGET_OPENCL'),
+    'opencv-opencl-fp16': ('DNN_BACKEND_OPENCV', 'DNN_TARGET_OPENCL_FP16'),
+    'opencv-openvino': ('DNN_BACKEND_INFERENCE_ENGINE', 'DNN_TARGET_CPU')
+}
+
+BACKENDS = tuple(_OPENCV_BACKENDS) + ('onnxruntime',)
+
+
+def default_backend():
+    """Get the name of the backend to use when none is given."""
+    return os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND
+
+
+def create_backend(name, config_fn, weights_fn):
+    """Load a darknet model on a backend.
+
+    Args:
+        name (str): One of BACKENDS, or None for the default one.
+        config_fn (str): The darknet .cfg file.
+        weights_fn (str): The darknet .weights file.
+
+    Returns:
+        The backend, with forward(blob) and get_image_bytes(shape).
+    """
+    if name is None:
+        name = default_backend()
+
+    if name in _OPENCV_BACKENDS:
+        backend, target = _OPENCV_BACKENDS[name]
+
+        try:
+            backend, target = getattr(cv2.dnn, backend), \
+                getattr(cv2.dnn, target)
+        except AttributeError:
+            raise ValueError('The {:s} backend needs a newer OpenCV'
+                             .format(name))
+
+        return OpenCVBackend(config_fn, weights_fn, backend, target,
+                             name=name)
+
+    if name == 'onnxruntime':
+        return OnnxRuntimeBackend(config_fn, weights_fn)
+
+    raise ValueError('Unknown backend: {!r} (expected one of {:s})'
+                     .format(name, ', '.join(BACKENDS)))
+
+
+class OpenCVBackend(object):
+    """Runs a darknet model with OpenCV's DNN module.
+
+    Attributes:
+        name (str): The name of the backend.
+        net (cv2.dnn.Net): The network.
+        out_layers (List[str]): The names of the output layers.
+    """
+
+    def __init__(self, config_fn, weights_fn, backend=None, target=None,
+                 name=None):
+        """Load the model.
+
+        Args:
+            backend (int): A cv2.dnn.DNN_BACKEND_* value, defaults to
+                DNN_BACKEND_OPENCV.
+            target (int): A cv2.dnn.DNN_TARGET_* value, defaults to
+                OpenCV's own default (the CPU).
+            name (str): The name of the backend, defaults to one made
+                from the backend and target values.
+        """
+        self.name = name or 'opencv:{!r}:{!r}'.format(backend, target)
+        self.net = cv2.dnn.readNetFromDarknet(config_fn, weights_fn)
+
+        if backend is None:
+            backend = cv2.dnn.DNN_BACKEND_OPENCV
+
+        self.net.setPreferableBackend(backend)
+
+        if target is not None:
+            self.net.setPreferableTarget(target)
+
+        # Locate output layers
+        layers = self.net.getLayerNames()
+        out_idxs = np.asarray(self.net.getUnconnectedOutLayers())
+        self.out_layers = [layers[i - 1] for i in out_idxs.reshape(-1)]
+
+    def forward(self, blob):
+        """Run a blob through the net and get the outputs."""
+        self.net.setInput(blob)
+        return self.net.forward(self.out_layers)
+
+    def get_image_bytes(self, shape):
+        """Estimate the memory one input of the shape needs, if known."""
+        try:
+            _, image_bytes = self.net.getMemoryConsumption(shape)
+        except (AttributeError, cv2.error):
+            return None
+
+        return image_bytes
+
+
+class OnnxRuntimeBackend(object):
+    """Runs a darknet model with ONNX Runtime.
+
+    The model is exported to ONNX when loaded. If a cache directory is
+    given (or set with the TARGET_FINDER_CACHE_DIR environment
+    variable), the export is saved there and reused until the config or
+    weights change.
+
+    Attributes:
+        name (str): The name of the backend, 'onnxruntime'.
+        session (onnxruntime.InferenceSession): The session.
+    """
+
+    name = 'onnxruntime'
+
+    def __init__(self, config_fn, weights_fn, onnx_fn=None, cache_dir=None,
+                 threads=None):
+        """Export and load the model.
+
+        Args:
+            onnx_fn (str): An already exported model to load instead.
+            cache_dir (str): A directory to keep the exported model in.
+            threads (int): The number of threads for each forward pass,
+                defaults to ONNX Runtime's choice.
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError('The onnxruntime backend needs the onnx and '
+                              'onnxruntime packages installed')
+
+        if onnx_fn is None:
+            model = _exported_model(config_fn, weights_fn, cache_dir)
+        else:
+            model = onnx_fn
+
+        options = onnxruntime.SessionOptions()
+
+        if threads is not None:
+            options.intra_op_num_threads = threads
+
+        self.session = onnxruntime.InferenceSession(
+            model, options, providers=['CPUExecutionProvider'])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob):
+        """Run a blob through the model and get the outputs."""
+        return self.session.run(None, {self._input_name: blob})
+
+    def get_image_bytes(self, shape):
+        """ONNX Runtime doesn't give an estimate, so this is None."""
+        return None
+
+
+def _exported_model(config_fn, weights_fn, cache_dir=None):
+    """Get the path to the exported model, or the model itself.
+
+    Without a cache directory, the serialized model is returned.
+    """
+    from .onnx_export import build_onnx, export_onnx
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('TARGET_FINDER_CACHE_DIR')
+
+    if not cache_dir:
+        return build_onnx(config_fn, weights_fn).SerializeToString()
+
+    onnx_fn = os.path.join(cache_dir, '{:s}-{:s}.onnx'.format(
+        os.path.splitext(os.path.basename(config_fn))[0],
+        _model_hash(config_fn, weights_fn)))
+
+    if not os.path.isfile(onnx_fn):
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Written under another name first so other processes never
+        # load a half written file.
+        tmp_fn = '{:s}.{:d}.tmp'.format(onnx_fn, os.getpid())
+        export_onnx(config_fn, weights_fn, tmp_fn)
+        os.replace(tmp_fn, onnx_fn)
+
+    return onnx_fn
+
+
+def _model_hash(config_fn, weights_fn):
+    """Hash what an export depends on.
+
+    This is the exporter version, the config, and the weights' path,
+    size and modification time.
+    """
+    from .onnx_export import EXPORTER_VERSION
+
+    stat = os.stat(weights_fn)
+    digest = hashlib.sha1()
+    digest.update('exporter:{:d}\n'.format(EXPORTER_VERSION).encode())
+
+    with open(config_fn, 'rb') as f:
+        digest.update(f.read())
+
+    digest.update('{:s}:{:d}:{:d}'.format(
+        os.path.abspath(weights_fn), stat.st_size,
+        stat.st_mtime_ns).encode())
+
+    return digest.hexdigest()[:12]
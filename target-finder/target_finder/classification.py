@@ -1,90 +1,517 @@
 """Contains logic for finding targets in blobs."""
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import os
-from pkg_resources import resource_filename
+import threading
+import time
 
 import cv2
 import numpy as np
-import os
-import PIL.Image
-import sklearn.cluster
-import scipy.misc
 import target_finder_model as tfm
 
 from .darknet import Yolo3Detector, PreClassifier
-from .preprocessing import extract_crops, resize_all, extract_contour
-from .types import Color, Shape, Target, BBox
-from .color_cube import ColorCube
-
-# Default Models w/default weights
-models = {
-    'yolo3': Yolo3Detector(),
-    'clf': PreClassifier()
+from .image_source import ImageSource
+from .preprocessing import (crop_grid, extract_crops, extract_contour,
+                            scaled_tiles)
+from .metrics import timer
+from .types import Color, Shape, Target, BBox, BoxArray
+from .color_separation import separate_colors
+from .color_table import ColorTable
+
+# Default models w/default weights. These are only built the first
+# time they are needed since loading the weights is slow.
+_default_models = {
+    'yolo3': Yolo3Detector,
+    'clf': PreClassifier
 }
 
+models = {}
+_models_lock = threading.Lock()
+
+# Built the first time a color is named.
+_color_table = None
+_color_table_lock = threading.Lock()
+
 
 def set_models(new_models):
     models.update(new_models)
 
 
+def get_model(name):
+    """Get a model by name, loading the default one on first use."""
+    model = models.get(name)
+
+    if model is None:
+        with _models_lock:
+            model = models.get(name)
+
+            if model is None:
+                model = models[name] = _default_models[name]()
+
+    return model
+
+
+def _models_identity():
+    """Describe the models in use, so cached results follow them.
+
+    Darknet models give their files and backend (see
+    DarknetModel.identity), and other models set with set_models(...)
+    are told apart by their type and object.
+    """
+    identities = []
+
+    for name in sorted(_default_models):
+        model = get_model(name)
+        identity = getattr(model, 'identity', None)
+
+        if identity is None:
+            identity = '{:s}@{:x}'.format(type(model).__qualname__,
+                                          id(model))
+
+        identities.append('{:s}={:s}'.format(name, identity))
+
+    return ';'.join(identities)
+
+
+def preload():
+    """Load any default models and the color table if not loaded yet.
+
+    This is useful for long-running services which would rather pay
+    for loading the models at startup than on the first image.
+    """
+    for name in _default_models:
+        get_model(name)
+
+    _get_color_table()
+
+
 def find_targets(pil_image, **kwargs):
     """Wrapper for finding targets which accepts a PIL image"""
     image_ary = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
     return find_targets_from_array(image_ary, **kwargs)
 
 
-def find_targets_from_array(image_ary, limit=20):
+def find_targets_from_array(image_ary, limit=20, color_method='kmeans',
+                            segmentation=None, identify_workers=None,
+                            identify_executor=None, metrics=None,
+                            cache=None, target_images=True):
+    """Find targets in a BGR image.
+
+    Args:
+        image_ary (np.ndarray): The BGR image.
+        limit (int): The max number of targets to return.
+        target_images (Union[bool, str]): Whether to give the targets
+            images. With True, the target images are views of image_ary
+            until they are read, so they change if image_ary is reused
+            or drawn on before then. 'copy' copies the pixels first,
+            which is safe for reused frame buffers, and False skips the
+            target images.
+
+    The other arguments are passed on to _identify_properties(...).
+
+    Returns:
+        List[Target]: The targets found.
+    """
+    with timer(metrics, 'frame_seconds'):
+        raw_bboxes = _run_models(image_ary, metrics, cache)
+
+        targets = _finish_targets(raw_bboxes, image_ary, limit,
+                                  color_method=color_method,
+                                  segmentation=segmentation,
+                                  workers=identify_workers,
+                                  executor=identify_executor,
+                                  metrics=metrics,
+                                  target_images=target_images)
+
+    if metrics is not None:
+        metrics.inc('frames_total')
 
-    raw_bboxes = _run_models(image_ary)
-    targets = _bboxes_to_targets(raw_bboxes)
+    return targets
 
-    # Sorting with highest confidence first.
-    targets.sort(key=lambda t: t.confidence, reverse=True)
-    _identify_properties(targets, image_ary)
 
-    return targets[:limit]
+def find_targets_from_file(filename, limit=20, color_method='kmeans',
+                           segmentation=None, identify_workers=None,
+                           identify_executor=None, metrics=None,
+                           target_images=True):
+    """Find targets in an image file, decoding only what's needed.
+
+    The pre-classifier runs on the image decoded at a reduced size
+    (see ImageSource), and the full image is only decoded if it kept
+    any tiles. The arguments are the same as find_targets_from_array(...).
+    """
+    source = ImageSource(filename)
+
+    with timer(metrics, 'frame_seconds'):
+        raw_bboxes = _run_models_source(source, metrics)
+
+        # Any boxes mean the full image was already decoded (and timed)
+        # for the detector.
+        image = source.full() if raw_bboxes else None
+
+        targets = _finish_targets(raw_bboxes, image, limit,
+                                  color_method=color_method,
+                                  segmentation=segmentation,
+                                  workers=identify_workers,
+                                  executor=identify_executor,
+                                  metrics=metrics,
+                                  target_images=target_images)
+
+    if metrics is not None:
+        metrics.inc('frames_total')
+
+    source.release()
+
+    return targets
+
+
+def find_targets_batch(images, limit=20, batch_size=16,
+                       color_method='kmeans', segmentation=None,
+                       identify_workers=None, identify_executor=None,
+                       metrics=None, target_images=True):
+    """Find targets in several images with shared model passes.
+
+    The tiles of all the images go through the pre-classifier together,
+    and the ones kept are sent to the detector in batches of up to
+    batch_size, no matter which image they came from. This keeps the
+    detector busy when each image only has a few tiles with targets.
+
+    Args:
+        images (List[Union[np.ndarray, PIL.Image.Image]]): BGR arrays or
+            PIL images.
+        limit (int): The max number of targets to return per image.
+        batch_size (int): The max number of tiles per detector pass.
+        target_images (Union[bool, str]): Whether to give the targets
+            images, see find_targets_from_array(...).
+
+    The other arguments are the same as find_targets_from_array(...).
+
+    Returns:
+        List[List[Target]]: The targets for each image, in order.
+    """
+    images = [image if isinstance(image, np.ndarray) else
+              cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+              for image in images]
+
+    # Every tile remembers which image it came from.
+    with timer(metrics, 'stage_seconds', {'stage': 'tile'}):
+        owners, crops = [], []
+
+        for index, image in enumerate(images):
+            image_crops = extract_crops(image, tfm.CROP_SIZE,
+                                        tfm.CROP_OVERLAP)
+            owners.extend([index] * len(image_crops))
+            crops.extend(image_crops)
+
+    with timer(metrics, 'stage_seconds', {'stage': 'preclassify'}):
+        tiles = _batch_inputs(images, owners, crops, tfm.PRECLF_SIZE)
+        kept = [(owner, crop) for owner, crop, keep
+                in zip(owners, crops, _classify_tiles(tiles)) if keep]
+
+    if metrics is not None:
+        metrics.inc('tiles_total', len(crops))
+        metrics.inc('tiles_kept_total', len(kept))
+
+    raw_bboxes = [[] for _ in images]
+
+    with timer(metrics, 'stage_seconds', {'stage': 'detect'}):
+        for start in range(0, len(kept), batch_size):
+            batch_owners, batch_crops = zip(*kept[start:start + batch_size])
+            tiles = _batch_inputs(images, batch_owners, batch_crops,
+                                  tfm.DETECTOR_SIZE)
+
+            for owner, crop, bboxes in zip(batch_owners, batch_crops,
+                                           _detect_tiles(tiles)):
+                raw_bboxes[owner].extend(_normalize_bboxes(crop, bboxes))
+
+    if metrics is not None:
+        metrics.inc('raw_boxes_total', sum(map(len, raw_bboxes)))
+        metrics.inc('frames_total', len(images))
+
+    return [_finish_targets(image_bboxes, image, limit,
+                            color_method=color_method,
+                            segmentation=segmentation,
+                            workers=identify_workers,
+                            executor=identify_executor,
+                            metrics=metrics, target_images=target_images)
+            for image_bboxes, image in zip(raw_bboxes, images)]
+
+
+def _run_models(image, metrics=None, cache=None):
+
+    with timer(metrics, 'stage_seconds', {'stage': 'tile'}):
+        crops = extract_crops(image, tfm.CROP_SIZE, tfm.CROP_OVERLAP)
+
+    if cache is not None:
+        return _run_models_cached(image, crops, cache, metrics)
 
+    with timer(metrics, 'stage_seconds', {'stage': 'preclassify'}):
+        filtered_crops = _preclassify_crops(crops, metrics, image)
 
-def _run_models(image):
+    with timer(metrics, 'stage_seconds', {'stage': 'detect'}):
+        return _detect_bboxes(filtered_crops, metrics, image)
 
-    detector_model = models['yolo3']
-    clf_model = models['clf']
 
-    crops = extract_crops(image, tfm.CROP_SIZE, tfm.CROP_OVERLAP)
+def _run_models_cached(image, crops, cache, metrics=None):
+    """Run the models on the crops the tile cache doesn't know yet"""
 
-    clf_crops = resize_all(crops, tfm.PRECLF_SIZE)
+    models_identity = _models_identity()
+    keys = [cache.key(crop.image, models_identity) for crop in crops]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
 
-    regions = clf_model.classify_all([box.image for box in clf_crops])
+    with timer(metrics, 'stage_seconds', {'stage': 'preclassify'}):
+        keeps = _classify_crops([crops[i] for i in missing], image)
 
-    filtered_crops = [crops[i] for i, region in enumerate(regions)
-                      if region == 'shape_target']
+    kept = [i for i, keep in zip(missing, keeps) if keep]
 
-    detector_crops = resize_all(filtered_crops, tfm.DETECTOR_SIZE)
+    with timer(metrics, 'stage_seconds', {'stage': 'detect'}):
+        offset_bboxes = _detect_offset_bboxes([crops[i] for i in kept],
+                                              image)
+
+    for i in missing:
+        results[i] = (False, [])
+
+    for i, bboxes in zip(kept, offset_bboxes):
+        results[i] = (True, bboxes)
+
+    cache.put_many((keys[i],) + results[i] for i in missing)
+
+    normalized_bboxes = [box for crop, (_, bboxes) in zip(crops, results)
+                         for box in _normalize_bboxes(crop, bboxes)]
+
+    if metrics is not None:
+        metrics.inc('tiles_total', len(crops))
+        metrics.inc('tiles_kept_total', sum(keep for keep, _ in results))
+        metrics.inc('tile_cache_hits_total', len(crops) - len(missing))
+        metrics.inc('raw_boxes_total', len(normalized_bboxes))
+
+    return normalized_bboxes
+
+
+def _run_models_source(source, metrics=None):
+    """Run the models on an ImageSource, pre-classifying a reduced decode"""
+
+    with timer(metrics, 'stage_seconds', {'stage': 'tile'}):
+        crops = crop_grid(source.shape, tfm.CROP_SIZE, tfm.CROP_OVERLAP)
+
+    with timer(metrics, 'stage_seconds', {'stage': 'decode'}):
+        preview, preview_scale = source.reduced(
+            min(tfm.PRECLF_SIZE[0] / tfm.CROP_SIZE[0],
+                tfm.PRECLF_SIZE[1] / tfm.CROP_SIZE[1]))
+
+    with timer(metrics, 'stage_seconds', {'stage': 'preclassify'}):
+        tiles = scaled_tiles(preview, crops, tfm.PRECLF_SIZE, preview_scale)
+        kept = [crop for crop, keep in zip(crops, _classify_tiles(tiles))
+                if keep]
+
+    if metrics is not None:
+        metrics.inc('tiles_total', len(crops))
+        metrics.inc('tiles_kept_total', len(kept))
+
+    # Nothing worth detecting, so the full image is never decoded.
+    if not kept:
+        return []
+
+    with timer(metrics, 'stage_seconds', {'stage': 'decode'}):
+        image = source.full()
+
+    with timer(metrics, 'stage_seconds', {'stage': 'detect'}):
+        return _detect_bboxes(kept, metrics, image)
+
+
+def _preclassify_crops(crops, metrics=None, image=None):
+    """Keep only the crops the pre-classifier thinks have targets"""
+
+    keeps = _classify_crops(crops, image)
+
+    if isinstance(crops, BoxArray):
+        kept = crops[np.array(keeps, dtype=bool)]
+    else:
+        kept = [crop for crop, keep in zip(crops, keeps) if keep]
+
+    if metrics is not None:
+        metrics.inc('tiles_total', len(crops))
+        metrics.inc('tiles_kept_total', len(kept))
+
+    return kept
+
+
+def _classify_crops(crops, image=None):
+    """Check which crops the pre-classifier thinks have targets"""
+
+    return _classify_tiles(_crop_inputs(crops, image, tfm.PRECLF_SIZE))
+
+
+def _classify_tiles(tiles):
+    """Check which pre-classifier inputs have targets"""
+
+    clf_model = get_model('clf')
+
+    regions = clf_model.classify_all(tiles)
+
+    return [region == 'shape_target' for region in regions]
+
+
+def _detect_bboxes(crops, metrics=None, image=None):
+    """Run the detector on crops and get boxes on the full image"""
+
+    normalized_bboxes = _normalize_box_array(
+        crops, _detect_offset_bboxes(crops, image))
+
+    if metrics is not None:
+        metrics.inc('raw_boxes_total', len(normalized_bboxes))
+
+    return normalized_bboxes
+
+
+def _detect_offset_bboxes(crops, image=None):
+    """Get the raw detector boxes for each crop"""
+
+    return _detect_tiles(_crop_inputs(crops, image, tfm.DETECTOR_SIZE))
+
+
+def _detect_tiles(tiles):
+    """Get the raw detector boxes for each detector input"""
+
+    if len(tiles) == 0:
+        return []
+
+    detector_model = get_model('yolo3')
 
     try:
-        offset_bboxes = detector_model.detect_all([box.image
-                                                   for box in detector_crops])
+        offset_bboxes = detector_model.detect_all(tiles)
     except IndexError:
         print('Error processing Darknet output...assuming no shapes detected.')
-        offset_bboxes = []
+        offset_bboxes = [[] for _ in tiles]
+
+    return offset_bboxes
+
+
+def _crop_inputs(crops, image, size):
+    """Get the model inputs for crops
+
+    With the image the crops are from, the inputs are sliced from
+    scaled views of it (see scaled_tiles(...)). Otherwise the models
+    resize each crop's image.
+    """
+
+    if image is None:
+        return [box.image for box in crops]
+
+    return scaled_tiles(image, crops, size)
+
+
+def _batch_inputs(images, owners, crops, size):
+    """Get the model inputs for crops from several images"""
+
+    by_owner = {}
+    for i, owner in enumerate(owners):
+        by_owner.setdefault(owner, []).append(i)
+
+    tiles = [None] * len(crops)
+
+    for owner, idxs in by_owner.items():
+        owner_tiles = scaled_tiles(images[owner], [crops[i] for i in idxs],
+                                   size)
+
+        for i, tile in zip(idxs, owner_tiles):
+            tiles[i] = tile
+
+    return tiles
+
+
+def _normalize_box_array(crops, offset_bboxes):
+    """Move the raw detector boxes for each crop onto the full image
+
+    This is the same as _normalize_bboxes(...) for every crop, but the
+    boxes are kept in a BoxArray.
+    """
+
+    detections = [detection for bboxes in offset_bboxes
+                  for detection in bboxes]
+
+    if not detections:
+        return BoxArray()
+
+    if isinstance(crops, BoxArray):
+        corners = crops.coords[:, :2]
+    else:
+        corners = np.array([(crop.x1, crop.y1) for crop in crops])
+
+    ratio = tfm.DETECTOR_SIZE[0] / tfm.CROP_SIZE[0]
+
+    raw = np.array([bbox for _, _, bbox in detections],
+                   dtype=np.float64).reshape(-1, 4) / ratio
+    starts = raw[:, :2] + np.repeat(corners, [len(bboxes) for bboxes
+                                              in offset_bboxes], axis=0)
+
+    return BoxArray(np.hstack([starts, starts + raw[:, 2:]]),
+                    [conf for _, conf, _ in detections],
+                    [{name: conf} for name, conf, _ in detections])
+
+
+def _normalize_bboxes(crop, bboxes):
+    """Move the raw detector boxes for a crop onto the full image"""
 
     ratio = tfm.DETECTOR_SIZE[0] / tfm.CROP_SIZE[0]
     normalized_bboxes = []
 
-    for crop, bboxes in zip(detector_crops, offset_bboxes):
-        for name, conf, bbox in bboxes:
-            bw = bbox[2] / ratio
-            bh = bbox[3] / ratio
-            bx = (bbox[0] / ratio) + crop.x1
-            by = (bbox[1] / ratio) + crop.y1
-            box = BBox(bx, by, bx + bw, by + bh)
-            box.meta = {name: conf}
-            box.confidence = conf
-            normalized_bboxes.append(box)
+    for name, conf, bbox in bboxes:
+        bw = bbox[2] / ratio
+        bh = bbox[3] / ratio
+        bx = (bbox[0] / ratio) + crop.x1
+        by = (bbox[1] / ratio) + crop.y1
+        box = BBox(bx, by, bx + bw, by + bh)
+        box.meta = {name: conf}
+        box.confidence = conf
+        normalized_bboxes.append(box)
 
     return normalized_bboxes
 
 
+def _finish_targets(raw_bboxes, image, limit, metrics=None, **kwargs):
+    """Turn the detector boxes into fully identified targets
+
+    Keyword arguments are passed on to _identify_properties(...).
+    """
+
+    with timer(metrics, 'stage_seconds', {'stage': 'merge'}):
+        targets = _bboxes_to_targets(raw_bboxes)
+
+    # Sorting with highest confidence first, only the targets being
+    # returned need their properties.
+    targets.sort(key=lambda t: t.confidence, reverse=True)
+
+    if metrics is not None:
+        metrics.inc('merged_boxes_total', len(targets))
+
+    targets = targets[:limit]
+
+    if metrics is None:
+        _identify_properties(targets, image, **kwargs)
+    else:
+        stats = []
+
+        with metrics.time('stage_seconds', {'stage': 'identify'}):
+            _identify_properties(targets, image, stats=stats, **kwargs)
+
+        _record_target_stats(metrics, stats)
+
+    return targets
+
+
+def _record_target_stats(metrics, stats):
+    """Add the time each target took to the metrics"""
+
+    for target_stats in stats:
+        for step, key in (('grabcut', 'grabcut_time'),
+                          ('cluster', 'cluster_time'), ('total', 'time')):
+            if key in target_stats:
+                metrics.observe('target_seconds', target_stats[key],
+                                {'step': step})
+
+
 def _bboxes_to_targets(bboxes):
     """Produce targets from bounding boxes"""
 
@@ -124,18 +551,123 @@ def _get_shape_and_alpha(box):
 
 
 def _merge_boxes(boxes):
+    """Merge groups of overlapping boxes into single boxes.
+
+    Overlapping boxes are found with a vectorized sweep-line on a
+    BoxArray and joined with a union-find, so chains of boxes are
+    merged completely regardless of the order the detector returned
+    them in. Only boxes which overlap each other are joined: a box
+    inside a group's merged bounds which touches none of its boxes
+    stays on its own, so the merged boxes can overlap.
+
+    Each merged box is the first box of its group (in input order),
+    enlarged to cover the group, with the meta of the others added in
+    input order.
+
+    Args:
+        boxes (Union[BoxArray, List[BBox]]): The boxes to merge.
+
+    Returns:
+        List[BBox]: The merged boxes.
+    """
+    array = boxes if isinstance(boxes, BoxArray) else \
+        BoxArray.from_boxes(boxes)
+
+    if len(array) == 0:
+        return []
+
+    # The group each box is in, numbered from 0.
+    labels = _overlapping_components(array)
+    _, group_of = np.unique(labels, return_inverse=True)
+
+    num_groups = group_of.max() + 1
+    bounds = _group_bounds(array.coords, group_of, num_groups)
+
+    # The boxes of each group in input order, with the groups in the
+    # order of their first box.
+    order = np.argsort(group_of, kind='stable')
+    members = np.split(order, np.cumsum(np.bincount(group_of))[:-1])
+    members.sort(key=lambda group: group[0])
+
     merged = []
-    for box in boxes:
-        for merged_box in merged:
-            if _intersect(box, merged_box):
-                _enlarge(merged_box, box)
-                merged_box.meta.update(box.meta)
-                break
-        else:
-            merged.append(box)
+
+    for group in members:
+        group = group.tolist()
+        main_box = boxes[group[0]]
+
+        bbox = bounds[group_of[group[0]]].tolist()
+        main_box.x1, main_box.y1, main_box.x2, main_box.y2 = bbox
+
+        if array.meta is not None:
+            for i in group[1:]:
+                if array.meta[i] is not None:
+                    main_box.meta.update(array.meta[i])
+
+        merged.append(main_box)
+
     return merged
 
 
+def _group_bounds(coords, group_of, num_groups):
+    """Get a box covering the boxes in each group"""
+    # Starting from a box in each group, then growing it to the others.
+    bounds = np.empty((num_groups, 4), dtype=coords.dtype)
+    bounds[group_of] = coords
+
+    np.minimum.at(bounds[:, 0], group_of, coords[:, 0])
+    np.minimum.at(bounds[:, 1], group_of, coords[:, 1])
+    np.maximum.at(bounds[:, 2], group_of, coords[:, 2])
+    np.maximum.at(bounds[:, 3], group_of, coords[:, 3])
+
+    return bounds
+
+
+def _overlapping_components(boxes):
+    """Label each box with the connected group of boxes it overlaps
+
+    The intersecting pairs are joined a chunk at a time, so they never
+    all need to be kept. Most pairs on a busy frame are in a group
+    which is already joined, so only the rest go through the union-find.
+
+    Returns:
+        np.ndarray: The group label for each box, which is the lowest
+            index of a box in the group.
+    """
+    parent = np.arange(len(boxes))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i, j in boxes.iter_intersecting_pairs():
+        root_i, root_j = parent[i], parent[j]
+        apart = root_i != root_j
+
+        if not apart.any():
+            continue
+
+        edges = np.unique(np.stack([root_i[apart], root_j[apart]], axis=1),
+                          axis=0)
+
+        for a, b in edges.tolist():
+            root_a, root_b = find(a), find(b)
+
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        # Pointing every box straight at its root again.
+        while True:
+            roots = parent[parent]
+
+            if np.array_equal(roots, parent):
+                break
+
+            parent = roots
+
+    return parent
+
+
 def _intersect(box1, box2):
     # no intersection along x-axis
     if (box1.x1 > box2.x2 or box2.x1 > box1.x2):
@@ -148,41 +680,103 @@ def _intersect(box1, box2):
     return True
 
 
-def _enlarge(main_box, new_box):
-    main_box.x1 = min(main_box.x1, new_box.x1)
-    main_box.x2 = max(main_box.x2, new_box.x2)
-    main_box.y1 = min(main_box.y1, new_box.y1)
-    main_box.y2 = max(main_box.y2, new_box.y2)
+def _identify_properties(targets, full_image, padding=15,
+                         color_method='kmeans', segmentation=None,
+                         stats=None, workers=None, executor=None,
+                         target_images=True):
+    """Fill in the image and colors of each target.
+
+    Targets are independent of each other, so they can be identified
+    in parallel. Either way they are filled in the order given.
+
+    If a list is given as stats, a dict with the GrabCut stats (see
+    extract_contour(...)), the color clustering 'cluster_time' and the
+    total 'time' is appended for each target.
+
+    Args:
+        workers (int): The number of threads to use when no executor is
+            given. Defaults to one per target up to the number of CPUs.
+        executor (concurrent.futures.Executor): An optional thread or
+            process pool to identify the targets in.
+        target_images (Union[bool, str]): Whether to give the targets
+            images. The images are views of the frame until they are
+            read (see Target.set_image_view(...)), or of a copy of the
+            pixels with 'copy'.
+    """
+    if target_images not in (True, False, 'copy'):
+        raise ValueError('target_images must be True, False or \'copy\'')
+
+    blobs = [_crop_target(target, full_image, padding) for target in targets]
+    identify = functools.partial(_identify_blob, color_method=color_method,
+                                 segmentation=segmentation)
+
+    if executor is None:
+        if workers is None:
+            workers = min(len(targets), os.cpu_count() or 1)
+
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(identify, blobs))
+        else:
+            results = [identify(blob) for blob in blobs]
+    else:
+        results = list(executor.map(identify, blobs))
+
+    for target, blob, (colors, target_stats) in zip(targets, blobs, results):
+        target.background_color, target.alphanumeric_color = colors
+
+        # The PIL image is only made if the target image is read.
+        if target_images == 'copy':
+            target.set_image_view(blob.copy())
+        elif target_images:
+            target.set_image_view(blob)
+
+        if stats is not None:
+            stats.append(target_stats)
+
 
+def _crop_target(target, full_image, padding):
+    """Get the padded crop around a target"""
 
-def _identify_properties(targets, full_image, padding=15):
+    x = int(target.x) - padding
+    y = int(target.y) - padding
+    w = int(target.width) + padding * 2
+    h = int(target.height) + padding * 2
 
-    for target in targets:
+    return full_image[y:y + h, x:x + w]
 
-        x = int(target.x) - padding
-        y = int(target.y) - padding
-        w = int(target.width) + padding * 2
-        h = int(target.height) + padding * 2
-        blob_image = full_image[y:y + h, x:x + w]
 
-        img = PIL.Image.fromarray(cv2.cvtColor(blob_image, cv2.COLOR_BGR2RGB))
-        target.image = img
+def _identify_blob(blob_image, color_method='kmeans', segmentation=None):
+    """Get the colors and stats for a target's crop
+
+    This is a module level function so it can run in a process pool.
+    """
+    start = time.perf_counter()
+    target_stats = {}
+
+    try:
+        colors = _get_colors(blob_image, color_method, segmentation,
+                             target_stats)
+    except cv2.error:
+        colors = (Color.NONE, Color.NONE)
 
-        try:
-            target_color, alpha_color = _get_colors(blob_image)
-            target.background_color = target_color
-            target.alphanumeric_color = alpha_color
-        except cv2.error:
-            target.background_color = Color.NONE
-            target.alphanumeric_color = Color.NONE
+    target_stats['time'] = time.perf_counter() - start
 
+    return colors, target_stats
 
-def _get_colors(image):
+
+def _get_colors(image, color_method='kmeans', segmentation=None,
+                stats=None):
     """Find the primary and seconday colors of the the blob"""
 
-    contour = extract_contour(image)
+    contour = extract_contour(image, segmentation, stats)
+
+    start = time.perf_counter()
+    (color_a, count_a), (color_b, count_b) = _find_main_colors(image, contour,
+                                                               color_method)
 
-    (color_a, count_a), (color_b, count_b) = _find_main_colors(image, contour)
+    if stats is not None:
+        stats['cluster_time'] = time.perf_counter() - start
 
     # this assumes the shape will have more pixels than alphanum
     if count_a > count_b:
@@ -190,14 +784,17 @@ def _get_colors(image):
     else:
         primary, secondary = color_b, color_a
 
-    primary_color = _get_color_name(primary)
-    secondary_color = _get_color_name(secondary)
+    primary_color, secondary_color = _get_color_names([primary, secondary])
 
     return primary_color, secondary_color
 
 
-def _find_main_colors(image, contour):
-    """Find the two main colors of the blob"""
+def _find_main_colors(image, contour, color_method='kmeans',
+                      max_pixels=None):
+    """Find the two main colors of the blob
+
+    See color_separation.separate_colors(...) for the color methods.
+    """
     mask_img = np.array(image)  # the image w/the mask applied
 
     mask = np.zeros(mask_img.shape[:2], dtype='uint8')  # the mask itself
@@ -210,77 +807,38 @@ def _find_main_colors(image, contour):
 
     # extract colors from region within mask
     mask_x, mask_y = np.nonzero(mask)
-    valid_colors = masked_image[mask_x, mask_y].astype(np.float)
+    valid_colors = masked_image[mask_x, mask_y]
 
     # Get the two average colors
-    algo = sklearn.cluster.AgglomerativeClustering(n_clusters=2)
-    algo.fit(valid_colors)
-    colors = algo.labels_
-    all_a = valid_colors[colors == 1]
-    all_b = valid_colors[colors == 0]
+    return separate_colors(valid_colors, method=color_method,
+                           max_pixels=max_pixels)
 
-    # extract colors from prediction
-    color_a = np.mean(all_a, axis=0)
-    count_a = all_a.shape[0]
-    color_b = np.mean(all_b, axis=0)
-    count_b = all_b.shape[0]
 
-    return (color_a, count_a), (color_b, count_b)
+def _get_color_name(requested_color):
+    """Name an RGB color with the color lookup table"""
+    return _get_color_names([requested_color])[0]
 
 
-def _get_color_name(requested_color):
+def _get_color_names(requested_colors):
+    """Name an (N, 3) array of RGB colors at once
 
-    # ColorCube((Hl, sl, vl), (Hu, Su, Vu))
-    color_cubes = {
-        "white": ColorCube((0, 0, 85), (359, 20, 100)),
-        "black": ColorCube((0, 0, 0), (359, 100, 25)),
-        "gray": ColorCube((0, 0, 25), (359, 5, 75)),
-        "blue": ColorCube((180, 70, 70), (345, 100, 100)),
-        "red": ColorCube((350, 70, 70), (359, 100, 65)),
-        "green": ColorCube((100, 60, 30), (160, 100, 100)),
-        "yellow": ColorCube((60, 50, 55), (75, 100, 100)),
-        "purple": ColorCube((230, 40, 55), (280, 100, 100)),
-        "brown": ColorCube((300, 38, 20), (359, 100, 40)),
-        "orange": ColorCube((15, 70, 75), (45, 100, 100))
-    }
-
-    r = requested_color[0] / 255
-    g = requested_color[1] / 255
-    b = requested_color[2] / 255
-
-    c_max = max(r, g, b)
-    c_min = min(r, g, b)
-    delta = c_max - c_min
-
-    h = 0
-    s = 0
-    v = 0
-    if delta == 0:
-        h = 0
-    elif c_max == r:
-        h = 60 * (((g - b) / delta) % 6)
-    elif c_max == g:
-        h = 60 * (((b - r) / delta) + 2)
-    elif c_max == b:
-        h = 60 * (((r - g) / delta) + 4)
-
-    if c_max == 0:
-        s = 0
-    else:
-        s = delta / c_max
-    v = c_max * 100
-    s *= 100
-
-    contains = [color_cubes[key].contains((h, s, v)) for key in color_cubes]
-    if not any(contains):
-        cl_dists = [color_cubes[key].get_closest_distance((h, s, v))
-                    for key in color_cubes]
-        dist = [np.sqrt((p[0] * p[0]) + (p[1] * p[1]) + (p[2] * p[2]))
-                for p in cl_dists]
-        index = dist.index(min(dist)) + 1
-        return Color(index)
-    else:
-        index = contains.index(True) + 1
-        return Color(index)
+    The colors are rounded to integer RGB first, since the mean colors
+    found for a target are floats and the color table only covers
+    integer colors.
+    """
+    colors = np.asarray(requested_colors, dtype=np.float64).reshape(-1, 3)
+    colors = np.clip(np.rint(colors), 0, 255)
+
+    return [Color(value) for value in _get_color_table().lookup(colors)]
+
+
+def _get_color_table():
+    """Get the color lookup table, building it on first use"""
+    global _color_table
+
+    if _color_table is None:
+        with _color_table_lock:
+            if _color_table is None:
+                _color_table = ColorTable()
 
-    return Color.NONE
+    return _color_table
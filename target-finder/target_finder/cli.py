@@ -1,14 +1,22 @@
 """Contains functions for cli subcommands."""
 
 import argparse
-import json
+import functools
+import multiprocessing
 import os
 import sys
-import cv2
+import time
 
+import cv2
+import numpy as np
 import target_finder_model as tfm
 
-from .classification import find_targets
+from .backends import BACKEND_ENV, BACKENDS
+from .classification import (find_targets_from_array,
+                             find_targets_from_file, preload)
+from .darknet import PreClassifier, Yolo3Detector
+from .output import ARCHIVE_FORMATS, OUTPUT_FORMATS, TargetWriter
+from .tile_cache import TileCache
 from .version import __version__
 
 
@@ -32,6 +40,90 @@ target_parser.add_argument('--min-confidence', type=float, action='store',
 target_parser.add_argument('--limit', type=int, dest='limit', action='store',
                            default=10, help='max number of targets to find '
                                             'per image (default: 10)')
+target_parser.add_argument('--workers', type=int, dest='workers',
+                           action='store', default=1,
+                           help='number of processes used to find targets '
+                                '(default: 1)')
+target_parser.add_argument('--tile-cache', type=str, dest='tile_cache',
+                           action='store', default=None,
+                           help='database file to cache model results for '
+                                'tiles in, so repeat runs skip known tiles')
+target_parser.add_argument('--output-format', type=str, dest='output_format',
+                           action='store', choices=OUTPUT_FORMATS,
+                           default='files',
+                           help='save the metadata in a json file per '
+                                'target, or in one targets.jsonl or '
+                                'targets.npz (default: files)')
+target_parser.add_argument('--archive', type=str, dest='archive',
+                           action='store', choices=ARCHIVE_FORMATS,
+                           default=None,
+                           help='pack the target images into one '
+                                'targets.tar or targets.zip')
+target_parser.add_argument('--writers', type=int, dest='writers',
+                           action='store', default=4,
+                           help='number of threads saving targets '
+                                '(default: 4)')
+target_parser.add_argument('--backend', type=str, dest='backend',
+                           action='store', choices=BACKENDS, default=None,
+                           help='inference backend for the models '
+                                '(default: ${:s} or opencv)'
+                                .format(BACKEND_ENV))
+
+# Parser for the serve subcommand.
+serve_parser = subparsers.add_parser('serve', help='serves target finding '
+                                                   'over HTTP')
+serve_parser.add_argument('--host', type=str, action='store',
+                          default='127.0.0.1', help='address to listen on '
+                                                    '(default: 127.0.0.1)')
+serve_parser.add_argument('--port', type=int, action='store', default=8080,
+                          help='port to listen on (default: 8080)')
+serve_parser.add_argument('--socket', type=str, action='store', default=None,
+                          help='unix socket to listen on instead of a port')
+serve_parser.add_argument('--limit', type=int, dest='limit', action='store',
+                          default=10, help='max number of targets to find '
+                                           'per image (default: 10)')
+serve_parser.add_argument('--batch-size', type=int, dest='batch_size',
+                          action='store', default=8,
+                          help='max number of images per model batch '
+                               '(default: 8)')
+serve_parser.add_argument('--max-delay', type=float, dest='max_delay',
+                          action='store', default=0.01,
+                          help='max seconds to wait for a batch to fill '
+                               '(default: 0.01)')
+serve_parser.add_argument('--backend', type=str, dest='backend',
+                          action='store', choices=BACKENDS, default=None,
+                          help='inference backend for the models '
+                               '(default: ${:s} or opencv)'
+                               .format(BACKEND_ENV))
+
+# Parser for the benchmark subcommand.
+benchmark_parser = subparsers.add_parser('benchmark', help='compares the '
+                                                           'speed of the '
+                                                           'inference '
+                                                           'backends')
+benchmark_parser.add_argument('--backends', type=str, nargs='+',
+                              choices=BACKENDS, default=['opencv',
+                                                         'onnxruntime'],
+                              help='backends to compare (default: opencv '
+                                   'onnxruntime)')
+benchmark_parser.add_argument('--model', type=str, action='store',
+                              choices=('detector', 'preclassifier'),
+                              nargs='+',
+                              default=['detector', 'preclassifier'],
+                              help='models to run (default: both)')
+benchmark_parser.add_argument('--images', type=int, action='store',
+                              default=16, help='number of tiles per run '
+                                               '(default: 16)')
+benchmark_parser.add_argument('--repeat', type=int, action='store',
+                              default=3, help='number of timed runs, the '
+                                              'fastest is reported '
+                                              '(default: 3)')
+benchmark_parser.add_argument('--seed', type=int, action='store', default=0,
+                              help='seed for the random tiles (default: 0)')
+
+
+# The tile cache used by this process, if any.
+_tile_cache = None
 
 
 def run(args=None):
@@ -53,37 +145,177 @@ def print_version():
         model_version = '0.1.0'
 
     print(f'target-finder v{__version__} with target-finder-model '
-          f'v{model_version} (tensorflow v{tf.__version__})')
+          f'v{model_version} (opencv v{cv2.__version__})')
 
 
 def run_targets(args):
     """Run the targets subcommand."""
-    target_num = 0
+    _use_backend(args.backend)
 
     # Create the output directory if it doesn't already exist.
     os.makedirs(args.output, exist_ok=True)
 
-    for filename in _list_images(args.filename):
+    filenames = _list_images(args.filename)
+
+    # Each worker process gets its share of the cores for identifying
+    # targets, otherwise every process would start a thread per core.
+    identify_workers = None
+    if args.workers > 1:
+        identify_workers = _threads_per_worker(args.workers)
+
+    find = functools.partial(_find_file_targets, limit=args.limit,
+                             identify_workers=identify_workers)
+
+    writer = TargetWriter(args.output, output_format=args.output_format,
+                          archive=args.archive, workers=args.writers)
+
+    # Results come back in the same order as the filenames so the
+    # target numbering doesn't depend on which worker is faster.
+    with writer:
+        if args.workers > 1:
+            with _create_pool(args.workers, args.tile_cache) as pool:
+                _save_targets(writer, filenames, pool.imap(find, filenames))
+        else:
+            _init_cache(args.tile_cache)
+            _save_targets(writer, filenames, map(find, filenames))
+
+
+def run_serve(args):
+    """Run the serve subcommand."""
+    # Imported here so the other subcommands don't load asyncio.
+    from .server import TargetServer
+
+    _use_backend(args.backend)
+
+    server = TargetServer(limit=args.limit, batch_size=args.batch_size,
+                          max_delay=args.max_delay)
+    server.run(args.host, args.port, args.socket)
+
+
+def run_benchmark(args):
+    """Run the benchmark subcommand."""
+    print('{:<20s} {:<14s} {:>8s} {:>12s}'.format('backend', 'model',
+                                                  'load (s)', 'images/sec'))
+
+    for model_name in args.model:
+        tiles = _benchmark_tiles(model_name, args.images, args.seed)
+
+        for backend in args.backends:
+            try:
+                load_time, rate = _benchmark_backend(
+                    model_name, backend, tiles, args.repeat)
+            except (ImportError, ValueError, cv2.error) as e:
+                print('{:<20s} {:<14s} unavailable: {:s}'.format(
+                    backend, model_name, str(e).strip().splitlines()[0]))
+                continue
+
+            print('{:<20s} {:<14s} {:>8.2f} {:>12.1f}'.format(
+                backend, model_name, load_time, rate))
+
+
+def _benchmark_tiles(model_name, count, seed):
+    """Make random BGR tiles the size each model is given."""
+    if model_name == 'detector':
+        width, height = tfm.CROP_SIZE
+    else:
+        width, height = tfm.PRECLF_SIZE
+
+    random = np.random.RandomState(seed)
+
+    return [random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+            for _ in range(count)]
+
 
-        image = cv2.imread(filename)
+def _benchmark_backend(model_name, backend, tiles, repeat):
+    """Time loading a model on a backend and running the tiles.
 
-        targets = find_targets_from_array(image, limit=args.limit)
+    Returns:
+        Tuple[float, float]: The seconds it took to load the model, and
+            the images per second of the fastest run.
+    """
+    start = time.perf_counter()
 
+    if model_name == 'detector':
+        model = Yolo3Detector(backend=backend)
+        run_model = model.detect_all
+    else:
+        model = PreClassifier(backend=backend)
+        run_model = model.classify_all
+
+    load_time = time.perf_counter() - start
+
+    # The first pass sets up buffers, so it isn't counted.
+    run_model(tiles[:1])
+    best = None
+
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        run_model(tiles)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return load_time, len(tiles) / best
+
+
+def _use_backend(backend):
+    """Use a backend for the models in this and any worker process."""
+    if backend is not None:
+        os.environ[BACKEND_ENV] = backend
+
+
+def _save_targets(writer, filenames, results):
+    """Save the targets found for each image."""
+    for filename, targets in zip(filenames, results):
         # Save each target found with an incrementing number.
         for target in targets:
-            print('Saving target #{:06d} from {:s}'.format(target_num,
+            print('Saving target #{:06d} from {:s}'.format(writer.count,
                                                            filename))
+            writer.write(filename, target)
+
 
-            basename_image = 'target-{:06d}.jpg'.format(target_num)
-            basename_meta = 'target-{:06d}.json'.format(target_num)
+def _find_file_targets(filename, limit, identify_workers=None):
+    """Read an image and find the targets in it."""
+    # The tile cache is keyed on the full resolution tiles, otherwise
+    # the image is only decoded in full if it might have targets.
+    if _tile_cache is None:
+        return find_targets_from_file(filename, limit=limit,
+                                      identify_workers=identify_workers)
 
-            filename_image = os.path.join(args.output, basename_image)
-            filename_meta = os.path.join(args.output, basename_meta)
+    image = cv2.imread(filename)
 
-            target.image.save(filename_image)
-            _save_target_meta(filename_meta, filename, target)
+    return find_targets_from_array(image, limit=limit,
+                                   identify_workers=identify_workers,
+                                   cache=_tile_cache)
 
-            target_num += 1
+
+def _create_pool(workers, tile_cache=None):
+    """Create a process pool with the models loaded in each worker."""
+    return multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(_threads_per_worker(workers),
+                                          tile_cache))
+
+
+def _threads_per_worker(workers):
+    """Get the number of threads each worker process should use."""
+    # Splitting the cores between the workers so they don't
+    # oversubscribe the machine.
+    return max(1, multiprocessing.cpu_count() // workers)
+
+
+def _init_worker(num_threads, tile_cache=None):
+    """Set up a worker process so each image doesn't pay for it."""
+    cv2.setNumThreads(num_threads)
+    preload()
+    _init_cache(tile_cache)
+
+
+def _init_cache(path):
+    """Open the tile cache for this process if one is used."""
+    global _tile_cache
+
+    if path is not None:
+        _tile_cache = TileCache(path=path)
 
 
 def _list_images(filenames):
@@ -98,7 +330,7 @@ def _list_images(filenames):
         # If this is a directory, add the files ending with .jpg or
         # .jpeg (case-insensitive) to the list.
         elif os.path.isdir(filename):
-            for inner_filename in os.listdir(filename):
+            for inner_filename in sorted(os.listdir(filename)):
                 if inner_filename.lower().endswith('.jpg') or \
                         inner_filename.lower().endswith('.jpeg'):
                     images.append(os.path.join(filename, inner_filename))
@@ -116,27 +348,9 @@ def _list_images(filenames):
     return images
 
 
-def _save_target_meta(filename_meta, filename_image, target):
-    """Save target metadata to a file."""
-    with open(filename_meta, 'w') as f:
-        meta = {
-            'x': target.x,
-            'y': target.y,
-            'width': target.width,
-            'height': target.height,
-            'orientation': target.orientation,
-            'shape': target.shape.name.lower(),
-            'background_color': target.background_color.name.lower(),
-            'alphanumeric': target.alphanumeric,
-            'alphanumeric_color': target.alphanumeric_color.name.lower(),
-            'image': filename_image,
-            'confidence': target.confidence
-        }
-
-        json.dump(meta, f, indent=2)
-
-
 # Set the functions to run for each subcommand. If a subcommand was
 # not provided, print the usage message and set the exit code to 1.
 target_parser.set_defaults(func=run_targets)
+serve_parser.set_defaults(func=run_serve)
+benchmark_parser.set_defaults(func=run_benchmark)
 parser.set_defaults(func=lambda _: parser.print_usage() or sys.exit(1))
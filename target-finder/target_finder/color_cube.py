@@ -1,5 +1,7 @@
 from math import sqrt
 
+import numpy as np
+
 
 class ColorCube:
 
@@ -50,89 +52,115 @@ class ColorCube:
                     (point1[2] - point2[2])**2)
 
     def get_closest_distance(self, color):
-        closestDistance = 385.851
-        closestPoint = (0, 0, 0)
-        hS = self.hStart
-        hE = self.hEnd
-        sS = self.sStart
-        sE = self.sEnd
-        vS = self.vStart
-        vE = self.vEnd
-        for h in range(hS, hE + 1):
-            s, v = sE, vS
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            s, v = sS, vS
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            s, v = sS, vE
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            s, v = sE, vE
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-        for s in range(sS, sE + 1):
-
-            h, v = hS, vS
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            h, v = hE, vS
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            h, v = hS, vE
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            h, v = hE, vE
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-        for v in range(vS, vE + 1):
-
-            h, s = hS, sS
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            h, s = hS, sE
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            h, s = hE, sS
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-            h, s = hE, sE
-            currentDistance = self.get_distance((h, s, v), color)
-            if (currentDistance < closestDistance):
-                closestDistance = currentDistance
-                closestPoint = (h, s, v)
-
-        return closestPoint
+        return tuple(self.get_closest_points([color])[0])
+
+    def get_closest_points(self, colors, wrap_hue=False):
+        """Find the closest points on the edges of the cube.
+
+        The closest integer point on each of the 12 edges is found by
+        rounding and clamping instead of walking along the edge. Ties
+        go to the point the edge walk (hue edges, then saturation, then
+        value edges, each in increasing order) would have reached
+        first, so this returns the same points as the walk did.
+
+        Args:
+            colors (np.ndarray): An (N, 3) array of HSV colors.
+            wrap_hue (bool): Whether hue distances wrap around at 360.
+                This is off by default to match the edge walk.
+
+        Returns:
+            np.ndarray: An (N, 3) array of the closest points.
+        """
+        colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+
+        starts = np.array([self.hStart, self.sStart, self.vStart], float)
+        ends = np.array([self.hEnd, self.sEnd, self.vEnd], float)
+
+        dists = []
+        points = []
+        keys = []
+
+        for order, (axis, corners) in enumerate(_EDGES):
+            for corner_idx, corner in enumerate(corners):
+                point = np.tile(np.where(corner, ends, starts),
+                                (len(colors), 1))
+
+                t, dist = _closest_on_edge(point, colors, axis,
+                                           starts[axis], ends[axis],
+                                           wrap_hue)
+                point[:, axis] = t
+
+                dists.append(dist)
+                points.append(point)
+                keys.append(order * 10000 + t * 4 + corner_idx)
+
+        dists = np.stack(dists, axis=1)
+        points = np.stack(points, axis=1)
+        keys = np.stack(keys, axis=1)
+
+        # Take the first point the walk reaches at the smallest distance.
+        min_dists = dists.min(axis=1)
+        keys = np.where(dists == min_dists[:, np.newaxis], keys, np.inf)
+        closest = points[np.arange(len(colors)), np.argmin(keys, axis=1)]
+
+        # The walk only takes points closer than its starting distance.
+        closest[min_dists >= _START_DISTANCE] = 0
+
+        return closest
+
+
+# The distance the edge walk started with (the largest distance in the
+# HSV space used).
+_START_DISTANCE = 385.851
+
+# For each edge direction, the axis varied along the edge and which
+# corners (start or end on each axis) the 4 edges use, in the order the
+# edge walk visited them.
+_EDGES = [
+    (0, [(0, 1, 0), (0, 0, 0), (0, 0, 1), (0, 1, 1)]),
+    (1, [(0, 0, 0), (1, 0, 0), (0, 0, 1), (1, 0, 1)]),
+    (2, [(0, 0, 0), (0, 1, 0), (1, 0, 0), (1, 1, 0)])
+]
+
+
+def _closest_on_edge(point, colors, axis, lo, hi, wrap_hue):
+    """Find the closest integer point to each color along an edge.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The position along the edge and
+            the distance to it for each color.
+    """
+    c = colors[:, axis]
+
+    # The closest integers are on either side of the color, and with
+    # wrapping, also on either side of it shifted by a full turn.
+    shifts = (0, -360, 360) if wrap_hue and axis == 0 else (0,)
+    candidates = [np.clip(np.floor(c + shift) + offset, lo, hi)
+                  for shift in shifts for offset in (0, 1)]
+
+    best_t = np.zeros(len(colors))
+    best_dist = np.full(len(colors), np.inf)
+
+    # The edge walk never visits an empty range.
+    if lo > hi:
+        return best_t, best_dist
+
+    for t in candidates:
+        point[:, axis] = t
+        dist = _get_distances(point, colors, wrap_hue)
+
+        # Ties go to the lower value, which the walk would reach first.
+        closer = (dist < best_dist) | ((dist == best_dist) & (t < best_t))
+        best_t = np.where(closer, t, best_t)
+        best_dist = np.where(closer, dist, best_dist)
+
+    return best_t, best_dist
+
+
+def _get_distances(points, colors, wrap_hue=False):
+    diff = np.abs(points - colors)
+
+    if wrap_hue:
+        diff[:, 0] = np.minimum(diff[:, 0], 360 - diff[:, 0])
+
+    return np.sqrt(diff[:, 0]**2 + diff[:, 1]**2 + diff[:, 2]**2)
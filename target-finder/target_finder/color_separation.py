@@ -0,0 +1,240 @@
+"""Contains methods for splitting target pixels into two main colors.
+
+Each method takes an (N, 3) uint8 array of pixels and labels every
+pixel as 0 or 1. Methods can be picked by name or be any function with
+the same signature.
+"""
+
+import numpy as np
+
+
+def separate_colors(pixels, method='kmeans', max_pixels=None, seed=0):
+    """Split pixels into two colors.
+
+    Args:
+        pixels (np.ndarray): An (N, 3) array of pixel colors.
+        method (Union[str, Callable]): The name of the method in
+            METHODS, or a function labeling an (N, 3) uint8 array.
+        max_pixels (int): If given, the method only sees a random
+            subsample of this many pixels, and the rest of the pixels
+            go with the closest of the two colors found.
+        seed (int): The seed used for subsampling.
+
+    Returns:
+        Tuple[Tuple[np.ndarray, int], Tuple[np.ndarray, int]]: The
+            mean color and pixel count of label 1 then label 0.
+    """
+    labels = label_colors(pixels, method, max_pixels, seed)
+
+    return _summarize(pixels, labels)
+
+
+def label_colors(pixels, method='kmeans', max_pixels=None, seed=0):
+    """Label each pixel as one of two colors.
+
+    See separate_colors(...) for the arguments.
+
+    Returns:
+        np.ndarray: A 0 or 1 label for each pixel.
+    """
+    pixels = np.asarray(pixels).reshape(-1, 3).astype(np.uint8)
+    func = METHODS[method] if isinstance(method, str) else method
+
+    if max_pixels is None or len(pixels) <= max_pixels:
+        return np.asarray(func(pixels))
+
+    rng = np.random.RandomState(seed)
+    sample = pixels[rng.choice(len(pixels), max_pixels, replace=False)]
+    sample_labels = np.asarray(func(sample))
+
+    # Give every pixel the label of the closer mean color.
+    (color_a, count_a), (color_b, count_b) = _summarize(sample,
+                                                        sample_labels)
+    centers = np.array([color_b if count_b else color_a,
+                        color_a if count_a else color_b])
+
+    return _nearest(pixels, centers)
+
+
+def color_agreement(pixels, method='kmeans', max_pixels=None, seed=0):
+    """Compare a method with agglomerative clustering on the same pixels.
+
+    Args:
+        pixels (np.ndarray): An (N, 3) array of pixel colors.
+        method, max_pixels, seed: See separate_colors(...).
+
+    Returns:
+        dict: The fraction of pixels given the same color
+            ('label_agreement', ignoring which label is which), and the
+            largest distance between matching mean colors
+            ('color_distance').
+    """
+    expected = label_colors(pixels, 'agglomerative')
+    actual = label_colors(pixels, method, max_pixels, seed)
+
+    same = np.mean(expected == actual)
+    if same < 0.5:
+        actual = 1 - actual
+        same = 1 - same
+
+    colors_expected = _summarize(pixels, expected)
+    colors_actual = _summarize(pixels, actual)
+
+    distance = max(
+        float(np.linalg.norm(a[0] - b[0])) if a[1] and b[1] else 0.0
+        for a, b in zip(colors_expected, colors_actual)
+    )
+
+    return {'label_agreement': float(same), 'color_distance': distance}
+
+
+def agglomerative_labels(pixels):
+    """Label pixels with sklearn's AgglomerativeClustering.
+
+    This was the original method. Its time and memory grow with the
+    square of the number of pixels.
+    """
+    # Imported here since sklearn is slow to import.
+    import sklearn.cluster
+
+    if len(pixels) < 2:
+        return np.zeros(len(pixels), dtype=np.intp)
+
+    algo = sklearn.cluster.AgglomerativeClustering(n_clusters=2)
+    algo.fit(pixels.astype(np.float64))
+
+    return algo.labels_
+
+
+def histogram_labels(pixels):
+    """Label pixels by thresholding along their main color axis.
+
+    Pixels are projected onto the principal axis of their colors, and
+    the projections are split with Otsu's method on a 256 bin
+    histogram.
+    """
+    colors, inverse, counts = _unique_colors(pixels)
+
+    return _histogram_split(colors, counts)[inverse]
+
+
+def kmeans_labels(pixels, iterations=10):
+    """Label pixels with 2-means clustering.
+
+    The clustering runs on the unique colors weighted by their counts,
+    starting from the histogram split.
+    """
+    colors, inverse, counts = _unique_colors(pixels)
+    colors = colors.astype(np.float64)
+
+    labels = _histogram_split(colors, counts)
+
+    for _ in range(iterations):
+        if labels.min() == labels.max():
+            break
+
+        centers = np.array([
+            np.average(colors[labels == label], axis=0,
+                       weights=counts[labels == label])
+            for label in (0, 1)
+        ])
+
+        new_labels = _nearest(colors, centers)
+
+        if np.array_equal(new_labels, labels):
+            break
+
+        labels = new_labels
+
+    return labels[inverse]
+
+
+METHODS = {
+    'agglomerative': agglomerative_labels,
+    'histogram': histogram_labels,
+    'kmeans': kmeans_labels
+}
+
+
+def _summarize(pixels, labels):
+    """Get the mean color and count for label 1 then label 0."""
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 3)
+    out = []
+
+    for label in (1, 0):
+        group = pixels[labels == label]
+        mean = group.mean(axis=0) if len(group) else np.zeros(3)
+        out.append((mean, group.shape[0]))
+
+    return tuple(out)
+
+
+def _unique_colors(pixels):
+    """Get the unique colors with counts and the index of each pixel."""
+    pixels = pixels.astype(np.uint32)
+    packed = (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+    keys, inverse, counts = np.unique(packed, return_inverse=True,
+                                      return_counts=True)
+
+    colors = np.stack([keys >> 16, (keys >> 8) & 255, keys & 255], axis=1)
+
+    return colors.astype(np.uint8), inverse.reshape(-1), counts
+
+
+def _histogram_split(colors, counts):
+    """Split weighted colors with Otsu's method along their main axis."""
+    projection = _principal_projection(colors, counts)
+
+    lo, hi = projection.min(), projection.max()
+    if hi - lo < 1e-9:
+        return np.zeros(len(colors), dtype=np.intp)
+
+    bins = ((projection - lo) / (hi - lo) * 255).astype(np.intp)
+    hist = np.bincount(bins, weights=counts, minlength=256)
+
+    return (bins > _otsu_threshold(hist)).astype(np.intp)
+
+
+def _principal_projection(colors, counts):
+    """Project colors onto the main axis of their weighted spread."""
+    colors = colors.astype(np.float64)
+    mean = np.average(colors, axis=0, weights=counts)
+    centered = colors - mean
+
+    cov = (centered * counts[:, np.newaxis]).T @ centered
+    _, vectors = np.linalg.eigh(cov)
+
+    return centered @ vectors[:, -1]
+
+
+def _otsu_threshold(hist):
+    """Find the histogram split with the most between-class variance.
+
+    Bins above the returned threshold make up the second class.
+    """
+    bins = np.arange(len(hist))
+    weight_lo = np.cumsum(hist)
+    weight_hi = weight_lo[-1] - weight_lo
+
+    sum_lo = np.cumsum(hist * bins)
+    sum_hi = sum_lo[-1] - sum_lo
+
+    valid = (weight_lo > 0) & (weight_hi > 0)
+    mean_lo = np.divide(sum_lo, weight_lo, out=np.zeros(len(hist)),
+                        where=valid)
+    mean_hi = np.divide(sum_hi, weight_hi, out=np.zeros(len(hist)),
+                        where=valid)
+
+    variance = np.where(valid,
+                        weight_lo * weight_hi * (mean_lo - mean_hi) ** 2, -1)
+
+    return int(np.argmax(variance))
+
+
+def _nearest(pixels, centers):
+    """Label each pixel with the index of the closest center."""
+    pixels = np.asarray(pixels, dtype=np.float64)
+    dists = ((pixels[:, np.newaxis, :] - centers[np.newaxis]) ** 2).sum(-1)
+
+    return np.argmin(dists, axis=1)
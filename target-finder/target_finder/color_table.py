@@ -0,0 +1,250 @@
+"""Contains the color definitions and a lookup table for naming colors."""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from .color_cube import ColorCube
+from .types import Color
+
+
+# ColorCube((Hl, sl, vl), (Hu, Su, Vu))
+# Note that the Color returned for a cube is Color(position + 1).
+COLOR_CUBES = [
+    ('white', ColorCube((0, 0, 85), (359, 20, 100))),
+    ('black', ColorCube((0, 0, 0), (359, 100, 25))),
+    ('gray', ColorCube((0, 0, 25), (359, 5, 75))),
+    ('blue', ColorCube((180, 70, 70), (345, 100, 100))),
+    ('red', ColorCube((350, 70, 70), (359, 100, 65))),
+    ('green', ColorCube((100, 60, 30), (160, 100, 100))),
+    ('yellow', ColorCube((60, 50, 55), (75, 100, 100))),
+    ('purple', ColorCube((230, 40, 55), (280, 100, 100))),
+    ('brown', ColorCube((300, 38, 20), (359, 100, 40))),
+    ('orange', ColorCube((15, 70, 75), (45, 100, 100)))
+]
+
+
+def rgb_to_hsv(colors):
+    """Convert RGB colors to HSV in the units the color cubes use.
+
+    Args:
+        colors (np.ndarray): An (N, 3) array of RGB colors (0-255).
+
+    Returns:
+        np.ndarray: An (N, 3) float array of H (0-360), S and V
+            (0-100) values.
+    """
+    rgb = np.asarray(colors, dtype=np.float64).reshape(-1, 3) / 255
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+
+    c_max = rgb.max(axis=1)
+    c_min = rgb.min(axis=1)
+    delta = c_max - c_min
+
+    # Avoiding division by zero, those hues are set to 0 below.
+    safe_delta = np.where(delta == 0, 1, delta)
+
+    h = np.select(
+        [delta == 0, c_max == r, c_max == g],
+        [0, 60 * (((g - b) / safe_delta) % 6),
+         60 * (((b - r) / safe_delta) + 2)],
+        60 * (((r - g) / safe_delta) + 4)
+    )
+    s = np.where(c_max == 0, 0, delta / np.where(c_max == 0, 1, c_max))
+
+    return np.stack([h, s * 100, c_max * 100], axis=1)
+
+
+def name_colors(colors):
+    """Name RGB colors exactly using the color cubes.
+
+    A color is named after the first cube containing it. Otherwise, it
+    uses the cube whose closest point has the smallest magnitude.
+
+    Args:
+        colors (np.ndarray): An (N, 3) array of RGB colors (0-255).
+
+    Returns:
+        np.ndarray: The Color value for each color.
+    """
+    hsv = rgb_to_hsv(colors)
+    names = np.zeros(len(hsv), dtype=np.uint8)
+
+    for index, (_, cube) in reversed(list(enumerate(COLOR_CUBES))):
+        names[_cube_contains(cube, hsv)] = index + 1
+
+    misses = names == 0
+
+    if misses.any():
+        dists = []
+
+        for _, cube in COLOR_CUBES:
+            p = cube.get_closest_points(hsv[misses])
+            dists.append(np.sqrt((p[:, 0] * p[:, 0]) + (p[:, 1] * p[:, 1]) +
+                                 (p[:, 2] * p[:, 2])))
+
+        names[misses] = np.argmin(np.stack(dists, axis=1), axis=1) + 1
+
+    return names
+
+
+def _cube_contains(cube, hsv):
+    h, s, v = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+
+    return ((cube.hStart <= h) & (h <= cube.hEnd) &
+            (cube.sStart <= s) & (s <= cube.sEnd) &
+            (cube.vStart <= v) & (v <= cube.vEnd))
+
+
+class ColorTable(object):
+    """A quantized RGB lookup table for naming colors.
+
+    The table is built once by naming the corners and center of each
+    RGB bin with name_colors(...). Bins where these all share a name
+    store it, and bins on a boundary between colors store Color.NONE.
+
+    A stored name is only trusted once every integer color in the bin
+    has been named exactly and agrees with it, since a sliver of another
+    color can sit inside a bin without reaching any of the points
+    checked. Bins are verified like this the first time a lookup lands
+    in them, and bins which fail store Color.NONE from then on. Colors
+    in Color.NONE bins, and colors which aren't integers (which the
+    verification can't cover), are named exactly, so lookup(...) always
+    matches name_colors(...).
+
+    Attributes:
+        bins (int): The number of bins along each of R, G and B, which
+            must divide 256.
+        table (np.ndarray): The (bins, bins, bins) Color values.
+        verified (np.ndarray): Whether each bin has been verified.
+    """
+
+    def __init__(self, bins=32, cache_dir=None):
+        """Load the table from the cache or build it.
+
+        Args:
+            bins (int): The number of bins along each channel.
+            cache_dir (str): An optional directory to save the built
+                table in and load it from next time. Defaults to the
+                TARGET_FINDER_CACHE_DIR environment variable if set.
+        """
+        if 256 % bins != 0:
+            raise ValueError('The number of bins must divide 256')
+
+        self.bins = bins
+
+        if cache_dir is None:
+            cache_dir = os.environ.get('TARGET_FINDER_CACHE_DIR')
+
+        cache_fn = None
+        if cache_dir:
+            cache_fn = os.path.join(cache_dir, 'color-table-{:d}-{:s}.npy'
+                                    .format(bins, _cubes_hash()))
+
+        if cache_fn and os.path.isfile(cache_fn):
+            self.table = np.load(cache_fn)
+        else:
+            self.table = self._build()
+
+            if cache_fn:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(cache_fn, self.table)
+
+        self.verified = self.table == Color.NONE.value
+        self._lock = threading.Lock()
+
+    def _build(self):
+        n = self.bins
+        step = 256 / n
+
+        # Each bin is checked at its corners and its center.
+        corners = self._name_grid(np.minimum(np.arange(n + 1) * step, 255))
+        centers = self._name_grid((np.arange(n) + 0.5) * step)
+
+        table = centers.copy()
+
+        for dr in (0, 1):
+            for dg in (0, 1):
+                for db in (0, 1):
+                    other = corners[dr:n + dr, dg:n + dg, db:n + db]
+                    table[table != other] = Color.NONE.value
+
+        return table
+
+    def _name_grid(self, values):
+        grid = np.stack(np.meshgrid(values, values, values, indexing='ij'),
+                        axis=-1)
+
+        return name_colors(grid.reshape(-1, 3)).reshape(grid.shape[:3])
+
+    def _verify(self, idxs):
+        """Name every color in the unverified bins given exactly.
+
+        Args:
+            idxs (np.ndarray): An (N, 3) array of bin indices.
+        """
+        if self.verified[idxs[:, 0], idxs[:, 1], idxs[:, 2]].all():
+            return
+
+        with self._lock:
+            idxs = np.unique(idxs, axis=0)
+            idxs = idxs[~self.verified[idxs[:, 0], idxs[:, 1], idxs[:, 2]]]
+
+            size = 256 // self.bins
+            offsets = np.arange(size)
+            offsets = np.stack(np.meshgrid(offsets, offsets, offsets,
+                                           indexing='ij'),
+                               axis=-1).reshape(-1, 3)
+
+            colors = idxs[:, np.newaxis] * size + offsets
+            names = name_colors(colors.reshape(-1, 3)) \
+                .reshape(len(idxs), -1)
+
+            r, g, b = idxs[:, 0], idxs[:, 1], idxs[:, 2]
+            agree = np.all(names == self.table[r, g, b][:, np.newaxis],
+                           axis=1)
+
+            self.table[r[~agree], g[~agree], b[~agree]] = Color.NONE.value
+            self.verified[r, g, b] = True
+
+    def lookup(self, colors):
+        """Name RGB colors with the table.
+
+        Args:
+            colors (np.ndarray): An (N, 3) array of RGB colors.
+
+        Returns:
+            np.ndarray: The Color value for each color.
+        """
+        colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+        names = np.full(len(colors), Color.NONE.value, dtype=np.uint8)
+
+        integral = np.all((colors == np.floor(colors)) & (colors >= 0) &
+                          (colors <= 255), axis=1)
+
+        if integral.any():
+            idxs = colors[integral].astype(np.intp) // (256 // self.bins)
+            self._verify(idxs)
+            names[integral] = self.table[idxs[:, 0], idxs[:, 1], idxs[:, 2]]
+
+        # Colors in bins on a boundary are named exactly.
+        unsure = names == Color.NONE.value
+        if unsure.any():
+            names[unsure] = name_colors(colors[unsure])
+
+        return names
+
+    def name(self, color):
+        """Name a single RGB color with the table."""
+        return Color(int(self.lookup(color)[0]))
+
+
+def _cubes_hash():
+    """Hash the cube definitions so cached tables go stale with them."""
+    cubes = repr([(name, cube.hStart, cube.sStart, cube.vStart,
+                   cube.hEnd, cube.sEnd, cube.vEnd)
+                  for name, cube in COLOR_CUBES])
+
+    return hashlib.sha1(cubes.encode()).hexdigest()[:12]
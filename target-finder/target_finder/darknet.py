@@ -1,29 +1,124 @@
 """
 A python wrapper for the darknet components of target_finder_model
 """
+import os
+import threading
+import warnings
+
 import target_finder_model as tfm
 import numpy as np
 import cv2
 
+from .backends import create_backend
+from .preprocessing import TileBatcher
+
 
 class DarknetModel:
+    """Base for the darknet models.
+
+    Inputs are run through the net in micro-batches so the input blob
+    and the activations for a busy image don't need gigabytes at once.
+    A micro-batch has at most batch_size images, and at most as many as
+    fit in max_batch_bytes (using the net's own estimate of the memory
+    one image needs). Either limit can be None to turn it off.
+
+    The net runs on the given backend (see backends.py), which is
+    either a backend name or an already loaded backend. By default it's
+    the one in the TARGET_FINDER_BACKEND environment variable, or
+    OpenCV on the CPU. The cpu argument is deprecated, the backend
+    decides the device.
+    """
 
     def __init__(self, weights_fn=None, config_fn=None,
-                 classes=None, cpu=True):
+                 classes=None, cpu=True, input_size=None,
+                 batch_size=None, max_batch_bytes=None, backend=None):
+
+        if not cpu:
+            warnings.warn('cpu=False is ignored, pick a backend (e.g. '
+                          'backend=\'opencv-opencl\') instead',
+                          DeprecationWarning, stacklevel=2)
 
         self.classes = classes
+        self.config_fn = config_fn
+        self.weights_fn = weights_fn
+        self.input_size = input_size
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self._image_bytes = None
+
+        # Inputs are resized straight into one reusable blob.
+        self._batcher = TileBatcher(input_size)
 
         # Init model
-        self.net = cv2.dnn.readNetFromDarknet(config_fn, weights_fn)
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        if backend is None or isinstance(backend, str):
+            backend = create_backend(backend, config_fn, weights_fn)
+
+        self.backend = backend
+
+        # A net can only run one forward pass at a time, so threads
+        # sharing the model take turns.
+        self._lock = threading.Lock()
+
+    @property
+    def identity(self):
+        """A string which changes with the model files and backend.
+
+        Results cached for one identity (see TileCache) shouldn't be
+        used for another.
+        """
+        try:
+            stat = os.stat(self.weights_fn)
+            weights = '{:d}:{:d}'.format(stat.st_size, stat.st_mtime_ns)
+        except (OSError, TypeError):
+            weights = 'unknown'
+
+        return '{:s}:{!s}:{!s}:{:s}:{!s}:{:s}'.format(
+            type(self).__name__, self.config_fn, self.weights_fn, weights,
+            self.input_size,
+            getattr(self.backend, 'name', type(self.backend).__name__))
+
+    def _forward(self, images):
+        with self._lock:
+            blob = self._batcher.fill(images)
+            return self.backend.forward(blob)
+
+    def _micro_batches(self, images):
+        """Split the inputs into the micro-batches to run."""
+        size = self._micro_batch_size()
+
+        if size is None:
+            return [images]
+
+        return [images[i:i + size] for i in range(0, len(images), size)]
+
+    def _micro_batch_size(self):
+        """Get the max number of images to run at once."""
+        size = self.batch_size
+
+        if self.max_batch_bytes is not None:
+            fit = max(1, int(self.max_batch_bytes //
+                             self.get_image_bytes()))
+            size = fit if size is None else min(size, fit)
+
+        return size
+
+    def get_image_bytes(self):
+        """Estimate the memory needed to run one image through the net.
+
+        This is the size of the input and the layer outputs, the weights
+        are only loaded once no matter the batch size.
+        """
+        if self._image_bytes is None:
+            w, h = self.input_size
+            image_bytes = self.backend.get_image_bytes((1, 3, h, w))
 
-        if cpu:
-            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            # Without an estimate, only the input is counted.
+            if image_bytes is None:
+                image_bytes = 3 * h * w * 4
 
-        # Locate output layers
-        layers = self.net.getLayerNames()
-        self.out_layers = [layers[i[0] - 1]
-                           for i in self.net.getUnconnectedOutLayers()]
+            self._image_bytes = image_bytes
+
+        return self._image_bytes
 
 
 class Yolo3Detector(DarknetModel):
@@ -32,92 +127,121 @@ class Yolo3Detector(DarknetModel):
         kwargs['weights_fn'] = kwargs.get('weights_fn', tfm.yolo3_weights)
         kwargs['config_fn'] = kwargs.get('config_fn', tfm.yolo3_file)
         kwargs['classes'] = tfm.YOLO_CLASSES
+        kwargs['input_size'] = kwargs.get('input_size', tfm.DETECTOR_SIZE)
+        kwargs['batch_size'] = kwargs.get('batch_size', 8)
         super().__init__(*args, **kwargs)
 
-    def _filter_nms(self, classes, confs, boxes, thresh):
-        detects = []
-        best_idxs = cv2.dnn.NMSBoxes(boxes, confs, 0.05, thresh)
-        for i_ in best_idxs:
-            i = i_[0]
-            detects.append((classes[i], confs[i], boxes[i]))
-        return detects
-
     def detect_all(self, images, threshold=0.05, nms_thresh=.40):
 
+        detections = []
+
+        for batch in self._micro_batches(images):
+            detections.extend(self._detect_batch(batch, threshold,
+                                                 nms_thresh))
+
+        return detections
+
+    def _detect_batch(self, images, threshold, nms_thresh):
+
         if len(images) == 0:
             return []
 
-        elif len(images) == 1:
+        n = len(images)
+
+        if n == 1:
             # OpenCV Darknet doesnt like lonely inputs
-            images = [images[0], np.copy(images[0])]
+            images = [images[0], images[0]]
 
-        h, w, _ = images[0].shape
-        n = len(images)
-        num_classes = len(self.classes)
+        net_out = self._forward(images)
 
-        detections = []
+        return decode_yolo_output(net_out, self.classes, self.input_size,
+                                  threshold, nms_thresh)[:n]
 
-        blob = cv2.dnn.blobFromImages(images, 1 / 255, (h, w), [0, 0, 0], 1)
-        self.net.setInput(blob)
-        net_out = self.net.forward(self.out_layers)
 
-        for k in range(n):
+def decode_yolo_output(net_out, classes, size, threshold=0.05,
+                       nms_thresh=.40):
+    """Decode the raw YOLO output layers for a whole batch at once.
 
-            # storing box/conf/classes seperately for NMS
-            shape_boxes = []
-            shape_confidences = []
-            shape_classes = []
+    Rows are thresholded, argmaxed and converted to boxes for every
+    image together, then shape and alphanumeric detections are split
+    with a class mask and run through NMS separately.
 
-            alpha_boxes = []
-            alpha_confidences = []
-            alpha_classes = []
+    Args:
+        net_out (List[np.ndarray]): The output of each YOLO layer,
+            each with the shape (n, rows, 5 + C).
+        classes (List[str]): The class names of the detector.
+        size (Tuple[int, int]): The (width, height) of the inputs.
+        threshold (float): The minimum class confidence for a row.
+        nms_thresh (float): The overlap threshold used for NMS.
 
-            local_detects = []
+    Returns:
+        List[List[tuple]]: For each image, the (name, conf,
+            [left, top, width, height]) detections.
+    """
+    w, h = size
+    n = net_out[0].shape[0]
+    num_classes = len(classes)
 
-            for out_layer in net_out:
+    out = np.concatenate([layer.reshape(n, -1, layer.shape[-1])
+                          for layer in net_out], axis=1)
 
-                out_tensor = out_layer[k]
+    scores = out[:, :, 5:]
+    class_idxs = np.argmax(scores, axis=2)
+    confs = np.take_along_axis(scores, class_idxs[:, :, np.newaxis],
+                               axis=2)[:, :, 0]
 
-                for detection in out_tensor:
+    keep = (confs > threshold) & (class_idxs < num_classes)
+    image_idxs, row_idxs = np.nonzero(keep)
 
-                    scores = detection[5:]
-                    class_idx = np.argmax(scores)
-                    conf = float(scores[class_idx])
+    # Same integer truncation as the per-row int() conversions.
+    dims = out[image_idxs, row_idxs, :4].astype(np.float64)
+    center_x = (dims[:, 0] * w).astype(np.int64)
+    center_y = (dims[:, 1] * h).astype(np.int64)
+    width = (dims[:, 2] * w).astype(np.int64)
+    height = (dims[:, 3] * h).astype(np.int64)
+    left = (center_x - width / 2).astype(np.int64)
+    top = (center_y - height / 2).astype(np.int64)
 
-                    if conf > threshold and class_idx < num_classes:
+    boxes = np.stack([left, top, width, height], axis=1)
+    class_idxs = class_idxs[image_idxs, row_idxs]
+    confs = confs[image_idxs, row_idxs]
 
-                        center_x = int(detection[0] * w)
-                        center_y = int(detection[1] * h)
-                        width = int(detection[2] * w)
-                        height = int(detection[3] * h)
-                        left = int(center_x - width / 2)
-                        top = int(center_y - height / 2)
+    # Alphanumerics have single character class names.
+    alpha_mask = np.array([len(name) == 1 for name in classes])[class_idxs]
 
-                        class_name = self.classes[class_idx]
-                        dims = [left, top, width, height]
+    bounds = np.searchsorted(image_idxs, np.arange(n + 1))
+    detections = []
 
-                        # place alpha and shape bboxes in diff sets
-                        if len(class_name) != 1:
-                            shape_classes.append(class_name)
-                            shape_confidences.append(conf)
-                            shape_boxes.append(dims)
-                        else:
-                            alpha_classes.append(class_name)
-                            alpha_confidences.append(conf)
-                            alpha_boxes.append(dims)
+    for k in range(n):
 
-            local_detects.extend(self._filter_nms(shape_classes,
-                                                  shape_confidences,
-                                                  shape_boxes,
-                                                  nms_thresh))
-            local_detects.extend(self._filter_nms(alpha_classes,
-                                                  alpha_confidences,
-                                                  alpha_boxes,
-                                                  nms_thresh))
+        local = slice(bounds[k], bounds[k + 1])
+        local_detects = []
 
-            detections.append(local_detects)
+        # place alpha and shape bboxes in diff sets
+        for mask in (~alpha_mask[local], alpha_mask[local]):
+            local_detects.extend(_filter_nms(classes,
+                                             class_idxs[local][mask],
+                                             confs[local][mask],
+                                             boxes[local][mask],
+                                             nms_thresh))
+
+        detections.append(local_detects)
+
+    return detections
 
-        return detections
+
+def _filter_nms(classes, class_idxs, confs, boxes, thresh):
+    if len(boxes) == 0:
+        return []
+
+    confs = confs.tolist()
+    boxes = boxes.tolist()
+
+    best_idxs = cv2.dnn.NMSBoxes(boxes, confs, 0.05, thresh)
+
+    # Older OpenCV versions return the indices as an (n, 1) array.
+    return [(classes[class_idxs[i]], confs[i], boxes[i])
+            for i in np.asarray(best_idxs, dtype=np.int64).reshape(-1)]
 
 
 class PreClassifier(DarknetModel):
@@ -126,16 +250,24 @@ class PreClassifier(DarknetModel):
         kwargs['weights_fn'] = kwargs.get('weights_fn', tfm.preclf_weights)
         kwargs['config_fn'] = kwargs.get('config_fn', tfm.preclf_file)
         kwargs['classes'] = tfm.CLF_CLASSES
+        kwargs['input_size'] = kwargs.get('input_size', tfm.PRECLF_SIZE)
+        kwargs['batch_size'] = kwargs.get('batch_size', 128)
         super().__init__(*args, **kwargs)
 
     def classify_all(self, images):
 
-        h, w, _ = images[0].shape
+        classes = []
+
+        for batch in self._micro_batches(images):
+            if len(batch) == 0:
+                continue
 
-        blob = cv2.dnn.blobFromImages(images, 1 / 255, (h, w), [0, 0, 0], 1)
-        self.net.setInput(blob)
+            # One row of class scores per image, even for a single
+            # image (squeezing would drop the batch axis).
+            net_out = self._forward(batch)
+            prediction = np.asarray(net_out[0]).reshape(len(batch), -1)
 
-        net_out = self.net.forward(self.out_layers)
-        prediction = np.squeeze(net_out)
+            classes.extend(self.classes[np.argmax(pred)]
+                           for pred in prediction)
 
-        return [self.classes[np.argmax(pred)] for pred in prediction]
+        return classes
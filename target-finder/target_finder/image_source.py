@@ -0,0 +1,116 @@
+"""Contains an image file which is only decoded as much as needed.
+
+The pre-classifier only looks at frames at a fraction of their size,
+so JPEGs can be decoded at a reduced scale for it (libjpeg scales while
+decoding, which is much faster than decoding everything). The full
+resolution image is only decoded once something needs it.
+"""
+
+import cv2
+import PIL.Image
+
+
+# The OpenCV flags for decoding at 1 / factor of the full size.
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# EXIF orientations which swap the width and height. OpenCV rotates
+# images by their orientation when decoding.
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class ImageSource(object):
+    """An image file decoded lazily, at full or reduced resolution.
+
+    Only the header is read when the source is created. Decoded images
+    are kept until release() is called.
+
+    Attributes:
+        filename (str): The image file.
+        width (int): The full width of the image.
+        height (int): The full height of the image.
+    """
+
+    def __init__(self, filename):
+        """Read the size of an image file."""
+        self.filename = filename
+
+        try:
+            with PIL.Image.open(filename) as image:
+                self.width, self.height = image.size
+                orientation = _exif_orientation(image)
+        except (IOError, SyntaxError):
+            raise IOError('Could not read image: "{:s}"'.format(filename))
+
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            self.width, self.height = self.height, self.width
+
+        self._full = None
+        self._reduced = {}
+
+    @property
+    def shape(self):
+        """The (height, width, channels) of the full image."""
+        return self.height, self.width, 3
+
+    def full(self):
+        """Get the full resolution BGR image."""
+        if self._full is None:
+            self._full = self._read(cv2.IMREAD_COLOR)
+
+        return self._full
+
+    def reduced(self, scale):
+        """Get the image decoded at a reduced resolution.
+
+        The smallest of 1/2, 1/4 or 1/8 of the full size which is still
+        at least the scale asked for is decoded. If the full image was
+        already decoded, it's used instead.
+
+        Args:
+            scale (float): The smallest scale needed.
+
+        Returns:
+            Tuple[np.ndarray, float]: The BGR image and its scale.
+        """
+        factors = [factor for factor in _REDUCED_FLAGS
+                   if 1 / factor >= scale]
+
+        if self._full is not None or not factors:
+            return self.full(), 1
+
+        factor = max(factors)
+
+        if factor not in self._reduced:
+            self._reduced[factor] = self._read(_REDUCED_FLAGS[factor])
+
+        return self._reduced[factor], 1 / factor
+
+    def release(self):
+        """Drop the decoded images."""
+        self._full = None
+        self._reduced = {}
+
+    def _read(self, flags):
+        image = cv2.imread(self.filename, flags)
+
+        if image is None:
+            raise IOError('Could not read image: "{:s}"'.format(
+                self.filename))
+
+        return image
+
+
+def _exif_orientation(image):
+    """Get the EXIF orientation of an open PIL image, if it has one."""
+    if hasattr(image, 'getexif'):
+        return image.getexif().get(0x0112)
+
+    # Pillow before 6.0 only reads EXIF data from JPEGs.
+    if hasattr(image, '_getexif'):
+        return (image._getexif() or {}).get(0x0112)
+
+    return None
@@ -0,0 +1,211 @@
+"""Contains a simple collector for target finding metrics.
+
+A Metrics object can be passed to find_targets_from_array(...) and the
+Pipeline to record how long each stage takes and how many tiles and
+boxes go through them. The values are kept as counters and histograms
+and can be exported in the Prometheus text format.
+"""
+
+import bisect
+import threading
+import time
+
+
+# Histogram buckets (in seconds) covering single GrabCut runs up to
+# whole frames.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+
+class Metrics(object):
+    """Counters and histograms for target finding.
+
+    The metrics recorded by target-finder are:
+
+    - frames_total: the number of images processed.
+    - frame_seconds: the total time for each image (not recorded by
+      the Pipeline, since its stages overlap).
+    - stage_seconds{stage}: the time spent in each stage for an image.
+    - tiles_total / tiles_kept_total: the tiles made and the ones the
+      pre-classifier kept.
+    - tile_cache_hits_total: the tiles found in the TileCache, if one
+      is used.
+    - tiles_reused_total: the tiles a FrameSequenceFinder reused from
+      earlier frames.
+    - raw_boxes_total / merged_boxes_total: the boxes from the detector
+      before and after merging.
+    - target_seconds{step}: the GrabCut ('grabcut'), color clustering
+      ('cluster') and total ('total') time for each target.
+    - server_requests_total{path,status} / server_batches_total: the
+      requests a TargetServer answered and the batches it ran.
+
+    All methods are thread-safe.
+
+    Attributes:
+        prefix (str): The prefix of the exported metric names.
+        buckets (Tuple[float]): The upper bounds of histogram buckets.
+    """
+
+    def __init__(self, prefix='target_finder', buckets=DEFAULT_BUCKETS):
+        """Create an empty set of metrics."""
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, labels=None):
+        """Add to a counter."""
+        key = (name, _label_key(labels))
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """Add a value to a histogram."""
+        key = (name, _label_key(labels))
+
+        with self._lock:
+            hist = self._histograms.get(key)
+
+            if hist is None:
+                hist = self._histograms[key] = _Histogram(len(self.buckets))
+
+            hist.counts[bisect.bisect_left(self.buckets, value)] += 1
+            hist.sum += value
+            hist.count += 1
+
+    def time(self, name, labels=None):
+        """Time a block of code into a histogram.
+
+        Example:
+            >>> with metrics.time('stage_seconds', {'stage': 'tile'}):
+            ...     tile()
+        """
+        return _Timer(self, name, labels)
+
+    def get_counter(self, name, labels=None):
+        """Get the value of a counter, 0 if it was never added to."""
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def get_histogram(self, name, labels=None):
+        """Get the count and sum of a histogram.
+
+        Returns:
+            Tuple[int, float]: The number of values and their sum.
+        """
+        with self._lock:
+            hist = self._histograms.get((name, _label_key(labels)))
+
+            if hist is None:
+                return 0, 0.0
+
+            return hist.count, hist.sum
+
+    def to_prometheus(self):
+        """Export the metrics in the Prometheus text format."""
+        lines = []
+
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                full_name = self._full_name(name)
+                lines.append('# TYPE {:s} counter'.format(full_name))
+
+                for key, value in sorted(self._counters.items()):
+                    if key[0] == name:
+                        lines.append('{:s}{:s} {}'.format(
+                            full_name, _format_labels(key[1]), value))
+
+            for name in sorted({name for name, _ in self._histograms}):
+                full_name = self._full_name(name)
+                lines.append('# TYPE {:s} histogram'.format(full_name))
+
+                for key, hist in sorted(self._histograms.items()):
+                    if key[0] == name:
+                        lines.extend(self._histogram_lines(full_name,
+                                                           key[1], hist))
+
+        return '\n'.join(lines) + '\n'
+
+    def _full_name(self, name):
+        return self.prefix + '_' + name if self.prefix else name
+
+    def _histogram_lines(self, full_name, labels, hist):
+        total = 0
+
+        for bound, count in zip(self.buckets + ('+Inf',), hist.counts):
+            total += count
+            bucket_labels = labels + (('le', _format_value(bound)),)
+            yield '{:s}_bucket{:s} {:d}'.format(
+                full_name, _format_labels(bucket_labels), total)
+
+        yield '{:s}_sum{:s} {}'.format(full_name, _format_labels(labels),
+                                       hist.sum)
+        yield '{:s}_count{:s} {:d}'.format(full_name, _format_labels(labels),
+                                           hist.count)
+
+
+def timer(metrics, name, labels=None):
+    """Time a block of code if there are metrics to record it in.
+
+    This returns a shared no-op context manager when metrics is None.
+    """
+    if metrics is None:
+        return _null_timer
+
+    return metrics.time(name, labels)
+
+
+class _Histogram(object):
+
+    def __init__(self, num_buckets):
+        # The last count is for the +Inf bucket.
+        self.counts = [0] * (num_buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start,
+                             self.labels)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{:s}="{:s}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return value if isinstance(value, str) else repr(float(value))
@@ -0,0 +1,362 @@
+"""Contains an exporter from darknet models to ONNX.
+
+The darknet configs in target_finder_model are converted layer by layer
+into an ONNX graph with the weights from the .weights file, so the
+models can run on ONNX Runtime. The outputs match what OpenCV gives for
+the same darknet model: a (n, rows, 5 + classes) array of decoded boxes
+for each YOLO layer, and the class scores for a classifier.
+
+Only the layers the target_finder_model configs use are supported:
+convolutional (with batch normalization, leaky or linear), maxpool,
+route, upsample, yolo, avgpool and softmax.
+
+This needs the onnx package, which is only imported when exporting.
+"""
+
+import numpy as np
+
+
+# Bumped whenever the exported graph changes, so cached exports made by
+# an older version are rebuilt.
+EXPORTER_VERSION = 1
+
+# Version of the ONNX operator set used.
+OPSET = 13
+
+# The ONNX IR version which goes with the operator set, so older
+# versions of ONNX Runtime can load the model.
+IR_VERSION = 7
+
+
+def export_onnx(config_fn, weights_fn, onnx_fn):
+    """Export a darknet model to an ONNX file.
+
+    The batch size of the model is dynamic, the input size is the one
+    in the config.
+
+    Args:
+        config_fn (str): The darknet .cfg file.
+        weights_fn (str): The darknet .weights file.
+        onnx_fn (str): The ONNX file to write.
+    """
+    import onnx
+
+    model = build_onnx(config_fn, weights_fn)
+    onnx.checker.check_model(model)
+    onnx.save(model, onnx_fn)
+
+
+def build_onnx(config_fn, weights_fn):
+    """Build the ONNX model for a darknet model.
+
+    Returns:
+        onnx.ModelProto: The model, with an input named 'input'.
+    """
+    from onnx import TensorProto, helper
+
+    sections = parse_config(config_fn)
+    net, layers = sections[0], sections[1:]
+
+    width = int(net['width'])
+    height = int(net['height'])
+    channels = int(net.get('channels', 3))
+
+    graph = _GraphBuilder()
+    weights = _WeightsReader(weights_fn)
+
+    # The output name, channels and (height, width) of each layer.
+    outputs = []
+    current = ('input', channels, (height, width))
+    yolo_outputs = []
+
+    for i, layer in enumerate(layers):
+        kind = layer['type']
+
+        if kind == 'convolutional':
+            current = _convolutional(graph, weights, layer, current)
+        elif kind == 'maxpool':
+            current = _maxpool(graph, layer, current)
+        elif kind == 'route':
+            current = _route(graph, layer, i, outputs)
+        elif kind == 'upsample':
+            current = _upsample(graph, layer, current)
+        elif kind == 'yolo':
+            name = _yolo(graph, layer, current, (height, width))
+            _, _, (h, w) = current
+            yolo_outputs.append(
+                (name, [h * w * len(layer['mask'].split(',')),
+                        5 + int(layer['classes'])]))
+        elif kind == 'avgpool':
+            name, c, _ = current
+            current = (graph.add('GlobalAveragePool', [name]), c, (1, 1))
+        elif kind == 'softmax':
+            name, c, size = current
+            flat = graph.add('Flatten', [name], axis=1)
+            current = (graph.add('Softmax', [flat], axis=1), c, size)
+        else:
+            raise ValueError('Unsupported darknet layer: [{:s}]'
+                             .format(kind))
+
+        outputs.append(current)
+
+    weights.check_done()
+
+    # The shape of each output after the batch dimension.
+    if yolo_outputs:
+        out_shapes = yolo_outputs
+    else:
+        out_shapes = [(current[0], [current[1]])]
+
+    graph_proto = helper.make_graph(
+        graph.nodes, 'darknet',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT,
+                                       ['batch', channels, height, width])],
+        [helper.make_tensor_value_info(name, TensorProto.FLOAT,
+                                       ['batch'] + shape)
+         for name, shape in out_shapes],
+        graph.initializers
+    )
+
+    return helper.make_model(
+        graph_proto, producer_name='target-finder', ir_version=IR_VERSION,
+        opset_imports=[helper.make_opsetid('', OPSET)]
+    )
+
+
+def parse_config(config_fn):
+    """Parse a darknet config into a list of sections.
+
+    Returns:
+        List[Dict[str, str]]: The options of each section, with the
+            section name as 'type'.
+    """
+    sections = []
+
+    with open(config_fn) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+
+            if not line:
+                continue
+
+            if line.startswith('['):
+                sections.append({'type': line.strip('[]').strip()})
+            else:
+                key, _, value = line.partition('=')
+                sections[-1][key.strip()] = value.strip()
+
+    return sections
+
+
+def _convolutional(graph, weights, layer, current):
+    name, c, (h, w) = current
+
+    filters = int(layer['filters'])
+    size = int(layer.get('size', 1))
+    stride = int(layer.get('stride', 1))
+    pad = size // 2 if int(layer.get('pad', 0)) else \
+        int(layer.get('padding', 0))
+    activation = layer.get('activation', 'logistic')
+
+    if int(layer.get('groups', 1)) != 1:
+        raise ValueError('Grouped convolutions are not supported')
+
+    if int(layer.get('batch_normalize', 0)):
+        biases = weights.read(filters)
+        scales = weights.read(filters)
+        mean = weights.read(filters)
+        variance = weights.read(filters)
+        kernel = weights.read(filters * c * size * size)
+
+        # Folding the batch normalization into the convolution, with
+        # the same epsilon darknet uses.
+        factor = scales / np.sqrt(variance + 1e-6)
+        kernel = kernel.reshape(filters, -1) * factor[:, np.newaxis]
+        biases = biases - mean * factor
+    else:
+        biases = weights.read(filters)
+        kernel = weights.read(filters * c * size * size)
+
+    kernel = kernel.reshape(filters, c, size, size)
+
+    out = graph.add('Conv', [name, graph.constant(kernel),
+                             graph.constant(biases)],
+                    kernel_shape=[size, size], strides=[stride, stride],
+                    pads=[pad, pad, pad, pad])
+
+    if activation == 'leaky':
+        out = graph.add('LeakyRelu', [out], alpha=0.1)
+    elif activation == 'logistic':
+        out = graph.add('Sigmoid', [out])
+    elif activation != 'linear':
+        raise ValueError('Unsupported activation: ' + activation)
+
+    h = (h + 2 * pad - size) // stride + 1
+    w = (w + 2 * pad - size) // stride + 1
+
+    return out, filters, (h, w)
+
+
+def _maxpool(graph, layer, current):
+    name, c, (h, w) = current
+
+    size = int(layer.get('size', layer.get('stride', 1)))
+    stride = int(layer.get('stride', 1))
+    padding = int(layer.get('padding', size - 1))
+
+    # Darknet puts the extra padding on the bottom and right.
+    before = padding // 2
+    after = padding - before
+
+    out = graph.add('MaxPool', [name], kernel_shape=[size, size],
+                    strides=[stride, stride],
+                    pads=[before, before, after, after])
+
+    h = (h + padding - size) // stride + 1
+    w = (w + padding - size) // stride + 1
+
+    return out, c, (h, w)
+
+
+def _route(graph, layer, index, outputs):
+    sources = [int(v) for v in layer['layers'].split(',')]
+    sources = [outputs[index + i if i < 0 else i] for i in sources]
+
+    if len(sources) == 1:
+        return sources[0]
+
+    out = graph.add('Concat', [name for name, _, _ in sources], axis=1)
+
+    return out, sum(c for _, c, _ in sources), sources[0][2]
+
+
+def _upsample(graph, layer, current):
+    name, c, (h, w) = current
+    stride = int(layer.get('stride', 2))
+
+    scales = graph.constant(np.array([1, 1, stride, stride], np.float32))
+    out = graph.add('Resize', [name, '', scales], mode='nearest')
+
+    return out, c, (h * stride, w * stride)
+
+
+def _yolo(graph, layer, current, net_size):
+    """Decode a YOLO layer the same way OpenCV does.
+
+    Each row is (x, y, w, h, objectness, class scores...), with the box
+    relative to the input size and the class scores multiplied by the
+    objectness. Class scores at or below the layer's threshold are set
+    to 0. Rows are ordered by cell row, cell column, then anchor.
+    """
+    name, c, (h, w) = current
+    net_h, net_w = net_size
+
+    classes = int(layer['classes'])
+    anchors = np.array([float(v) for v in layer['anchors'].split(',')],
+                       np.float32).reshape(-1, 2)
+    mask = [int(v) for v in layer['mask'].split(',')]
+    num = len(mask)
+    row_size = 5 + classes
+    thresh = float(layer.get('thresh', 0.2))
+
+    if float(layer.get('scale_x_y', 1)) != 1 or \
+            int(layer.get('new_coords', 0)):
+        raise ValueError('Only the default YOLO box coordinates are '
+                         'supported')
+
+    out = graph.add('Reshape', [name, graph.constant(
+        np.array([-1, num, row_size, h, w], np.int64))])
+    out = graph.add('Transpose', [out], perm=[0, 3, 4, 1, 2])
+
+    def part(start, end):
+        return graph.add('Slice', [
+            out, graph.constant(np.array([start], np.int64)),
+            graph.constant(np.array([end], np.int64)),
+            graph.constant(np.array([4], np.int64))
+        ])
+
+    grid_y, grid_x = np.meshgrid(np.arange(h), np.arange(w), indexing='ij')
+    grid = np.stack([grid_x, grid_y], axis=-1).reshape(1, h, w, 1, 2)
+
+    xy = graph.add('Add', [graph.add('Sigmoid', [part(0, 2)]),
+                           graph.constant(grid.astype(np.float32))])
+    xy = graph.add('Div', [xy, graph.constant(
+        np.array([w, h], np.float32))])
+
+    wh = graph.add('Mul', [graph.add('Exp', [part(2, 4)]), graph.constant(
+        (anchors[mask] / [net_w, net_h]).astype(np.float32)
+        .reshape(1, 1, 1, num, 2))])
+
+    objectness = graph.add('Sigmoid', [part(4, 5)])
+    scores = graph.add('Mul', [graph.add('Sigmoid', [part(5, row_size)]),
+                               objectness])
+    zero = graph.constant(np.zeros(1, np.float32))
+    scores = graph.add('Where', [
+        graph.add('Greater', [scores, graph.constant(
+            np.array([thresh], np.float32))]),
+        scores, zero])
+
+    rows = graph.add('Concat', [xy, wh, objectness, scores], axis=4)
+
+    return graph.add('Reshape', [rows, graph.constant(
+        np.array([-1, h * w * num, row_size], np.int64))])
+
+
+class _GraphBuilder(object):
+    """Collects the nodes and constants of an ONNX graph."""
+
+    def __init__(self):
+        self.nodes = []
+        self.initializers = []
+        self._count = 0
+
+    def add(self, op, inputs, **attrs):
+        from onnx import helper
+
+        name = self._name(op.lower())
+        self.nodes.append(helper.make_node(op, inputs, [name], name=name,
+                                           **attrs))
+
+        return name
+
+    def constant(self, array):
+        from onnx import numpy_helper
+
+        name = self._name('const')
+        self.initializers.append(numpy_helper.from_array(array, name))
+
+        return name
+
+    def _name(self, prefix):
+        self._count += 1
+        return '{:s}_{:d}'.format(prefix, self._count)
+
+
+class _WeightsReader(object):
+    """Reads the arrays in a darknet .weights file in order."""
+
+    def __init__(self, weights_fn):
+        with open(weights_fn, 'rb') as f:
+            major, minor, _ = np.fromfile(f, np.int32, 3)
+
+            # The count of images seen grew to 64 bits in version 0.2.
+            seen_type = np.int64 if major * 10 + minor >= 2 else np.int32
+            np.fromfile(f, seen_type, 1)
+
+            self.data = np.fromfile(f, np.float32)
+
+        self.offset = 0
+
+    def read(self, count):
+        if self.offset + count > len(self.data):
+            raise ValueError('The weights file is too short for the config')
+
+        values = self.data[self.offset:self.offset + count]
+        self.offset += count
+
+        return values
+
+    def check_done(self):
+        if self.offset != len(self.data):
+            raise ValueError('The weights file has {:d} values left over'
+                             .format(len(self.data) - self.offset))
@@ -0,0 +1,235 @@
+"""Contains the writer for saving targets found by the CLI.
+
+Making, encoding and writing the target images happens on a pool of
+threads so it overlaps with finding targets in the next images. On slow or
+network storage, the metadata can go into a single JSON lines or NumPy
+.npz file and the images into a single tar or zip archive instead of
+two small files per target.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from .types import TARGET_DTYPE, TargetBatch
+
+
+OUTPUT_FORMATS = ('files', 'jsonl', 'npz')
+
+ARCHIVE_FORMATS = ('tar', 'zip')
+
+
+class TargetWriter(object):
+    """Saves targets and their metadata in the background.
+
+    Targets are numbered in the order they are written. Each image is
+    saved as target-{num}.jpg, either in the output directory or in a
+    targets.tar or targets.zip archive there. The metadata is either
+    saved next to it as target-{num}.json ('files'), as a line in
+    targets.jsonl ('jsonl'), or in a TargetBatch saved to targets.npz
+    when the writer is closed ('npz'), in order. The "image" field of
+    the metadata is the image the target was found in, and
+    "target_image" is the saved target image's path, or its name in the
+    archive. The .npz file has these in its 'image' and 'target_image'
+    arrays.
+
+    Only a few targets are held in memory at once, write(...) waits for
+    the writers to catch up when they fall behind.
+
+    Example:
+        >>> with TargetWriter('out', output_format='jsonl') as writer:
+        ...     for target in targets:
+        ...         writer.write(filename, target)
+
+    Attributes:
+        output (str): The output directory.
+        output_format (str): 'files', 'jsonl' or 'npz'.
+        archive (str): 'tar', 'zip' or None for separate image files.
+        count (int): The number of targets written so far.
+    """
+
+    def __init__(self, output, output_format='files', archive=None,
+                 workers=4):
+        """Create the output files and start the writer threads."""
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output format: ' + repr(output_format))
+
+        if archive is not None and archive not in ARCHIVE_FORMATS:
+            raise ValueError('Unknown archive format: ' + repr(archive))
+
+        self.output = output
+        self.output_format = output_format
+        self.archive = archive
+        self.count = 0
+
+        self._executor = ThreadPoolExecutor(workers)
+        self._pending = threading.BoundedSemaphore(workers * 4)
+        self._futures = []
+        self._lock = threading.Lock()
+        self._jsonl = None
+        self._archive = None
+        self._rows = []
+
+        if output_format == 'jsonl':
+            self._jsonl = open(os.path.join(output, 'targets.jsonl'), 'w')
+
+        if archive == 'tar':
+            self._archive = tarfile.open(os.path.join(output, 'targets.tar'),
+                                         'w')
+        elif archive == 'zip':
+            # The JPEGs are already compressed.
+            self._archive = zipfile.ZipFile(
+                os.path.join(output, 'targets.zip'), 'w', zipfile.ZIP_STORED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, filename, target):
+        """Queue a target found in an image to be saved.
+
+        Args:
+            filename (str): The image the target is from.
+            target (Target): The target.
+
+        Returns:
+            int: The number of the target.
+        """
+        num = self.count
+        self.count += 1
+
+        basename_image = 'target-{:06d}.jpg'.format(num)
+
+        if self._archive is None:
+            image_path = os.path.join(self.output, basename_image)
+        else:
+            image_path = basename_image
+
+        meta = target_meta(target, filename, image_path)
+
+        # The lines and rows are added here so they stay in order.
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(meta) + '\n')
+        elif self.output_format == 'npz':
+            self._rows.append((TargetBatch.row(target), filename,
+                               image_path))
+
+        self._raise_errors()
+        self._pending.acquire()
+
+        try:
+            future = self._executor.submit(self._save, num, target,
+                                           image_path, meta)
+        except BaseException:
+            self._pending.release()
+            raise
+
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append(future)
+
+        return num
+
+    def close(self):
+        """Wait for everything queued to be saved and close the files.
+
+        Raises:
+            Exception: The first error any of the writes hit.
+        """
+        try:
+            self._executor.shutdown()
+            self._raise_errors(done_only=False)
+
+            if self.output_format == 'npz':
+                self._save_npz()
+        finally:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+    def _save(self, num, target, image_path, meta):
+        # Read here so a lazy target image is made on the writer thread.
+        image = target.image
+
+        if self._archive is None:
+            image.save(image_path)
+        else:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG')
+            self._add_to_archive(image_path, buffer.getvalue())
+
+        if self.output_format == 'files':
+            basename_meta = 'target-{:06d}.json'.format(num)
+
+            with open(os.path.join(self.output, basename_meta), 'w') as f:
+                json.dump(meta, f, indent=2)
+
+    def _save_npz(self):
+        rows, images, target_images = zip(*self._rows) if self._rows else \
+            ((), (), ())
+
+        batch = TargetBatch(np.array(list(rows), dtype=TARGET_DTYPE))
+        batch.save_npz(os.path.join(self.output, 'targets.npz'),
+                       image=np.array(images, dtype=str),
+                       target_image=np.array(target_images, dtype=str))
+
+    def _add_to_archive(self, name, data):
+        with self._lock:
+            if self.archive == 'tar':
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = time.time()
+                self._archive.addfile(info, io.BytesIO(data))
+            else:
+                self._archive.writestr(name, data)
+
+    def _raise_errors(self, done_only=True):
+        """Raise the first error from the finished writes."""
+        futures = []
+
+        for future in self._futures:
+            if done_only and not future.done():
+                futures.append(future)
+            else:
+                future.result()
+
+        self._futures = futures
+
+
+def target_meta(target, image, target_image=None):
+    """Get the JSON fields saved for a target.
+
+    These are the fields of the .json files and targets.jsonl, and of
+    each target the server responds with.
+
+    Args:
+        target (Target): The target.
+        image (str): The image the target was found in.
+        target_image (str): Where the target image is, if anywhere.
+    """
+    return {
+        'x': target.x,
+        'y': target.y,
+        'width': target.width,
+        'height': target.height,
+        'orientation': target.orientation,
+        'shape': target.shape.name.lower(),
+        'background_color': target.background_color.name.lower(),
+        'alphanumeric': target.alphanumeric,
+        'alphanumeric_color': target.alphanumeric_color.name.lower(),
+        'image': image,
+        'target_image': target_image,
+        'confidence': target.confidence
+    }
@@ -0,0 +1,295 @@
+"""Contains a streaming pipeline for finding targets in many images.
+
+Each step of target finding runs as its own stage with its own worker
+threads. Stages are wired together with bounded queues, so while one
+image is in the detector the next can already be decoded and
+pre-classified, and a slow stage holds back the ones before it instead
+of letting images pile up in memory.
+"""
+
+import queue
+import threading
+
+import cv2
+import numpy as np
+import target_finder_model as tfm
+
+from .classification import (_preclassify_crops, _detect_bboxes,
+                             _finish_targets)
+from .metrics import timer
+from .preprocessing import extract_crops
+
+
+# The stages in the order images go through them.
+STAGES = ('decode', 'tile', 'preclassify', 'detect', 'identify')
+
+# Marks the end of the stream on a queue.
+_DONE = object()
+
+
+def find_targets_stream(sources, **kwargs):
+    """Find targets in a stream of images with a Pipeline.
+
+    See Pipeline for the keyword arguments accepted.
+
+    Args:
+        sources (Iterable): Filenames, BGR arrays, or PIL images.
+
+    Yields:
+        Tuple[object, List[Target]]: Each source with its targets, in
+            the same order as the sources.
+    """
+    return Pipeline(**kwargs).run(sources)
+
+
+class Pipeline(object):
+    """Finds targets in a stream of images with concurrent stages.
+
+    The stages are decode -> tile (extract_crops) -> preclassify
+    (PreClassifier.classify_all) -> detect (Yolo3Detector.detect_all)
+    -> identify (_identify_properties).
+
+    Attributes:
+        limit (int): The max number of targets to return per image.
+        color_method (Union[str, Callable]): How target pixels are
+            split into two colors, see color_separation.
+        segmentation (SegmentationSettings): How much work GrabCut
+            does for each target, see preprocessing.
+        metrics (Metrics): Optional metrics to record stage timings and
+            counts in.
+        target_images (Union[bool, str]): Whether to give the targets
+            images. Use 'copy' if the source arrays are reused, see
+            find_targets_from_array(...).
+        workers (Dict[str, int]): The number of threads for each stage.
+            Stages not listed get one thread.
+        queue_size (int): The max number of images waiting in front of
+            each stage.
+    """
+
+    def __init__(self, limit=20, workers=None, queue_size=2,
+                 color_method='kmeans', segmentation=None, metrics=None,
+                 target_images=True):
+        """Create a new pipeline."""
+        workers = workers or {}
+
+        unknown = set(workers) - set(STAGES)
+        if unknown:
+            raise ValueError('Unknown pipeline stages: ' +
+                             ', '.join(sorted(unknown)))
+
+        self.limit = limit
+        self.color_method = color_method
+        self.segmentation = segmentation
+        self.metrics = metrics
+        self.target_images = target_images
+        self.workers = {stage: workers.get(stage, 1) for stage in STAGES}
+        self.queue_size = queue_size
+
+    def run(self, sources):
+        """Run images through the pipeline.
+
+        Args:
+            sources (Iterable): Filenames, BGR arrays, or PIL images.
+
+        Yields:
+            Tuple[object, List[Target]]: Each source with its targets,
+                in the same order as the sources.
+        """
+        stop = threading.Event()
+        queues = [queue.Queue(self.queue_size) for _ in STAGES]
+        results = queue.Queue(self.queue_size)
+        queues.append(results)
+
+        threads = [threading.Thread(target=self._feed,
+                                    args=(sources, queues[0], stop),
+                                    name='target-finder-pipeline-feed')]
+
+        for i, stage in enumerate(STAGES):
+            func = getattr(self, '_' + stage)
+            count = self.workers[stage]
+            remaining = [count]
+            lock = threading.Lock()
+
+            for _ in range(count):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(func, queues[i], queues[i + 1], stop,
+                          remaining, lock),
+                    name='target-finder-pipeline-' + stage
+                ))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            yield from self._collect(results)
+        finally:
+            # The stage threads notice this within a moment and exit,
+            # even if the stream was closed early.
+            stop.set()
+
+            # Unblock anything still waiting to put onto a full queue.
+            for q in queues:
+                _drain(q)
+
+    def _feed(self, sources, out_queue, stop):
+        """Put the sources onto the first queue."""
+        try:
+            for index, source in enumerate(sources):
+                if stop.is_set():
+                    break
+
+                _put(out_queue, _Frame(index, source), stop)
+        except Exception as e:
+            _put(out_queue, _Failure(e), stop)
+
+        _put(out_queue, _DONE, stop)
+
+    def _work(self, func, in_queue, out_queue, stop, remaining, lock):
+        """Run a stage on each frame until the stream ends."""
+        while not stop.is_set():
+            frame = _get(in_queue, stop)
+
+            if frame is None:
+                return
+
+            if frame is _DONE:
+                # Let the other workers of this stage see the end too,
+                # and only pass it on once all of them are finished.
+                _put(in_queue, _DONE, stop)
+
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+
+                if last:
+                    _put(out_queue, _DONE, stop)
+
+                return
+
+            if not isinstance(frame, _Failure):
+                try:
+                    func(frame)
+                except Exception as e:
+                    frame = _Failure(e)
+
+            _put(out_queue, frame, stop)
+
+    def _collect(self, results):
+        """Yield the finished frames in the order they were fed in."""
+        pending = {}
+        next_index = 0
+
+        while True:
+            frame = results.get()
+
+            if frame is _DONE:
+                break
+
+            if isinstance(frame, _Failure):
+                raise frame.error
+
+            pending[frame.index] = frame
+
+            while next_index in pending:
+                done = pending.pop(next_index)
+                next_index += 1
+                yield done.source, done.targets
+
+    def _decode(self, frame):
+        with timer(self.metrics, 'stage_seconds', {'stage': 'decode'}):
+            self._decode_source(frame)
+
+    def _decode_source(self, frame):
+        source = frame.source
+
+        if isinstance(source, str):
+            image = cv2.imread(source)
+
+            if image is None:
+                raise IOError('Could not read image: "{:s}"'.format(source))
+        elif isinstance(source, np.ndarray):
+            image = source
+        else:
+            image = cv2.cvtColor(np.array(source), cv2.COLOR_RGB2BGR)
+
+        frame.image = image
+
+    def _tile(self, frame):
+        with timer(self.metrics, 'stage_seconds', {'stage': 'tile'}):
+            frame.crops = extract_crops(frame.image, tfm.CROP_SIZE,
+                                        tfm.CROP_OVERLAP)
+
+    def _preclassify(self, frame):
+        with timer(self.metrics, 'stage_seconds', {'stage': 'preclassify'}):
+            frame.crops = _preclassify_crops(frame.crops, self.metrics,
+                                             frame.image)
+
+    def _detect(self, frame):
+        with timer(self.metrics, 'stage_seconds', {'stage': 'detect'}):
+            frame.bboxes = _detect_bboxes(frame.crops, self.metrics,
+                                          frame.image)
+
+        frame.crops = None
+
+    def _identify(self, frame):
+        # The merge and identify timings are recorded inside.
+        frame.targets = _finish_targets(frame.bboxes, frame.image,
+                                        self.limit, metrics=self.metrics,
+                                        color_method=self.color_method,
+                                        segmentation=self.segmentation,
+                                        target_images=self.target_images)
+        frame.image = None
+        frame.bboxes = None
+
+        if self.metrics is not None:
+            self.metrics.inc('frames_total')
+
+
+class _Frame(object):
+    """An image and its intermediate results in the pipeline."""
+
+    def __init__(self, index, source):
+        self.index = index
+        self.source = source
+        self.image = None
+        self.crops = None
+        self.bboxes = None
+        self.targets = None
+
+
+class _Failure(object):
+    """Carries an error from a stage to the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(out_queue, item, stop):
+    """Put onto a queue, giving up if the pipeline was stopped."""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(in_queue, stop):
+    """Get from a queue, or None if the pipeline was stopped."""
+    while not stop.is_set():
+        try:
+            return in_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    return None
+
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
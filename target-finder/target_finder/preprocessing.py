@@ -1,62 +1,269 @@
 """Contains logic for finding and filtering blobs."""
+import time
+
 import cv2
 import numpy as np
 
-from .types import BBox
+from .types import BoxArray
 
 
 def extract_crops(image, size, overlap):
 
-    h, w, _ = image.shape
+    crops = crop_grid(image.shape, size, overlap)
+    crops.images = [image[y1:y2, x1:x2]
+                    for x1, y1, x2, y2 in crops.coords.tolist()]
 
-    crops = []
+    return crops
 
-    for y1 in range(0, h, size[0] - overlap):
 
-        for x1 in range(0, w, size[1] - overlap):
+def crop_grid(shape, size, overlap):
+    """Get the crops extract_crops(...) makes, without their images.
 
-            if y1 + size[0] > h:
-                y1 = h - size[0]
+    Args:
+        shape (Tuple[int, ...]): The (height, width, ...) of the image.
+        size (Tuple[int, int]): The size of the crops.
+        overlap (int): How much the crops overlap.
 
-            if x1 + size[1] > w:
-                x1 = w - size[1]
+    Returns:
+        BoxArray: The crops on the image, row by row.
+    """
+    h, w = shape[:2]
 
-            y2 = y1 + size[0]
-            x2 = x1 + size[1]
+    # Crops past the bottom or right edges are moved back onto the
+    # image, so the last ones can repeat.
+    ys = np.arange(0, h, size[0] - overlap)
+    ys = np.where(ys + size[0] > h, h - size[0], ys)
 
-            crop_ary = image[y1:y2, x1:x2]
-            box = BBox(x1, y1, x2, y2)
-            box.image = crop_ary
+    xs = np.arange(0, w, size[1] - overlap)
+    xs = np.where(xs + size[1] > w, w - size[1], xs)
 
-            crops.append(box)
+    y1, x1 = np.meshgrid(ys, xs, indexing='ij')
 
-    return crops
+    return BoxArray(np.stack([x1, y1, x1 + size[1], y1 + size[0]], axis=-1))
 
 
 def resize_all(image_crops, new_size):
 
-    new_crops = []
+    if not isinstance(image_crops, BoxArray):
+        image_crops = BoxArray.from_boxes(image_crops)
+
+    return BoxArray(image_crops.coords,
+                    images=[cv2.resize(image, new_size)
+                            for image in image_crops.images or []])
+
+
+def scaled_tiles(image, crops, size, image_scale=1):
+    """Get the crops of an image resized, with one resize per region.
+
+    Crops which overlap are grouped into regions, and each region is
+    resized once and sliced into the tiles instead of resizing every
+    crop on its own. A full frame of crops needs a handful of resizes,
+    while a few scattered crops only scale the areas around them.
+
+    Crops are only grouped when their scaled offsets from each other
+    are whole pixels, so each tile samples the same pixels as resizing
+    its crop would. This keeps the crops clamped to the image edges in
+    their own regions.
+
+    Args:
+        image (np.ndarray): The image the crops are from.
+        crops (List[BBox]): The crops, all the same size.
+        size (Tuple[int, int]): The (width, height) of the tiles.
+        image_scale (float): The scale of the image compared to the
+            crop coordinates, for images decoded at a lower resolution.
+
+    Returns:
+        List[np.ndarray]: The tile for each crop. These are views of
+            the scaled regions.
+    """
+    if len(crops) == 0:
+        return []
+
+    if not isinstance(crops, BoxArray):
+        crops = BoxArray.from_boxes(crops)
+
+    w, h = size
+    sx = w / (crops.coords[0, 2] - crops.coords[0, 0]).item()
+    sy = h / (crops.coords[0, 3] - crops.coords[0, 1]).item()
+
+    coords = crops.coords.tolist()
+    tiles = [None] * len(crops)
+
+    for group in _crop_regions(crops, sx, sy):
+        x1 = min(coords[i][0] for i in group)
+        y1 = min(coords[i][1] for i in group)
+        x2 = max(coords[i][2] for i in group)
+        y2 = max(coords[i][3] for i in group)
+
+        region = image[round(y1 * image_scale):round(y2 * image_scale),
+                       round(x1 * image_scale):round(x2 * image_scale)]
+
+        # Passing the scale instead of a size keeps the exact ratio, so
+        # pixels are sampled where resizing each crop would sample them.
+        scaled = cv2.resize(region, None, fx=sx / image_scale,
+                            fy=sy / image_scale)
+
+        # Rounding on a reduced image can leave it a pixel short.
+        if scaled.shape[0] < h or scaled.shape[1] < w:
+            scaled = cv2.resize(region, (max(w, scaled.shape[1]),
+                                         max(h, scaled.shape[0])))
+
+        for i in group:
+            ox = min(round((coords[i][0] - x1) * sx), scaled.shape[1] - w)
+            oy = min(round((coords[i][1] - y1) * sy), scaled.shape[0] - h)
+            tiles[i] = scaled[oy:oy + h, ox:ox + w]
+
+    return tiles
+
+
+def _crop_regions(crops, sx, sy):
+    """Group the indices of overlapping crops with the same scaled phase."""
+    x1, y1, x2, y2 = crops.x1, crops.y1, crops.x2, crops.y2
+    phase_x = np.round(x1 * sx % 1, 6)
+    phase_y = np.round(y1 * sy % 1, 6)
+
+    linked = ((x1[:, None] < x2[None, :]) & (x1[None, :] < x2[:, None]) &
+              (y1[:, None] < y2[None, :]) & (y1[None, :] < y2[:, None]) &
+              (phase_x[:, None] == phase_x[None, :]) &
+              (phase_y[:, None] == phase_y[None, :]))
+
+    parents = list(range(len(crops)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(linked, 1))):
+        parents[find(int(j))] = find(int(i))
+
+    groups = {}
+    for i in range(len(crops)):
+        groups.setdefault(find(i), []).append(i)
+
+    return list(groups.values())
+
+
+class TileBatcher(object):
+    """Resizes and normalizes tiles straight into a reusable blob.
+
+    This produces the same NCHW float32 RGB blob (scaled by 1 / 255)
+    as cv2.dnn.blobFromImages, but the buffer is only reallocated when
+    a larger batch comes in and tiles are written into it directly
+    instead of being resized into new arrays first.
+
+    Attributes:
+        size (Tuple[int, int]): The (width, height) of the blob images.
+    """
+
+    def __init__(self, size):
+        """Create a new batcher for images of a given size."""
+        self.size = size
+
+        w, h = size
+        self._blob = np.empty((0, 3, h, w), np.float32)
+        self._resized = np.empty((h, w, 3), np.uint8)
+
+    def fill(self, images):
+        """Write the images into the blob.
+
+        Args:
+            images (List[np.ndarray]): The BGR images to use. They are
+                resized if they aren't the batcher's size already.
+
+        Returns:
+            np.ndarray: The (n, 3, h, w) blob for the images. This is
+                overwritten on the next call.
+        """
+        n = len(images)
+        w, h = self.size
+
+        if self._blob.shape[0] < n:
+            self._blob = np.empty((n, 3, h, w), np.float32)
+
+        blob = self._blob[:n]
 
-    for crop in image_crops:
+        for i, image in enumerate(images):
+            if image.shape[:2] != (h, w):
+                image = cv2.resize(image, self.size, dst=self._resized)
 
-        new_image = cv2.resize(crop.image, new_size)
-        box = BBox(crop.x1, crop.y1, crop.x2, crop.y2)
-        box.image = new_image
-        new_crops.append(box)
+            # BGR (h, w, c) -> RGB (c, h, w), scaled into the blob.
+            np.multiply(image[:, :, ::-1].transpose(2, 0, 1),
+                        np.float32(1 / 255), out=blob[i], dtype=np.float32)
 
-    return new_crops
+        return blob
 
 
-def extract_contour(img):
+class SegmentationSettings(object):
+    """Controls how much work GrabCut does for each target.
+
+    The defaults match running 5 GrabCut iterations on the full crop.
+
+    Attributes:
+        iterations (int): The max number of GrabCut iterations.
+        scale (float): How much the crop is resized before GrabCut. The
+            mask is resized back up afterwards.
+        max_pixels (int): If set, crops are downscaled further so
+            GrabCut runs on at most this many pixels.
+        tolerance (float): If set, GrabCut stops once less than this
+            fraction of the mask changes in an iteration.
+        refine_iterations (int): The number of GrabCut iterations run
+            at full size, starting from the upscaled mask, when the
+            crop was downscaled.
+        min_size (int): Crops are never downscaled so their shorter
+            side is under this, since GrabCut falls apart on tiny crops.
+    """
+
+    def __init__(self, iterations=5, scale=1.0, max_pixels=None,
+                 tolerance=None, refine_iterations=0, min_size=96):
+        """Create new segmentation settings."""
+        self.iterations = iterations
+        self.scale = scale
+        self.max_pixels = max_pixels
+        self.tolerance = tolerance
+        self.refine_iterations = refine_iterations
+        self.min_size = min_size
+
+    def get_scale(self, h, w):
+        """Get the scale to use for a crop of a given size."""
+        scale = self.scale
+
+        if self.max_pixels is not None and h * w * scale ** 2 > \
+                self.max_pixels:
+            scale = (self.max_pixels / (h * w)) ** 0.5
+
+        scale = max(scale, self.min_size / min(h, w))
+
+        return min(scale, 1.0)
+
+
+def extract_contour(img, settings=None, stats=None):
+    """Find the contour of the target in a padded crop.
+
+    Args:
+        img (np.ndarray): The BGR crop around the target.
+        settings (SegmentationSettings): Optional GrabCut settings.
+        stats (dict): If given, 'grabcut_time' (seconds),
+            'grabcut_iterations' and 'grabcut_scale' are set on it.
+
+    Returns:
+        np.ndarray: The largest contour found.
+    """
+    if settings is None:
+        settings = _default_segmentation
+
+    start = time.perf_counter()
 
     h, w, _ = img.shape
 
-    # Seperate foreground w/YOLO's bbox as reference
-    mask = np.zeros((h, w), np.uint8)
-    bgdModel = np.zeros((1, 65), np.float64)
-    fgdModel = np.zeros((1, 65), np.float64)
-    bbox = (24, 24, w - 52, h - 52)
-    cv2.grabCut(img, mask, bbox, bgdModel, fgdModel, 5, cv2.GC_INIT_WITH_RECT)
+    scale = settings.get_scale(h, w)
+    mask, iterations = _grab_cut(img, scale, settings)
+
+    if stats is not None:
+        stats['grabcut_time'] = time.perf_counter() - start
+        stats['grabcut_iterations'] = iterations
+        stats['grabcut_scale'] = scale
 
     # Extract shape using foreground mask
     mask_fg = np.where((mask == 2) | (mask == 0), 0, 1)
@@ -76,3 +283,72 @@ def extract_contour(img):
             max_area = width * height
 
     return main_contour
+
+
+def _grab_cut(img, scale, settings):
+    """Run GrabCut on a possibly downscaled crop.
+
+    Returns:
+        Tuple[np.ndarray, int]: The mask at the crop's size and the
+            number of iterations run.
+    """
+    h, w, _ = img.shape
+
+    if scale < 1:
+        small = cv2.resize(img, (max(1, round(w * scale)),
+                                 max(1, round(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    else:
+        small = img
+
+    sh, sw, _ = small.shape
+    sx, sy = sw / w, sh / h
+
+    # Seperate foreground w/YOLO's bbox as reference
+    mask = np.zeros((sh, sw), np.uint8)
+    bgdModel = np.zeros((1, 65), np.float64)
+    fgdModel = np.zeros((1, 65), np.float64)
+    bbox = (round(24 * sx), round(24 * sy),
+            sw - round(52 * sx), sh - round(52 * sy))
+
+    if settings.tolerance is None:
+        cv2.grabCut(small, mask, bbox, bgdModel, fgdModel,
+                    settings.iterations, cv2.GC_INIT_WITH_RECT)
+        iterations = settings.iterations
+    else:
+        # Run one iteration at a time so we can stop early.
+        mode = cv2.GC_INIT_WITH_RECT
+        iterations = 0
+        last_fg = None
+
+        while iterations < settings.iterations:
+            cv2.grabCut(small, mask, bbox, bgdModel, fgdModel, 1, mode)
+            mode = cv2.GC_EVAL
+            iterations += 1
+
+            fg = (mask == 1) | (mask == 3)
+
+            if last_fg is not None and \
+                    np.mean(fg != last_fg) < settings.tolerance:
+                break
+
+            last_fg = fg
+
+    if small is not img:
+        mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+
+        if settings.refine_iterations > 0 and _has_both_labels(mask):
+            cv2.grabCut(img, mask, None, bgdModel, fgdModel,
+                        settings.refine_iterations, cv2.GC_INIT_WITH_MASK)
+            iterations += settings.refine_iterations
+
+    return mask, iterations
+
+
+def _has_both_labels(mask):
+    """Check a GrabCut mask has both foreground and background."""
+    fg = (mask == 1) | (mask == 3)
+    return fg.any() and not fg.all()
+
+
+_default_segmentation = SegmentationSettings()
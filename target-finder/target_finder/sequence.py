@@ -0,0 +1,183 @@
+"""Contains an incremental target finder for sequences of frames.
+
+Consecutive frames from a video stream mostly repeat the same tiles, so
+the model results for a tile can be reused until it changes enough.
+"""
+
+import cv2
+import numpy as np
+import target_finder_model as tfm
+
+from .classification import (_classify_crops, _detect_offset_bboxes,
+                             _finish_targets, _normalize_bboxes)
+from .metrics import timer
+from .preprocessing import extract_crops
+
+
+class FrameSequenceFinder(object):
+    """Finds targets in a sequence of frames, reusing unchanged tiles.
+
+    Each tile is compared with a small grayscale thumbnail of itself
+    from when the models last ran on it. Tiles whose mean absolute
+    difference is below the threshold reuse the pre-classifier and
+    detector results from then, and the rest are run through the
+    models again. Comparing against the last inferred tile instead of
+    the last frame means slow drift is still noticed.
+
+    Every tile is re-run every refresh_interval frames no matter what,
+    so the results can't go stale. The targets are then merged and
+    identified on each frame as usual.
+
+    Attributes:
+        threshold (float): The max mean absolute difference (0-255) for
+            a tile to be reused.
+        refresh_interval (int): Tiles are run through the models at
+            least once every this many frames. None never forces a
+            refresh.
+        limit (int): The max number of targets to return per frame.
+        thumbnail_size (Tuple[int, int]): The size tiles are shrunk to
+            before comparing them.
+        tiles_inferred (int): The number of tiles run through the
+            models so far.
+        tiles_reused (int): The number of tiles reused so far.
+    """
+
+    def __init__(self, threshold=2.0, refresh_interval=30, limit=20,
+                 thumbnail_size=(32, 32), metrics=None, **kwargs):
+        """Create a new finder.
+
+        Other keyword arguments are passed on to _identify_properties,
+        see find_targets_from_array(...).
+        """
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.limit = limit
+        self.thumbnail_size = thumbnail_size
+        self.metrics = metrics
+        self.kwargs = kwargs
+
+        self.tiles_inferred = 0
+        self.tiles_reused = 0
+
+        self._shape = None
+        self._tiles = {}
+
+    def reset(self):
+        """Forget the previous frames."""
+        self._shape = None
+        self._tiles = {}
+
+    def find(self, image):
+        """Find the targets in the next frame.
+
+        Args:
+            image (np.ndarray): The BGR frame.
+
+        Returns:
+            List[Target]: The targets found.
+        """
+        metrics = self.metrics
+
+        # Tiles can only be matched up between frames of the same size.
+        if image.shape != self._shape:
+            self.reset()
+            self._shape = image.shape
+
+        with timer(metrics, 'frame_seconds'):
+            with timer(metrics, 'stage_seconds', {'stage': 'tile'}):
+                crops = extract_crops(image, tfm.CROP_SIZE,
+                                      tfm.CROP_OVERLAP)
+
+            raw_bboxes = self._run_models(image, crops)
+
+            targets = _finish_targets(raw_bboxes, image, self.limit,
+                                      metrics=metrics, **self.kwargs)
+
+        if metrics is not None:
+            metrics.inc('frames_total')
+
+        return targets
+
+    def _run_models(self, image, crops):
+        metrics = self.metrics
+        thumbs = {}
+        changed = []
+        reused = 0
+
+        for i, crop in enumerate(crops):
+            key = _crop_key(crop)
+
+            # Crops at the edges of the frame can repeat.
+            if key in thumbs:
+                continue
+
+            thumbs[key] = thumb = self._thumbnail(crop.image)
+            tile = self._tiles.get(key)
+
+            if tile is None or self._is_stale(tile, thumb):
+                changed.append(i)
+            else:
+                tile.age += 1
+                reused += 1
+
+        with timer(metrics, 'stage_seconds', {'stage': 'preclassify'}):
+            keeps = _classify_crops([crops[i] for i in changed], image)
+
+        kept = [i for i, keep in zip(changed, keeps) if keep]
+
+        with timer(metrics, 'stage_seconds', {'stage': 'detect'}):
+            offset_bboxes = _detect_offset_bboxes([crops[i] for i in kept],
+                                                  image)
+
+        for i in changed:
+            key = _crop_key(crops[i])
+            self._tiles[key] = _Tile(thumbs[key], False, [])
+
+        for i, bboxes in zip(kept, offset_bboxes):
+            tile = self._tiles[_crop_key(crops[i])]
+            tile.kept = True
+            tile.bboxes = bboxes
+
+        self.tiles_inferred += len(changed)
+        self.tiles_reused += reused
+
+        tiles = [self._tiles[_crop_key(crop)] for crop in crops]
+        normalized_bboxes = [box for crop, tile in zip(crops, tiles)
+                             for box in _normalize_bboxes(crop, tile.bboxes)]
+
+        if metrics is not None:
+            metrics.inc('tiles_total', len(crops))
+            metrics.inc('tiles_kept_total', sum(tile.kept for tile in tiles))
+            metrics.inc('tiles_reused_total', reused)
+            metrics.inc('raw_boxes_total', len(normalized_bboxes))
+
+        return normalized_bboxes
+
+    def _thumbnail(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        return cv2.resize(gray, self.thumbnail_size,
+                          interpolation=cv2.INTER_AREA)
+
+    def _is_stale(self, tile, thumb):
+        if self.refresh_interval is not None and \
+                tile.age + 1 >= self.refresh_interval:
+            return True
+
+        diff = cv2.absdiff(tile.thumb, thumb)
+
+        return float(np.mean(diff)) > self.threshold
+
+
+class _Tile(object):
+    """The model results for a tile and what it looked like then."""
+
+    def __init__(self, thumb, kept, bboxes):
+        self.thumb = thumb
+        self.kept = kept
+        self.bboxes = bboxes
+        self.age = 0
+
+
+def _crop_key(crop):
+    return crop.x1, crop.y1, crop.x2, crop.y2
@@ -0,0 +1,370 @@
+"""Contains a long-running HTTP server for finding targets.
+
+The server keeps the models loaded between requests, and requests that
+arrive together share model passes through find_targets_batch(...).
+It only needs the standard library's asyncio, and speaks just enough
+HTTP/1.1 for clients like curl and requests.
+
+Endpoints:
+    POST /targets: Find the targets in an image. The body is either the
+        encoded image (e.g. a JPEG) or a JSON object with the "path" of
+        an image on the server. The response is {"targets": [...]},
+        with the same fields the targets subcommand saves for each
+        target, where "image" is the path given (or null) and
+        "target_image" is the target image as a base64 JPEG.
+    GET /health: {"status": "ok"} once the models are loaded.
+    GET /metrics: The server's Metrics in the Prometheus text format.
+"""
+
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+
+import cv2
+import numpy as np
+
+from .classification import find_targets_batch, preload
+from .metrics import Metrics
+from .output import target_meta
+
+
+_ROUTES = ('/health', '/metrics', '/targets')
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error'
+}
+
+
+class TargetServer(object):
+    """Finds targets in images sent over HTTP, batching requests.
+
+    Images are queued as they arrive. The first image waits up to
+    max_delay seconds for others to join it, and then up to batch_size
+    images are sent through the models together. The models run on a
+    single thread, so images arriving during a batch are queued for
+    the next one.
+
+    Attributes:
+        limit (int): The max number of targets to return per image.
+        batch_size (int): The max number of images per batch.
+        max_delay (float): The max seconds to wait for a batch to fill.
+        max_body_size (int): The largest request body accepted, in
+            bytes.
+        metrics (Metrics): The metrics recorded for the requests and
+            the images.
+    """
+
+    def __init__(self, limit=10, batch_size=8, max_delay=0.01,
+                 max_body_size=64 * 1024 * 1024, metrics=None, **kwargs):
+        """Create a new server.
+
+        Other keyword arguments are passed on to find_targets_batch(...).
+        """
+        self.limit = limit
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_body_size = max_body_size
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.kwargs = kwargs
+
+        self._queue = None
+        self._batcher = None
+        self._servers = []
+        self._model_executor = ThreadPoolExecutor(1)
+
+    async def start(self, host='127.0.0.1', port=8080, path=None):
+        """Load the models and start listening.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 picks a free one.
+            path (str): A Unix socket to listen on instead, if given.
+
+        Returns:
+            asyncio.AbstractServer: The server listening.
+        """
+        loop = asyncio.get_event_loop()
+
+        await loop.run_in_executor(self._model_executor, preload)
+
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = loop.create_task(self._batch_loop())
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+
+        self._servers.append(server)
+
+        return server
+
+    async def stop(self):
+        """Stop listening and finish the batch loop."""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+
+        self._servers = []
+
+        if self._batcher is not None:
+            self._batcher.cancel()
+
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+
+            self._batcher = None
+
+        self._model_executor.shutdown()
+
+    def run(self, host='127.0.0.1', port=8080, path=None):
+        """Serve requests until interrupted."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            loop.run_until_complete(self.start(host, port, path))
+
+            print('Listening on {:s}'.format(
+                path or 'http://{:s}:{:d}'.format(host, port)))
+
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+    async def find(self, image):
+        """Queue a BGR image and wait for its targets."""
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((image, future))
+
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.batch_size:
+                # Anything already waiting joins even after the deadline.
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [image for image, _ in batch]
+            self.metrics.inc('server_batches_total')
+
+            try:
+                results = await loop.run_in_executor(
+                    self._model_executor, self._find_batch, images)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), targets in zip(batch, results):
+                    if not future.done():
+                        future.set_result(targets)
+
+    def _find_batch(self, images):
+        return find_targets_batch(images, limit=self.limit,
+                                  metrics=self.metrics, **self.kwargs)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader, self.max_body_size)
+
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+
+                try:
+                    status, content_type, content = \
+                        await self._respond(method, path, body)
+                except _HTTPError as e:
+                    status, content_type, content = e.status, *_json_body(
+                        {'error': e.message})
+                except Exception as e:
+                    status, content_type, content = 500, *_json_body(
+                        {'error': str(e)})
+
+                route = path.split('?', 1)[0]
+                self.metrics.inc('server_requests_total', labels={
+                    'path': route if route in _ROUTES else 'other',
+                    'status': status})
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await _write_response(writer, status, content_type, content,
+                                      keep_alive)
+
+                if not keep_alive:
+                    break
+        except _HTTPError as e:
+            await _write_response(writer, e.status,
+                                  *_json_body({'error': e.message}), False)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, path, body):
+        path = path.split('?', 1)[0]
+
+        if path == '/health':
+            _check_method(method, 'GET')
+            return (200, *_json_body({'status': 'ok'}))
+
+        if path == '/metrics':
+            _check_method(method, 'GET')
+            return (200, 'text/plain; version=0.0.4',
+                    self.metrics.to_prometheus().encode())
+
+        if path == '/targets':
+            _check_method(method, 'POST')
+
+            loop = asyncio.get_event_loop()
+
+            image, image_path = await loop.run_in_executor(
+                None, _decode_body, body)
+            targets = await self.find(image)
+
+            # Encoding the target images would hold up other requests.
+            metas = await loop.run_in_executor(
+                None, _targets_meta, targets, image_path)
+
+            return (200, *_json_body({'targets': metas}))
+
+        raise _HTTPError(404, 'Unknown path: ' + path)
+
+
+class _HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def _read_request(reader, max_body_size):
+    """Read the next request, or None if the connection was closed."""
+    line = await reader.readline()
+
+    if not line:
+        return None
+
+    try:
+        method, path, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise _HTTPError(400, 'Bad request line')
+
+    headers = {}
+
+    while True:
+        line = await reader.readline()
+
+        if line in (b'\r\n', b'\n', b''):
+            break
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise _HTTPError(400, 'Bad Content-Length')
+
+    if length > max_body_size:
+        raise _HTTPError(413, 'Request body is too large')
+
+    body = await reader.readexactly(length) if length else b''
+
+    return method.upper(), path, headers, body
+
+
+async def _write_response(writer, status, content_type, content, keep_alive):
+    head = ('HTTP/1.1 {:d} {:s}\r\n'
+            'Content-Type: {:s}\r\n'
+            'Content-Length: {:d}\r\n'
+            'Connection: {:s}\r\n\r\n').format(
+        status, _REASONS.get(status, ''), content_type, len(content),
+        'keep-alive' if keep_alive else 'close')
+
+    writer.write(head.encode('latin-1') + content)
+    await writer.drain()
+
+
+def _check_method(method, allowed):
+    if method != allowed:
+        raise _HTTPError(405, 'Use ' + allowed)
+
+
+def _json_body(value):
+    return 'application/json', json.dumps(value).encode()
+
+
+def _decode_body(body):
+    """Decode an uploaded image, or read the image at a JSON path.
+
+    Returns:
+        Tuple[np.ndarray, str]: The BGR image and its path, if given.
+    """
+    path = None
+
+    if body[:1] == b'{':
+        try:
+            path = json.loads(body.decode())['path']
+        except (ValueError, KeyError, TypeError):
+            raise _HTTPError(400, 'Expected a JSON object with a "path"')
+
+        image = cv2.imread(path)
+    else:
+        image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+
+    if image is None:
+        raise _HTTPError(400, 'Could not read the image')
+
+    return image, path
+
+
+def _targets_meta(targets, image_path):
+    """Get the fields of each target with its image encoded."""
+    return [target_meta(target, image_path, _encode_image(target.image))
+            for target in targets]
+
+
+def _encode_image(image):
+    """Encode a target image as a base64 JPEG."""
+    if image is None:
+        return None
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
@@ -0,0 +1,191 @@
+"""Contains a cache of model results for tiles seen before.
+
+Tiles are keyed by a hash of their pixels, the model version and the
+models in use, so re-running the same imagery (or overlapping captures
+with identical tiles) can skip the pre-classifier and detector for
+tiles it already knows.
+"""
+
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import target_finder_model as tfm
+
+
+class TileCache(object):
+    """An LRU cache of pre-classifier and detector results for tiles.
+
+    Each entry is whether the pre-classifier kept the tile and the raw
+    detector boxes (relative to the tile) for it. The most recently used
+    entries are kept in memory. If a path is given, every entry is also
+    saved in an SQLite database there so later runs can use them.
+
+    The database keeps up to max_rows entries, dropping the least
+    recently used ones when more are added. An entry counts as used when
+    it's saved or read from the database, but not when it's found in
+    memory.
+
+    The cache is thread-safe, and several processes can share a
+    database file.
+
+    Attributes:
+        max_size (int): The max number of entries kept in memory.
+        path (str): The optional SQLite database file.
+        max_rows (int): The max number of entries kept in the database,
+            or None for no limit.
+        version (str): The model version entries are stored under.
+    """
+
+    def __init__(self, max_size=10000, path=None, version=None,
+                 max_rows=1000000):
+        """Create a new cache, opening the database if a path is given."""
+        self.max_size = max_size
+        self.path = path
+        self.max_rows = max_rows
+        self.version = version or getattr(tfm, '__version__', 'unknown')
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30,
+                                       check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS tiles '
+                             '(key TEXT PRIMARY KEY, value TEXT, '
+                             'last_used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS tiles_last_used '
+                             'ON tiles (last_used)')
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, tile, models=''):
+        """Get the key for a tile's pixels.
+
+        Args:
+            tile (np.ndarray): The tile image.
+            models (str): Describes the models and backend the results
+                are from, so results from others aren't reused.
+
+        Returns:
+            str: The hash of the pixels, shape, model version and
+                models.
+        """
+        tile = np.ascontiguousarray(tile)
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.version.encode())
+        digest.update(models.encode() + b'\0')
+        digest.update(str(tile.shape).encode())
+        digest.update(tile.data)
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Get the entry for a key.
+
+        Returns:
+            Tuple[bool, List[tuple]]: Whether the tile was kept and its
+                (name, conf, [left, top, width, height]) detections, or
+                None if the tile isn't known.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute('SELECT value FROM tiles WHERE key = ?',
+                                       (key,)).fetchone()
+
+                if row is not None:
+                    entry = _decode_entry(row[0])
+                    self._add(key, entry)
+
+                    self._db.execute('UPDATE tiles SET last_used = ? '
+                                     'WHERE key = ?', (time.time(), key))
+                    self._db.commit()
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return entry
+
+    def put(self, key, kept, detections):
+        """Save the results for a tile."""
+        self.put_many([(key, kept, detections)])
+
+    def put_many(self, results):
+        """Save the results for several tiles at once.
+
+        Args:
+            results (Iterable[Tuple[str, bool, List[tuple]]]): The key,
+                whether the tile was kept, and the detections for each
+                tile.
+        """
+        entries = [(key, (bool(kept), [(name, float(conf),
+                                        [int(v) for v in bbox])
+                                       for name, conf, bbox in detections]))
+                   for key, kept, detections in results]
+
+        with self._lock:
+            for key, entry in entries:
+                self._add(key, entry)
+
+            if self._db is not None:
+                now = time.time()
+
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?)',
+                    [(key, json.dumps(entry), now) for key, entry in entries])
+                self._evict_rows()
+                self._db.commit()
+
+    def clear(self):
+        """Remove the entries in memory, the database is kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        """Close the database if there is one."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _evict_rows(self):
+        """Drop the least recently used rows over max_rows."""
+        if self.max_rows is None:
+            return
+
+        count, = self._db.execute('SELECT COUNT(*) FROM tiles').fetchone()
+
+        if count > self.max_rows:
+            self._db.execute('DELETE FROM tiles WHERE key IN (SELECT key '
+                             'FROM tiles ORDER BY last_used LIMIT ?)',
+                             (count - self.max_rows,))
+
+    def _add(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def _decode_entry(value):
+    kept, detections = json.loads(value)
+
+    return kept, [tuple(detection) for detection in detections]
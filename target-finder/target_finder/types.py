@@ -1,7 +1,11 @@
 """Contains basic storage types passed around in the library."""
 
+import json
 from enum import Enum, unique
 
+import numpy as np
+import PIL.Image
+
 
 @unique
 class Color(Enum):
@@ -52,13 +56,15 @@ class Shape(Enum):
 
 class BBox(object):
 
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'image', 'meta', 'confidence')
+
     def __init__(self, x1, y1, x2, y2):
         self.x1 = x1
         self.y1 = y1
         self.x2 = x2
         self.y2 = y2
         self.image = None
-        self.meta = ''
+        self.meta = {}
         self.confidence = -1
 
     @property
@@ -70,6 +76,225 @@ class BBox(object):
         return self.y2 - self.y1
 
 
+# The most candidate pairs BoxArray.iter_intersecting_pairs(...) compares
+# at once.
+PAIR_CHUNK_SIZE = 1 << 20
+
+
+class BoxArray(object):
+    """Many boxes stored as arrays instead of a BBox each.
+
+    The (x1, y1, x2, y2) coordinates are rows of a single array and the
+    confidences are another, so operations on all the boxes can be
+    vectorized. The meta dicts and images are optional lists.
+
+    Indexing with an int gives a BBox for that row, and indexing with a
+    slice, an index array or a boolean mask gives a smaller BoxArray.
+    Iterating gives a BBox per row, and arrays can be joined with +, so a
+    BoxArray can be passed where a list of boxes is expected.
+
+    Attributes:
+        coords (np.ndarray): The (n, 4) box coordinates.
+        confidence (np.ndarray): The confidence of each box, -1 if
+            unknown.
+        meta (List[dict]): The meta of each box, or None.
+        images (List[np.ndarray]): The image of each box, or None.
+    """
+
+    def __init__(self, coords=None, confidence=None, meta=None, images=None):
+        """Create boxes from their coordinates."""
+        if coords is None:
+            coords = np.empty((0, 4))
+
+        self.coords = np.asarray(coords).reshape(-1, 4)
+
+        if confidence is None:
+            confidence = np.full(len(self.coords), -1.0)
+
+        self.confidence = np.asarray(confidence, dtype=np.float64)
+        self.meta = meta
+        self.images = images
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        """Create an array from a list of BBoxes."""
+        boxes = list(boxes)
+
+        images = [box.image for box in boxes]
+
+        return cls([(box.x1, box.y1, box.x2, box.y2) for box in boxes],
+                   [box.confidence for box in boxes],
+                   [box.meta for box in boxes],
+                   images if any(image is not None for image in images)
+                   else None)
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """Join several arrays of boxes into one."""
+        arrays = list(arrays)
+
+        if not arrays:
+            return cls()
+
+        def join(lists, lengths):
+            if all(items is None for items in lists):
+                return None
+
+            return [item for items, length in zip(lists, lengths)
+                    for item in (items if items is not None
+                                 else [None] * length)]
+
+        lengths = [len(array) for array in arrays]
+
+        return cls(np.concatenate([array.coords for array in arrays]),
+                   np.concatenate([array.confidence for array in arrays]),
+                   join([array.meta for array in arrays], lengths),
+                   join([array.images for array in arrays], lengths))
+
+    @property
+    def x1(self):
+        return self.coords[:, 0]
+
+    @property
+    def y1(self):
+        return self.coords[:, 1]
+
+    @property
+    def x2(self):
+        return self.coords[:, 2]
+
+    @property
+    def y2(self):
+        return self.coords[:, 3]
+
+    @property
+    def w(self):
+        return self.x2 - self.x1
+
+    @property
+    def h(self):
+        return self.y2 - self.y1
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            box = BBox(*self.coords[key].tolist())
+            box.confidence = self.confidence[key].item()
+
+            # Parts joined without meta have None for it.
+            if self.meta is not None and self.meta[key] is not None:
+                box.meta = self.meta[key]
+
+            if self.images is not None:
+                box.image = self.images[key]
+
+            return box
+
+        indices = np.arange(len(self))[key]
+
+        return BoxArray(self.coords[indices], self.confidence[indices],
+                        _take(self.meta, indices),
+                        _take(self.images, indices))
+
+    def __add__(self, other):
+        if not isinstance(other, BoxArray):
+            other = BoxArray.from_boxes(other)
+
+        return BoxArray.concatenate([self, other])
+
+    def __repr__(self):
+        return 'BoxArray({:d} boxes)'.format(len(self))
+
+    def intersects(self, other):
+        """Check which boxes intersect which other boxes.
+
+        Boxes which only touch along an edge count as intersecting.
+
+        Args:
+            other (BoxArray): The other boxes.
+
+        Returns:
+            np.ndarray: An (n, m) boolean matrix, True where box i of
+                this array intersects box j of the other.
+        """
+        return ((self.x1[:, None] <= other.x2[None, :]) &
+                (other.x1[None, :] <= self.x2[:, None]) &
+                (self.y1[:, None] <= other.y2[None, :]) &
+                (other.y1[None, :] <= self.y2[:, None]))
+
+    def intersecting_pairs(self):
+        """Find the pairs of boxes in this array which intersect.
+
+        This sweeps along the x-axis, so only boxes overlapping along
+        it are compared instead of every pair.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The indices i and j of each
+                intersecting pair, with i < j.
+        """
+        chunks = list(self.iter_intersecting_pairs())
+
+        if not chunks:
+            return np.empty(0, np.intp), np.empty(0, np.intp)
+
+        return tuple(np.concatenate(part) for part in zip(*chunks))
+
+    def iter_intersecting_pairs(self, max_pairs=PAIR_CHUNK_SIZE):
+        """Find the pairs of boxes which intersect a chunk at a time.
+
+        This is the same sweep as intersecting_pairs(), but only up to
+        max_pairs candidate pairs are compared at once, so the memory
+        used stays bounded when many boxes overlap along the x-axis.
+
+        Args:
+            max_pairs (int): The most candidate pairs in one chunk,
+                unless a single box has more.
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray]: The indices i and j of the
+                intersecting pairs in each chunk, with i < j.
+        """
+        n = len(self)
+        order = np.argsort(self.x1, kind='stable')
+        x1, y1, x2, y2 = self.coords[order].T
+
+        # Each box is compared with the following boxes starting before
+        # it ends.
+        ends = np.searchsorted(x1, x2, side='right')
+        counts = np.maximum(ends - np.arange(n) - 1, 0)
+        totals = np.cumsum(counts)
+
+        begin = 0
+
+        while begin < n:
+            # Taking the boxes up to max_pairs more candidates.
+            done = totals[begin] - counts[begin]
+            end = max(int(np.searchsorted(totals, done + max_pairs,
+                                          side='right')), begin + 1)
+
+            part = counts[begin:end]
+            a = np.repeat(np.arange(begin, end), part)
+            b = a + 1 + np.arange(len(a)) - \
+                np.repeat(np.cumsum(part) - part, part)
+
+            hits = (y1[a] <= y2[b]) & (y1[b] <= y2[a])
+            i, j = order[a[hits]], order[b[hits]]
+
+            yield np.minimum(i, j), np.maximum(i, j)
+
+            begin = end
+
+
+def _take(items, indices):
+    return None if items is None else [items[i] for i in indices.tolist()]
+
+
 class Target(object):
     """Represents a target found on an image.
 
@@ -98,11 +323,18 @@ class Target(object):
             A-Z, a-z. Typically, this will only be one capital
             letter.
         alphanumeric_color (Color): The target alphanumeric color.
-        image (PIL.Image): Image showing the target.
+        image (PIL.Image): Image showing the target. If the target was
+            given a view of the frame with set_image_view(...), this is
+            only made the first time it's read, so changes made to the
+            frame before then show up in it.
         confidence (float): The confidence that the target exists
             (0 <= confidence <= 1).
     """
 
+    __slots__ = ('x', 'y', 'width', 'height', 'shape', 'orientation',
+                 'background_color', 'alphanumeric', 'alphanumeric_color',
+                 'confidence', '_image', '_image_view')
+
     def __init__(self, x, y, width, height, shape=Shape.NAS, orientation=0.0,
                  background_color=Color.NONE, alphanumeric='',
                  alphanumeric_color=Color.NONE, image=None, confidence=0.0):
@@ -119,6 +351,35 @@ class Target(object):
         self.image = image
         self.confidence = confidence
 
+    @property
+    def image(self):
+        if self._image is None and self._image_view is not None:
+            # The view is BGR, like the frames from OpenCV.
+            self._image = PIL.Image.fromarray(
+                np.ascontiguousarray(self._image_view[..., ::-1]))
+            self._image_view = None
+
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+        self._image_view = None
+
+    def set_image_view(self, view):
+        """Make the image from a BGR view of the frame when it's read.
+
+        The view keeps the frame it's from in memory until the image is
+        read or the target is dropped. The image is made from whatever
+        the frame holds when it's read, so pass a copy if the frame
+        will be reused or drawn on before then.
+
+        Args:
+            view (np.ndarray): The BGR pixels of the target image.
+        """
+        self._image = None
+        self._image_view = view
+
     def overlaps(self, other_target):
 
         if (self.x > other_target.x + other_target.width or
@@ -143,3 +404,146 @@ class Target(object):
             f'alphanumeric={repr(self.alphanumeric)}, '
             f'alphanumeric_color={self.alphanumeric_color})'
         )
+
+
+# The columns of a TargetBatch. Shapes and colors are stored as the
+# values of their enums, and alphanumerics can be up to
+# MAX_ALPHANUMERIC characters long.
+MAX_ALPHANUMERIC = 8
+
+TARGET_DTYPE = np.dtype([
+    ('x', np.float64),
+    ('y', np.float64),
+    ('width', np.float64),
+    ('height', np.float64),
+    ('orientation', np.float64),
+    ('shape', np.uint8),
+    ('background_color', np.uint8),
+    ('alphanumeric', 'U{:d}'.format(MAX_ALPHANUMERIC)),
+    ('alphanumeric_color', np.uint8),
+    ('confidence', np.float64)
+])
+
+
+class TargetBatch(object):
+    """Targets stored column by column in a NumPy structured array.
+
+    This is a compact form for when only the positions, shapes, colors
+    and confidences are needed: there's no Python object per target and
+    no target image. Columns can be read by name, e.g.
+    batch['confidence']. Alphanumerics longer than MAX_ALPHANUMERIC
+    characters can't be stored, and are rejected with a ValueError.
+
+    Attributes:
+        array (np.ndarray): The targets, with the TARGET_DTYPE fields.
+    """
+
+    def __init__(self, array=None):
+        """Wrap a structured array, or create an empty batch."""
+        if array is None:
+            array = np.empty(0, dtype=TARGET_DTYPE)
+
+        self.array = np.asarray(array, dtype=TARGET_DTYPE)
+
+    @classmethod
+    def from_targets(cls, targets):
+        """Create a batch from a list of targets, leaving out images."""
+        return cls(np.array([cls.row(target) for target in targets],
+                            dtype=TARGET_DTYPE))
+
+    @staticmethod
+    def row(target):
+        """Get the row for a target, as a tuple of TARGET_DTYPE fields.
+
+        Raises:
+            ValueError: If the alphanumeric is too long to store.
+        """
+        if target.alphanumeric is not None and \
+                len(target.alphanumeric) > MAX_ALPHANUMERIC:
+            raise ValueError('Alphanumerics can only be {:d} characters '
+                             'long in a TargetBatch: {!r}'.format(
+                                 MAX_ALPHANUMERIC, target.alphanumeric))
+
+        return (target.x, target.y, target.width, target.height,
+                target.orientation, target.shape.value,
+                target.background_color.value, target.alphanumeric,
+                target.alphanumeric_color.value, target.confidence)
+
+    @classmethod
+    def concatenate(cls, batches):
+        """Join several batches into one."""
+        return cls(np.concatenate([batch.array for batch in batches] +
+                                  [np.empty(0, dtype=TARGET_DTYPE)]))
+
+    @classmethod
+    def load_npz(cls, file):
+        """Load a batch saved with save_npz(...)."""
+        with np.load(file) as data:
+            return cls(data['targets'])
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, key):
+        """Get a column by name, or a batch of the rows selected."""
+        if isinstance(key, str):
+            return self.array[key]
+
+        return TargetBatch(np.atleast_1d(self.array[key]))
+
+    def __repr__(self):
+        return 'TargetBatch({:d} targets)'.format(len(self))
+
+    def to_targets(self):
+        """Turn the batch back into a list of targets without images."""
+        return [Target(row['x'].item(), row['y'].item(),
+                       row['width'].item(), row['height'].item(),
+                       shape=Shape(row['shape']),
+                       orientation=row['orientation'].item(),
+                       background_color=Color(row['background_color']),
+                       alphanumeric=str(row['alphanumeric']),
+                       alphanumeric_color=Color(row['alphanumeric_color']),
+                       confidence=row['confidence'].item())
+                for row in self.array]
+
+    def filter(self, min_confidence):
+        """Get the targets with at least a confidence."""
+        return TargetBatch(self.array[self.array['confidence'] >=
+                                      min_confidence])
+
+    def to_dicts(self):
+        """Get a dict for each target with lowercase shape and color names.
+
+        The fields are the same as in the metadata saved by the CLI,
+        without the image.
+        """
+        names = TARGET_DTYPE.names
+        columns = {name: self.array[name].tolist() for name in names}
+
+        columns['shape'] = [_SHAPE_NAMES[v] for v in columns['shape']]
+
+        for name in ('background_color', 'alphanumeric_color'):
+            columns[name] = [_COLOR_NAMES[v] for v in columns[name]]
+
+        return [dict(zip(names, row))
+                for row in zip(*(columns[name] for name in names))]
+
+    def to_json(self, **kwargs):
+        """Serialize the targets as a JSON list of to_dicts(...).
+
+        Keyword arguments are passed on to json.dumps(...).
+        """
+        return json.dumps(self.to_dicts(), **kwargs)
+
+    def save_npz(self, file, **arrays):
+        """Save the targets to a .npz file.
+
+        Other keyword arguments are saved as extra arrays in the file,
+        e.g. the image each target is from.
+        """
+        np.savez_compressed(file, targets=self.array, **arrays)
+
+
+_SHAPE_NAMES = {shape.value: shape.name.lower() for shape in Shape}
+
+_COLOR_NAMES = {color.value: color.name.lower() for color in Color}
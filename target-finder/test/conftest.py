@@ -0,0 +1,34 @@
+"""Shared fixtures for the tests."""
+
+import pytest
+
+from target_finder import classification
+
+
+class FakeClassifier(object):
+
+    def classify_all(self, images):
+        return ['shape_target' if image.mean() > 0 else 'background'
+                for image in images]
+
+
+class FakeDetector(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def detect_all(self, images):
+        self.calls += len(images)
+        return [[] for _ in images]
+
+
+@pytest.fixture
+def fake_models():
+    old_models = dict(classification.models)
+    detector = FakeDetector()
+    classification.set_models({'clf': FakeClassifier(), 'yolo3': detector})
+
+    yield detector
+
+    classification.models.clear()
+    classification.models.update(old_models)
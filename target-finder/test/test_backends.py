@@ -0,0 +1,144 @@
+"""Testing the inference backends."""
+
+import os
+
+import numpy as np
+import pytest
+import target_finder_model as tfm
+
+from target_finder.backends import (BACKEND_ENV, OpenCVBackend,
+                                    create_backend, default_backend)
+from target_finder.darknet import PreClassifier, Yolo3Detector
+
+
+class _MeanBackend(object):
+    """A backend scoring inputs by their mean, without a net."""
+
+    def __init__(self):
+        self.shapes = []
+
+    def forward(self, blob):
+        self.shapes.append(blob.shape)
+        means = blob.reshape(len(blob), -1).mean(axis=1)
+        return [np.stack([np.full_like(means, 0.5), means], axis=1)]
+
+    def get_image_bytes(self, shape):
+        return None
+
+
+def test_default_backend(monkeypatch):
+    monkeypatch.delenv(BACKEND_ENV, raising=False)
+    assert default_backend() == 'opencv'
+
+    monkeypatch.setenv(BACKEND_ENV, 'onnxruntime')
+    assert default_backend() == 'onnxruntime'
+
+
+def test_create_backend_from_env(monkeypatch):
+    monkeypatch.setenv(BACKEND_ENV, 'not-a-backend')
+
+    with pytest.raises(ValueError):
+        create_backend(None, tfm.preclf_file, tfm.preclf_weights)
+
+    monkeypatch.setenv(BACKEND_ENV, 'opencv')
+    backend = create_backend(None, tfm.preclf_file, tfm.preclf_weights)
+
+    assert isinstance(backend, OpenCVBackend)
+
+
+def test_model_with_backend_object():
+    backend = _MeanBackend()
+    model = PreClassifier(backend=backend, max_batch_bytes=2 * 64 * 64 * 12)
+
+    images = [np.zeros((64, 64, 3), np.uint8),
+              np.full((64, 64, 3), 255, np.uint8),
+              np.zeros((64, 64, 3), np.uint8)]
+
+    assert model.classify_all(images) == \
+        ['background', 'shape_target', 'background']
+
+    # With no memory estimate from the backend, only the input counts.
+    assert [shape[0] for shape in backend.shapes] == [2, 1]
+
+
+def test_cpu_deprecated():
+    with pytest.warns(DeprecationWarning):
+        PreClassifier(backend=_MeanBackend(), cpu=False)
+
+
+def test_onnxruntime_matches_opencv(tmpdir):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+
+    from target_finder.backends import OnnxRuntimeBackend
+
+    blob = np.random.RandomState(0).rand(3, 3, 64, 64).astype(np.float32)
+
+    expected = OpenCVBackend(tfm.preclf_file, tfm.preclf_weights) \
+        .forward(blob)[0]
+    backend = OnnxRuntimeBackend(tfm.preclf_file, tfm.preclf_weights,
+                                 cache_dir=str(tmpdir))
+    actual = backend.forward(blob)[0]
+
+    assert np.allclose(actual, expected.reshape(actual.shape), atol=1e-5)
+
+    # The export is kept for next time.
+    assert len([fn for fn in os.listdir(str(tmpdir))
+                if fn.endswith('.onnx')]) == 1
+
+
+def test_onnxruntime_detector_matches_opencv():
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+
+    from target_finder.backends import OnnxRuntimeBackend
+
+    size = tfm.DETECTOR_SIZE
+    blob = np.random.RandomState(0).rand(2, 3, size[1], size[0]) \
+        .astype(np.float32)
+
+    opencv = OpenCVBackend(tfm.yolo3_file, tfm.yolo3_weights)
+    onnxruntime = OnnxRuntimeBackend(tfm.yolo3_file, tfm.yolo3_weights)
+
+    expected = opencv.forward(blob)
+    actual = onnxruntime.forward(blob)
+
+    # The YOLO layers are decoded in the graph the same way OpenCV
+    # decodes them, with class scores under the threshold zeroed.
+    assert len(actual) == len(expected)
+
+    for a, e in zip(actual, expected):
+        assert a.shape == e.shape
+        assert np.allclose(a, e, rtol=1e-4, atol=1e-4)
+
+    # Both give the same detections. The random weights make many
+    # boxes with almost the same confidence, so NMS can keep a
+    # different one of a near tie now and then.
+    tiles = [(blob[i].transpose(1, 2, 0) * 255).astype(np.uint8)
+             for i in range(2)]
+
+    def detect(backend):
+        return Yolo3Detector(backend=backend).detect_all(tiles)
+
+    for a, e in zip(detect(onnxruntime), detect(opencv)):
+        assert [name for name, _, _ in a] == [name for name, _, _ in e]
+        assert np.allclose([conf for _, conf, _ in a],
+                           [conf for _, conf, _ in e], atol=1e-4)
+
+        boxes_a = np.array([box for _, _, box in a], float)
+        boxes_e = np.array([box for _, _, box in e], float)
+        same = np.all(np.isclose(boxes_a, boxes_e, rtol=1e-3, atol=1),
+                      axis=1)
+
+        assert same.mean() > 0.99
+
+
+def test_export_cache_follows_exporter_version(monkeypatch):
+    from target_finder import backends, onnx_export
+
+    before = backends._model_hash(tfm.preclf_file, tfm.preclf_weights)
+    monkeypatch.setattr(onnx_export, 'EXPORTER_VERSION',
+                        onnx_export.EXPORTER_VERSION + 1)
+
+    assert backends._model_hash(tfm.preclf_file,
+                                tfm.preclf_weights) != before
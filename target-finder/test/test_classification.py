@@ -0,0 +1,254 @@
+"""Testing the helpers used when classifying targets."""
+
+from concurrent.futures import ThreadPoolExecutor
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from target_finder import classification
+from target_finder.types import BBox, BoxArray, Target
+
+
+def test_set_models():
+    fake_model = object()
+    old_models = dict(classification.models)
+
+    try:
+        classification.set_models({'clf': fake_model})
+        assert classification.get_model('clf') is fake_model
+    finally:
+        classification.models.clear()
+        classification.models.update(old_models)
+
+
+def _box(x1, y1, x2, y2, meta):
+    box = BBox(x1, y1, x2, y2)
+    box.meta = meta
+    return box
+
+
+def test_merge_boxes_chain():
+    # The third box links the first two, which a single greedy pass
+    # in input order would leave apart.
+    boxes = [
+        _box(0, 0, 10, 10, {'circle': 0.5}),
+        _box(30, 0, 40, 10, {'A': 0.9}),
+        _box(8, 0, 32, 5, {'circle': 0.7}),
+        _box(100, 100, 110, 110, {'B': 0.4})
+    ]
+
+    merged = classification._merge_boxes(boxes)
+
+    assert len(merged) == 2
+    assert (merged[0].x1, merged[0].y1, merged[0].x2, merged[0].y2) == \
+        (0, 0, 40, 10)
+    assert merged[0].meta == {'circle': 0.7, 'A': 0.9}
+    assert merged[1].meta == {'B': 0.4}
+
+
+def test_merge_boxes_order_independent():
+    rng = random.Random(0)
+    coords = []
+
+    for _ in range(300):
+        x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        coords.append((x, y, x + rng.uniform(1, 40), y + rng.uniform(1, 40)))
+
+    def merge(coords):
+        boxes = [_box(*c, {}) for c in coords]
+        merged = classification._merge_boxes(boxes)
+        return sorted((b.x1, b.y1, b.x2, b.y2) for b in merged)
+
+    expected = merge(coords)
+
+    rng.shuffle(coords)
+    assert merge(coords) == expected
+
+    # Each merged box covers one connected group of boxes.
+    boxes = [_box(*c, {}) for c in coords]
+    group = list(range(len(boxes)))
+
+    for i, box_a in enumerate(boxes):
+        for j, box_b in enumerate(boxes[:i]):
+            if classification._intersect(box_a, box_b):
+                old, new = group[i], group[j]
+                group = [new if g == old else g for g in group]
+
+    bounds = {}
+
+    for g, c in zip(group, coords):
+        x1, y1, x2, y2 = bounds.get(g, c)
+        bounds[g] = (min(x1, c[0]), min(y1, c[1]),
+                     max(x2, c[2]), max(y2, c[3]))
+
+    assert expected == sorted(bounds.values())
+
+
+def test_merge_boxes_inside_bounds():
+    # The first two boxes make an L, and the third is inside their
+    # merged bounds without touching either of them. The last box
+    # touches only the third.
+    boxes = [
+        _box(0, 0, 2, 20, {'circle': 0.5}),
+        _box(0, 18, 20, 20, {'A': 0.9}),
+        _box(10, 5, 12, 7, {'B': 0.4}),
+        _box(11, 6, 30, 8, {'square': 0.6})
+    ]
+
+    merged = classification._merge_boxes(boxes)
+
+    assert [(b.x1, b.y1, b.x2, b.y2) for b in merged] == \
+        [(0, 0, 20, 20), (10, 5, 30, 8)]
+    assert merged[0].meta == {'circle': 0.5, 'A': 0.9}
+    assert merged[1].meta == {'B': 0.4, 'square': 0.6}
+
+
+def test_merge_box_array():
+    rng = random.Random(1)
+    coords = []
+
+    for _ in range(200):
+        x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        coords.append((x, y, x + rng.uniform(1, 40), y + rng.uniform(1, 40)))
+
+    def merge(boxes):
+        return [(b.x1, b.y1, b.x2, b.y2, b.meta)
+                for b in classification._merge_boxes(boxes)]
+
+    array = BoxArray(coords, meta=[{str(i): i} for i in range(len(coords))])
+    boxes = [_box(*c, {str(i): i}) for i, c in enumerate(coords)]
+
+    assert merge(array) == merge(boxes)
+    assert classification._merge_boxes(BoxArray()) == []
+
+    # Boxes without meta, or joined with some that have none.
+    plain = BoxArray([(0, 0, 10, 10), (5, 5, 15, 15)])
+    assert merge(plain) == [(0, 0, 15, 15, {})]
+
+    mixed = BoxArray.concatenate([plain, BoxArray([(8, 8, 20, 20)],
+                                                  meta=[{'A': 0.5}])])
+    assert merge(mixed) == [(0, 0, 20, 20, {'A': 0.5})]
+
+
+def test_normalize_box_array():
+    crops = [BBox(0, 0, 400, 400), BBox(300, 600, 700, 1000),
+             BBox(900, 0, 1300, 400)]
+    offset_bboxes = [
+        [('circle', 0.9, [10, 20, 30, 40]), ('A', 0.5, [0, 0, 608, 608])],
+        [],
+        [('star', 0.7, [100.5, 200, 50, 60])]
+    ]
+
+    expected = [box for crop, bboxes in zip(crops, offset_bboxes)
+                for box in classification._normalize_bboxes(crop, bboxes)]
+
+    for crop_boxes in (crops, BoxArray.from_boxes(crops)):
+        array = classification._normalize_box_array(crop_boxes,
+                                                    offset_bboxes)
+
+        assert [(b.x1, b.y1, b.x2, b.y2, b.meta, b.confidence)
+                for b in array] == \
+            [(b.x1, b.y1, b.x2, b.y2, b.meta, b.confidence)
+             for b in expected]
+
+
+def test_identify_properties_order():
+    rng = np.random.RandomState(0)
+    image = rng.randint(0, 30, (300, 600, 3)).astype(np.uint8)
+
+    targets = []
+    for i, color in enumerate([(0, 0, 255), (0, 255, 0), (255, 0, 0),
+                               (255, 255, 255), (0, 255, 255)]):
+        x = 40 + i * 100
+        cv2.rectangle(image, (x, 100), (x + 39, 139), color, -1)
+        targets.append(Target(x, 100, 40, 40))
+
+    def identify(**kwargs):
+        stats = []
+        classification._identify_properties(targets, image, stats=stats,
+                                            **kwargs)
+
+        return stats, [(t.background_color, t.alphanumeric_color,
+                        np.array(t.image).tobytes()) for t in targets]
+
+    stats, expected = identify(workers=1)
+    assert len(stats) == len(targets)
+
+    _, threaded = identify(workers=4)
+    assert threaded == expected
+
+    with ThreadPoolExecutor(2) as executor:
+        _, pooled = identify(executor=executor)
+
+    assert pooled == expected
+
+    # The images match converting the padded crops straight away.
+    crop = image[85:155, 25:95]
+    assert np.array(targets[0].image).tobytes() == \
+        cv2.cvtColor(crop, cv2.COLOR_BGR2RGB).tobytes()
+
+
+def test_identify_properties_without_images():
+    image = np.zeros((100, 100, 3), np.uint8)
+    targets = [Target(40, 40, 20, 20)]
+
+    classification._identify_properties(targets, image, workers=1,
+                                        target_images=False)
+
+    assert targets[0].image is None
+
+
+def test_identify_properties_copy_images():
+    image = np.zeros((100, 100, 3), np.uint8)
+    targets = [Target(40, 40, 20, 20), Target(40, 40, 20, 20)]
+
+    classification._identify_properties(targets[:1], image, workers=1)
+    classification._identify_properties(targets[1:], image, workers=1,
+                                        target_images='copy')
+
+    # Reusing the frame changes the view, but not the copy.
+    image[:] = 255
+
+    assert np.array(targets[0].image).min() == 255
+    assert np.array(targets[1].image).max() == 0
+
+    with pytest.raises(ValueError):
+        classification._identify_properties(targets, image,
+                                            target_images='yes')
+
+
+class _BoxDetector(object):
+    """Finds a box in the middle of every crop that isn't all black"""
+
+    def __init__(self):
+        self.batches = []
+
+    def detect_all(self, images):
+        self.batches.append(len(images))
+        return [[('circle', image.mean() / 255, (200, 200, 50, 50))]
+                for image in images]
+
+
+def test_find_targets_batch(fake_models):
+    images = [np.zeros((500, 700, 3), dtype=np.uint8) for _ in range(3)]
+    images[0][:50, :50] = 200
+    images[2][-50:, -50:] = 100
+
+    detector = _BoxDetector()
+    classification.set_models({'yolo3': detector})
+
+    results = classification.find_targets_batch(images, batch_size=4)
+    expected = [classification.find_targets_from_array(image)
+                for image in images]
+
+    # The crops kept from the first and last images share one pass.
+    assert detector.batches[0] == 3
+
+    assert [len(targets) for targets in results] == \
+        [len(targets) for targets in expected]
+    assert results[1] == []
+    assert [[(t.x, t.y, t.confidence) for t in targets]
+            for targets in results] == \
+        [[(t.x, t.y, t.confidence) for t in targets] for targets in expected]
@@ -0,0 +1,62 @@
+"""Testing the command line interface."""
+
+import json
+import multiprocessing
+import os
+import sqlite3
+
+import pytest
+
+from target_finder import classification, cli
+
+
+IMAGE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+class _BoxDetector(object):
+
+    def detect_all(self, images):
+        return [[('circle', 0.75, [100, 120, 30, 40])] for _ in images]
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the fake models only reach forked workers')
+def test_targets_workers(fake_models, tmpdir, monkeypatch):
+    classification.set_models({'yolo3': _BoxDetector()})
+    monkeypatch.setattr(cli, '_tile_cache', None)
+
+    images = [os.path.join(IMAGE_DIR, fn)
+              for fn in ('fake-1.jpg', 'real-1.jpg', 'real-2.jpg')]
+
+    def run(name, *args):
+        output = str(tmpdir.join(name))
+        cli.run(['targets', *images, '-o', output, '--limit', '2',
+                 '--output-format', 'jsonl', *args])
+
+        with open(os.path.join(output, 'targets.jsonl')) as f:
+            metas = [json.loads(line) for line in f]
+
+        for meta in metas:
+            meta['target_image'] = os.path.basename(meta['target_image'])
+
+        return metas
+
+    expected = run('one', '--workers', '1')
+
+    assert [meta['target_image'] for meta in expected] == \
+        ['target-{:06d}.jpg'.format(i) for i in range(6)]
+    assert [meta['image'] for meta in expected] == \
+        [image for image in images for _ in range(2)]
+
+    assert run('two', '--workers', '2') == expected
+
+    # Each worker saves its tiles to the shared cache.
+    db = str(tmpdir.join('tiles.db'))
+    cached = run('cached', '--workers', '2', '--tile-cache', db)
+
+    with sqlite3.connect(db) as conn:
+        count, = conn.execute('SELECT COUNT(*) FROM tiles').fetchone()
+
+    assert count > 0
+    assert cached == expected
+    assert run('cached-again', '--workers', '2', '--tile-cache', db) == cached
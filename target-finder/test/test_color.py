@@ -0,0 +1,172 @@
+"""Testing the color naming helpers."""
+
+import os
+
+import numpy as np
+import PIL.Image
+import pytest
+
+from target_finder import classification
+from target_finder.color_cube import ColorCube
+from target_finder.color_separation import color_agreement, separate_colors
+from target_finder.color_table import COLOR_CUBES, ColorTable, name_colors
+from target_finder.types import Color
+
+
+IMAGE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_name_colors():
+    colors = [(250, 250, 250), (5, 5, 5), (128, 128, 128), (0, 255, 0)]
+
+    assert [Color(v) for v in name_colors(colors)] == \
+        [Color.WHITE, Color.BLACK, Color.GRAY, Color.GREEN]
+
+
+def test_color_table(tmpdir):
+    table = ColorTable(bins=4, cache_dir=str(tmpdir))
+
+    assert table.name((5, 5, 5)) == Color.BLACK
+
+    # The second table should come from the cache.
+    assert len(tmpdir.listdir()) == 1
+    cached = ColorTable(bins=4, cache_dir=str(tmpdir))
+    assert np.array_equal(cached.table, table.table)
+
+
+def _grid(r, g, b):
+    return np.stack(np.meshgrid(r, g, b, indexing='ij'),
+                    axis=-1).reshape(-1, 3)
+
+
+def test_color_table_exact():
+    table = ColorTable()
+
+    # Every integer color in regions where bins straddle a sliver of
+    # another color, and a coarse grid over the whole cube.
+    colors = np.concatenate([
+        _grid(np.arange(96, 160), np.arange(96, 128), np.arange(64, 96)),
+        _grid(np.arange(104, 112), np.arange(112, 128), np.arange(176, 192)),
+        _grid(np.arange(144, 160), np.arange(240, 256), np.arange(96, 112)),
+        _grid(*[np.arange(0, 256, 51)] * 3)
+    ])
+
+    assert np.array_equal(table.lookup(colors), name_colors(colors))
+
+    # Colors which aren't integers are named exactly.
+    colors = np.random.RandomState(0).uniform(0, 256, (3000, 3))
+
+    assert np.array_equal(table.lookup(colors), name_colors(colors))
+
+
+def _walk_edges(cube, color):
+    """Walk the cube edges like ColorCube used to"""
+    hs, ss, vs = cube.hStart, cube.sStart, cube.vStart
+    he, se, ve = cube.hEnd, cube.sEnd, cube.vEnd
+
+    points = []
+    for h in range(hs, he + 1):
+        points += [(h, se, vs), (h, ss, vs), (h, ss, ve), (h, se, ve)]
+    for s in range(ss, se + 1):
+        points += [(hs, s, vs), (he, s, vs), (hs, s, ve), (he, s, ve)]
+    for v in range(vs, ve + 1):
+        points += [(hs, ss, v), (hs, se, v), (he, ss, v), (he, se, v)]
+
+    closest, closest_dist = (0, 0, 0), 385.851
+    for point in points:
+        dist = cube.get_distance(point, color)
+        if dist < closest_dist:
+            closest, closest_dist = point, dist
+
+    return closest
+
+
+def test_color_names_on_fixtures(monkeypatch):
+    # Some of the targets in the fixtures as (x, y, width, height).
+    targets = {
+        'fake-1.jpg': [(701, 551, 50, 50), (849, 1451, 49, 46),
+                       (3201, 648, 52, 64), (1250, 1652, 37, 32)],
+        'real-1.jpg': [(743, 953, 44, 29), (1956, 910, 28, 32),
+                       (2450, 1828, 30, 30)],
+        'real-2.jpg': [(1609, 479, 88, 84)]
+    }
+
+    table = ColorTable()
+    monkeypatch.setattr(classification, '_color_table', table)
+    verified = table.verified.sum()
+
+    for fn, boxes in targets.items():
+        image = np.array(PIL.Image.open(os.path.join(IMAGE_DIR, fn)))
+
+        for x, y, w, h in boxes:
+            pixels = image[y:y + h, x:x + w].reshape(-1, 3)
+            means = [mean for mean, _ in separate_colors(pixels)]
+
+            # The mean colors are floats, but rounding them for the
+            # table gives the same names.
+            assert classification._get_color_names(means) == \
+                [Color(v) for v in name_colors(means)]
+
+    # The names came from the table.
+    assert table.verified.sum() > verified
+
+
+def test_closest_points():
+    rng = np.random.RandomState(0)
+    colors = np.concatenate([
+        rng.uniform(0, 1, (60, 3)) * [360, 100, 100],
+        rng.randint(0, 720, (60, 3)) / 2
+    ])
+
+    for _, cube in COLOR_CUBES:
+        expected = [_walk_edges(cube, tuple(color)) for color in colors]
+
+        assert np.array_equal(cube.get_closest_points(colors), expected)
+
+
+def test_closest_points_wrap_hue():
+    cube = ColorCube((100, 60, 30), (160, 100, 100))
+
+    assert tuple(cube.get_closest_points([(355, 80, 80)])[0]) == \
+        (160, 80, 100)
+    assert tuple(cube.get_closest_points([(355, 80, 80)],
+                                         wrap_hue=True)[0]) == (100, 80, 100)
+
+
+def _two_color_pixels():
+    rng = np.random.RandomState(0)
+    red = rng.normal((200, 30, 30), 8, (700, 3))
+    white = rng.normal((240, 240, 240), 8, (300, 3))
+
+    return np.clip(np.concatenate([red, white]), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('method', ['kmeans', 'histogram', 'agglomerative'])
+def test_separate_colors(method):
+    pixels = _two_color_pixels()
+
+    colors = separate_colors(pixels, method=method)
+    (main, main_count), (other, other_count) = \
+        sorted(colors, key=lambda c: -c[1])
+
+    assert (main_count, other_count) == (700, 300)
+    assert np.allclose(main, (200, 30, 30), atol=3)
+    assert np.allclose(other, (240, 240, 240), atol=3)
+
+
+def test_separate_colors_subsampled():
+    pixels = _two_color_pixels()
+
+    counts = sorted(c for _, c in separate_colors(pixels, max_pixels=100))
+    assert counts == [300, 700]
+
+    # Any function labeling the pixels can be used too.
+    labels = separate_colors(pixels, method=lambda p: p[:, 1] > 128)
+    assert sorted(c for _, c in labels) == [300, 700]
+
+
+def test_color_agreement():
+    result = color_agreement(_two_color_pixels(), 'kmeans')
+
+    assert result['label_agreement'] == 1.0
+    assert result['color_distance'] < 1e-6
@@ -0,0 +1,84 @@
+"""Testing the darknet output decoding."""
+
+import numpy as np
+
+from target_finder.darknet import PreClassifier, decode_yolo_output
+
+
+CLASSES = ['circle', 'square', 'A', 'B']
+
+
+def _row(x, y, w, h, scores):
+    return [x, y, w, h, 1] + scores
+
+
+def test_decode_yolo_output():
+    layer_1 = np.array([
+        [_row(0.5, 0.5, 0.1, 0.1, [0.9, 0.0, 0.0, 0.0]),
+         _row(0.2, 0.2, 0.1, 0.1, [0.0, 0.0, 0.01, 0.0])],
+        [_row(0.5, 0.5, 0.1, 0.1, [0.0, 0.0, 0.0, 0.0]),
+         _row(0.5, 0.5, 0.1, 0.1, [0.0, 0.0, 0.0, 0.0])]
+    ], dtype=np.float32)
+    layer_2 = np.array([
+        [_row(0.51, 0.5, 0.1, 0.1, [0.0, 0.0, 0.8, 0.0])],
+        [_row(0.25, 0.75, 0.2, 0.4, [0.0, 0.6, 0.0, 0.7])]
+    ], dtype=np.float32)
+
+    detections = decode_yolo_output([layer_1, layer_2], CLASSES, (100, 200))
+
+    assert len(detections) == 2
+
+    names = [name for name, _, _ in detections[0]]
+    assert names == ['circle', 'A']
+    assert detections[0][0][2] == [45, 90, 10, 20]
+    assert round(detections[0][0][1], 5) == 0.9
+
+    # Only the best scoring class is kept for each row.
+    assert [name for name, _, _ in detections[1]] == ['B']
+    assert detections[1][0][2] == [15, 110, 20, 80]
+
+
+def test_decode_yolo_output_empty():
+    layer = np.zeros((3, 5, 5 + len(CLASSES)), dtype=np.float32)
+
+    assert decode_yolo_output([layer], CLASSES, (64, 64)) == [[], [], []]
+
+
+def _fake_classifier(**kwargs):
+    """A PreClassifier scoring images by their mean, without a net"""
+    model = PreClassifier.__new__(PreClassifier)
+    model.classes = ['background', 'shape_target']
+    model.batch_size = kwargs.get('batch_size')
+    model.max_batch_bytes = kwargs.get('max_batch_bytes')
+    model._image_bytes = 1000
+    model.batches = []
+
+    def forward(images):
+        model.batches.append(len(images))
+        scores = [[0.5, image.mean() / 255] for image in images]
+        return [np.array(scores, np.float32).reshape(-1, 2, 1, 1)]
+
+    model._forward = forward
+    return model
+
+
+def test_classify_all_single_image():
+    model = _fake_classifier()
+
+    image = np.full((64, 64, 3), 255, np.uint8)
+
+    assert model.classify_all([image]) == ['shape_target']
+
+
+def test_classify_all_micro_batches():
+    images = [np.full((64, 64, 3), i * 50, np.uint8) for i in range(5)]
+    expected = _fake_classifier().classify_all(images)
+
+    model = _fake_classifier(batch_size=2)
+    assert model.classify_all(images) == expected
+    assert model.batches == [2, 2, 1]
+
+    # The byte budget fits 3 images, and the smaller limit wins.
+    model = _fake_classifier(batch_size=4, max_batch_bytes=3500)
+    assert model.classify_all(images) == expected
+    assert model.batches == [3, 2]
@@ -0,0 +1,74 @@
+"""Testing decoding images at reduced resolution."""
+
+import cv2
+import numpy as np
+
+from target_finder import classification
+from target_finder.image_source import ImageSource, _exif_orientation
+from target_finder.metrics import Metrics
+
+
+def _write_image(tmpdir, image):
+    filename = str(tmpdir.join('image.jpg'))
+    cv2.imwrite(filename, image)
+    return filename
+
+
+def test_reduced_decode(tmpdir):
+    image = np.full((800, 1200, 3), 128, dtype=np.uint8)
+    source = ImageSource(_write_image(tmpdir, image))
+
+    assert source.shape == (800, 1200, 3)
+
+    preview, scale = source.reduced(0.16)
+
+    assert scale == 0.25
+    assert preview.shape == (200, 300, 3)
+    assert source.reduced(0.16)[0] is preview
+
+    # Nothing smaller than half size is enough, so it's decoded in full.
+    full, scale = source.reduced(0.75)
+
+    assert scale == 1
+    assert full.shape == (800, 1200, 3)
+    assert source.full() is full
+
+
+def test_find_targets_from_file_skips_full_decode(tmpdir, fake_models,
+                                                  monkeypatch):
+    # The fake pre-classifier drops every tile of a black image.
+    filename = _write_image(tmpdir, np.zeros((700, 500, 3), np.uint8))
+
+    def full(self):
+        raise AssertionError('The full image was decoded')
+
+    monkeypatch.setattr(ImageSource, 'full', full)
+
+    assert classification.find_targets_from_file(filename) == []
+    assert fake_models.calls == 0
+
+
+def test_find_targets_from_file_detects(tmpdir, fake_models):
+    image = np.zeros((700, 500, 3), np.uint8)
+    image[:50, :50] = 255
+
+    metrics = Metrics()
+    classification.find_targets_from_file(_write_image(tmpdir, image),
+                                          metrics=metrics)
+
+    assert fake_models.calls > 0
+
+    # One reduced decode and one full decode.
+    count, _ = metrics.get_histogram('stage_seconds', {'stage': 'decode'})
+    assert count == 2
+
+
+def test_exif_orientation_old_pillow():
+    class OldImage(object):
+        """A PIL JPEG image before getexif() was added"""
+
+        def _getexif(self):
+            return {0x0112: 6}
+
+    assert _exif_orientation(OldImage()) == 6
+    assert _exif_orientation(object()) is None
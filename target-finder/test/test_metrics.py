@@ -0,0 +1,72 @@
+"""Testing the metrics collector."""
+
+import numpy as np
+
+from target_finder import classification
+from target_finder.metrics import Metrics, timer
+from target_finder.pipeline import Pipeline
+
+
+def test_prometheus_format():
+    metrics = Metrics(buckets=(0.1, 1))
+
+    metrics.inc('tiles_total', 3)
+    metrics.inc('tiles_total', 2)
+    metrics.observe('stage_seconds', 0.05, {'stage': 'tile'})
+    metrics.observe('stage_seconds', 0.5, {'stage': 'tile'})
+    metrics.observe('stage_seconds', 3, {'stage': 'tile'})
+
+    assert metrics.to_prometheus() == '\n'.join([
+        '# TYPE target_finder_tiles_total counter',
+        'target_finder_tiles_total 5',
+        '# TYPE target_finder_stage_seconds histogram',
+        'target_finder_stage_seconds_bucket{stage="tile",le="0.1"} 1',
+        'target_finder_stage_seconds_bucket{stage="tile",le="1.0"} 2',
+        'target_finder_stage_seconds_bucket{stage="tile",le="+Inf"} 3',
+        'target_finder_stage_seconds_sum{stage="tile"} 3.55',
+        'target_finder_stage_seconds_count{stage="tile"} 3',
+        ''
+    ])
+
+
+def test_timer_disabled():
+    with timer(None, 'stage_seconds'):
+        pass
+
+    metrics = Metrics()
+
+    with timer(metrics, 'stage_seconds', {'stage': 'tile'}):
+        pass
+
+    assert metrics.get_histogram('stage_seconds', {'stage': 'tile'})[0] == 1
+
+
+def test_find_targets_metrics(fake_models):
+    image = np.zeros((500, 700, 3), dtype=np.uint8)
+    image[:50, :50] = 1
+    metrics = Metrics()
+
+    classification.find_targets_from_array(image, metrics=metrics)
+
+    # Only the tile in the top left corner is kept.
+    assert metrics.get_counter('frames_total') == 1
+    assert metrics.get_counter('tiles_total') == 6
+    assert metrics.get_counter('tiles_kept_total') == 1
+    assert metrics.get_counter('raw_boxes_total') == 0
+    assert metrics.get_histogram('frame_seconds')[0] == 1
+
+    for stage in ('tile', 'preclassify', 'detect', 'merge', 'identify'):
+        assert metrics.get_histogram('stage_seconds', {'stage': stage})[0] \
+            == 1
+
+
+def test_pipeline_metrics(fake_models):
+    images = [np.ones((500, 700, 3), dtype=np.uint8)] * 3
+    metrics = Metrics()
+
+    list(Pipeline(metrics=metrics).run(images))
+
+    assert metrics.get_counter('frames_total') == 3
+    assert metrics.get_counter('tiles_total') == 18
+    assert metrics.get_histogram('stage_seconds', {'stage': 'decode'})[0] \
+        == 3
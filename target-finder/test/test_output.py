@@ -0,0 +1,138 @@
+"""Testing saving targets with the TargetWriter."""
+
+import json
+import os
+import tarfile
+import threading
+import zipfile
+
+import numpy as np
+import PIL.Image
+import pytest
+
+from target_finder.output import TargetWriter
+from target_finder.types import Color, Shape, Target, TargetBatch
+
+
+def _targets(count):
+    return [Target(10 * i, 20, 30, 40, shape=Shape.SQUARE,
+                   background_color=Color.RED, alphanumeric='A',
+                   alphanumeric_color=Color.WHITE, confidence=0.9,
+                   image=PIL.Image.new('RGB', (30, 40), (255, 0, 0)))
+            for i in range(count)]
+
+
+def test_write_files(tmpdir):
+    output = str(tmpdir)
+
+    with TargetWriter(output, workers=2) as writer:
+        for target in _targets(3):
+            writer.write('image.jpg', target)
+
+    assert sorted(os.listdir(output)) == [
+        'target-00000{:d}.{:s}'.format(i, ext)
+        for i in range(3) for ext in ('jpg', 'json')
+    ]
+
+    with open(os.path.join(output, 'target-000002.json')) as f:
+        meta = json.load(f)
+
+    assert meta['x'] == 20
+    assert meta['shape'] == 'square'
+    assert meta['image'] == 'image.jpg'
+    assert meta['target_image'] == os.path.join(output, 'target-000002.jpg')
+
+
+@pytest.mark.parametrize('archive', ['tar', 'zip'])
+def test_write_jsonl_archive(tmpdir, archive):
+    output = str(tmpdir)
+
+    with TargetWriter(output, output_format='jsonl',
+                      archive=archive) as writer:
+        for target in _targets(10):
+            writer.write('image.jpg', target)
+
+    assert sorted(os.listdir(output)) == sorted(['targets.' + archive,
+                                                 'targets.jsonl'])
+
+    with open(os.path.join(output, 'targets.jsonl')) as f:
+        metas = [json.loads(line) for line in f]
+
+    assert [meta['x'] for meta in metas] == [10 * i for i in range(10)]
+
+    path = os.path.join(output, 'targets.' + archive)
+
+    if archive == 'tar':
+        with tarfile.open(path) as f:
+            names = f.getnames()
+    else:
+        with zipfile.ZipFile(path) as f:
+            names = f.namelist()
+
+    assert sorted(names) == [meta['target_image'] for meta in metas]
+    assert {meta['image'] for meta in metas} == {'image.jpg'}
+
+
+def test_write_jsonl_twice(tmpdir):
+    output = str(tmpdir)
+
+    # A second run numbers from 0 again, so it replaces the first.
+    for _ in range(2):
+        with TargetWriter(output, output_format='jsonl') as writer:
+            for target in _targets(3):
+                writer.write('image.jpg', target)
+
+    with open(os.path.join(output, 'targets.jsonl')) as f:
+        assert len(f.readlines()) == 3
+
+
+def test_write_npz(tmpdir):
+    output = str(tmpdir)
+    targets = _targets(3)
+
+    with TargetWriter(output, output_format='npz') as writer:
+        for i, target in enumerate(targets):
+            writer.write('image-{:d}.jpg'.format(i), target)
+
+    filename = os.path.join(output, 'targets.npz')
+    batch = TargetBatch.load_npz(filename)
+
+    assert [t.x for t in batch.to_targets()] == [t.x for t in targets]
+    assert batch['shape'].tolist() == [Shape.SQUARE.value] * 3
+
+    with np.load(filename) as data:
+        assert data['image'].tolist() == ['image-0.jpg', 'image-1.jpg',
+                                          'image-2.jpg']
+        assert data['target_image'].tolist()[0] == \
+            os.path.join(output, 'target-000000.jpg')
+
+
+def test_write_lazy_image(tmpdir, monkeypatch):
+    threads = []
+    fromarray = PIL.Image.fromarray
+
+    def spy(array):
+        threads.append(threading.current_thread())
+        return fromarray(array)
+
+    monkeypatch.setattr(PIL.Image, 'fromarray', spy)
+
+    target = _targets(1)[0]
+    target.set_image_view(np.zeros((40, 30, 3), np.uint8))
+
+    with TargetWriter(str(tmpdir)) as writer:
+        writer.write('image.jpg', target)
+
+    # The image is made on a writer thread, not the caller's.
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+    assert os.path.isfile(str(tmpdir.join('target-000000.jpg')))
+
+
+def test_write_error(tmpdir):
+    target = _targets(1)[0]
+    target.image = None
+
+    with pytest.raises(AttributeError):
+        with TargetWriter(str(tmpdir)) as writer:
+            writer.write('image.jpg', target)
@@ -0,0 +1,56 @@
+"""Testing the streaming pipeline with stand-in models."""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from target_finder.pipeline import Pipeline, find_targets_stream
+
+
+def test_pipeline_order(fake_models):
+    images = [np.full((500, 700, 3), i % 2, dtype=np.uint8)
+              for i in range(6)]
+
+    pipeline = Pipeline(workers={'tile': 3, 'preclassify': 2}, queue_size=1)
+    results = list(pipeline.run(images))
+
+    assert len(results) == len(images)
+    assert all(source is image for (source, _), image
+               in zip(results, images))
+    assert all(targets == [] for _, targets in results)
+
+    # Only the three non-blank images have their 6 crops kept for the
+    # detector.
+    assert fake_models.calls == 3 * 6
+
+
+def test_pipeline_errors(fake_models):
+    with pytest.raises(IOError):
+        list(find_targets_stream(['does-not-exist.jpg']))
+
+
+def _pipeline_threads():
+    return [thread for thread in threading.enumerate()
+            if thread.name.startswith('target-finder-pipeline')]
+
+
+def test_pipeline_closed_early(fake_models):
+    images = [np.full((500, 700, 3), 1, dtype=np.uint8) for _ in range(20)]
+
+    stream = find_targets_stream(images, workers={'tile': 2})
+    next(stream)
+    stream.close()
+
+    deadline = time.time() + 5
+
+    while _pipeline_threads() and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert _pipeline_threads() == []
+
+
+def test_pipeline_bad_stage():
+    with pytest.raises(ValueError):
+        Pipeline(workers={'nope': 2})
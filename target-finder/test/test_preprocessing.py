@@ -0,0 +1,94 @@
+"""Testing the image preprocessing helpers."""
+
+import cv2
+import numpy as np
+
+from target_finder.preprocessing import (SegmentationSettings, TileBatcher,
+                                         extract_contour, extract_crops,
+                                         scaled_tiles)
+
+
+def test_tile_batcher():
+    rng = np.random.RandomState(0)
+    image = rng.randint(0, 256, (700, 900, 3)).astype(np.uint8)
+    crops = [crop.image for crop in extract_crops(image, (400, 400), 100)]
+
+    expected = cv2.dnn.blobFromImages(
+        [cv2.resize(crop, (64, 64)) for crop in crops],
+        1 / 255, (64, 64), [0, 0, 0], 1
+    )
+
+    batcher = TileBatcher((64, 64))
+    blob = batcher.fill(crops)
+
+    assert blob.dtype == np.float32
+    assert blob.shape == (len(crops), 3, 64, 64)
+    assert np.allclose(blob, expected, atol=1e-6)
+
+    # Smaller batches reuse the same buffer.
+    assert batcher.fill(crops[:2]).base is blob.base
+
+
+def _target_crop():
+    rng = np.random.RandomState(0)
+    image = rng.randint(90, 110, (160, 160, 3)).astype(np.uint8)
+    cv2.circle(image, (80, 80), 40, (30, 30, 220), -1)
+    return image
+
+
+def test_extract_contour_stats():
+    image = _target_crop()
+    stats = {}
+
+    contour = extract_contour(image, stats=stats)
+
+    assert stats['grabcut_iterations'] == 5
+    assert stats['grabcut_scale'] == 1.0
+    assert stats['grabcut_time'] > 0
+
+    x, y, w, h = cv2.boundingRect(contour)
+    assert abs(x - 40) <= 2 and abs(y - 40) <= 2
+    assert abs(w - 81) <= 2 and abs(h - 81) <= 2
+
+
+def test_extract_contour_downscaled():
+    image = _target_crop()
+    stats = {}
+
+    settings = SegmentationSettings(max_pixels=80 * 80, tolerance=0.001,
+                                    min_size=64)
+    contour = extract_contour(image, settings, stats)
+
+    assert stats['grabcut_scale'] == 0.5
+    assert 1 <= stats['grabcut_iterations'] <= 5
+
+    # The contour is still in the coordinates of the full crop.
+    x, y, w, h = cv2.boundingRect(contour)
+    assert abs(x - 40) <= 4 and abs(y - 40) <= 4
+    assert abs(w - 81) <= 4 and abs(h - 81) <= 4
+
+
+def test_scaled_tiles():
+    rng = np.random.RandomState(0)
+    image = rng.randint(0, 256, (2400, 4240, 3)).astype(np.uint8)
+    crops = extract_crops(image, (400, 400), 100)
+
+    # Downscaling samples the same pixels as resizing each crop,
+    # including the crops clamped to the edges.
+    tiles = scaled_tiles(image, crops, (64, 64))
+    assert len(tiles) == len(crops)
+
+    for crop, tile in zip(crops, tiles):
+        assert np.array_equal(tile, cv2.resize(crop.image, (64, 64)))
+
+    # Upscaling differs on the tile borders, where each crop on its own
+    # has no neighboring pixels, and by rounding inside.
+    some_crops = crops[:3] + crops[-2:]
+    tiles = scaled_tiles(image, some_crops, (608, 608))
+
+    for crop, tile in zip(some_crops, tiles):
+        expected = cv2.resize(crop.image, (608, 608)).astype(int)
+        diff = np.abs(tile - expected)[2:-2, 2:-2]
+
+        assert tile.shape == (608, 608, 3)
+        assert diff.max() <= 1
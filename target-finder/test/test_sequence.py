@@ -0,0 +1,54 @@
+"""Testing the incremental finder for frame sequences."""
+
+import numpy as np
+
+from target_finder.sequence import FrameSequenceFinder
+
+
+def _frame(value=0):
+    image = np.zeros((500, 700, 3), dtype=np.uint8)
+    image[:50, :50] = 200
+    image[-50:, -50:] = value
+    return image
+
+
+def test_reuses_unchanged_tiles(fake_models):
+    finder = FrameSequenceFinder(refresh_interval=None)
+
+    # The 6 crops of a 700x500 frame are at 4 places.
+    finder.find(_frame())
+    assert finder.tiles_inferred == 4
+    calls = fake_models.calls
+
+    # Tiny noise doesn't count as a change.
+    noisy = _frame()
+    noisy[100:110, 100:110] += 3
+    finder.find(noisy)
+
+    assert finder.tiles_inferred == 4
+    assert finder.tiles_reused == 4
+    assert fake_models.calls == calls
+
+    # Only the tile covering the bottom right corner changed.
+    finder.find(_frame(255))
+    assert finder.tiles_inferred == 5
+
+
+def test_refresh_interval(fake_models):
+    finder = FrameSequenceFinder(refresh_interval=3)
+
+    for _ in range(7):
+        finder.find(_frame())
+
+    # Every tile ran on frames 1, 4 and 7.
+    assert finder.tiles_inferred == 4 * 3
+    assert finder.tiles_reused == 4 * 4
+
+
+def test_new_frame_size(fake_models):
+    finder = FrameSequenceFinder()
+
+    finder.find(_frame())
+    finder.find(np.zeros((400, 400, 3), dtype=np.uint8))
+
+    assert finder.tiles_inferred == 5
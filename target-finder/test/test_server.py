@@ -0,0 +1,137 @@
+"""Testing the target finding server."""
+
+import asyncio
+import json
+import threading
+
+import cv2
+import numpy as np
+
+from target_finder import server as server_module
+from target_finder.server import TargetServer
+from target_finder.types import Target
+
+
+async def _request(port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+    writer.write('{:s} {:s} HTTP/1.1\r\nContent-Length: {:d}\r\n'
+                 'Connection: close\r\n\r\n'
+                 .format(method, path, len(body)).encode() + body)
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head, _, content = response.partition(b'\r\n\r\n')
+
+    return int(head.split()[1]), content
+
+
+def _run(server, coro_func):
+    loop = asyncio.new_event_loop()
+
+    async def main():
+        listening = await server.start(port=0)
+        port = listening.sockets[0].getsockname()[1]
+
+        try:
+            return await coro_func(port)
+        finally:
+            await server.stop()
+
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def _jpeg(image):
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def test_server_endpoints(fake_models):
+    server = TargetServer()
+
+    async def requests(port):
+        return await asyncio.gather(
+            _request(port, 'GET', '/health'),
+            _request(port, 'POST', '/targets',
+                     _jpeg(np.zeros((500, 700, 3), np.uint8))),
+            _request(port, 'POST', '/targets', b'not an image'),
+            _request(port, 'GET', '/targets'),
+            _request(port, 'GET', '/nothing')
+        )
+
+    health, targets, bad, method, missing = _run(server, requests)
+
+    assert health == (200, b'{"status": "ok"}')
+    assert targets[0] == 200
+    assert json.loads(targets[1].decode()) == {'targets': []}
+    assert bad[0] == 400
+    assert method[0] == 405
+    assert missing[0] == 404
+
+    metrics = server.metrics
+    assert metrics.get_counter('server_requests_total',
+                               {'path': '/targets', 'status': 200}) == 1
+    assert metrics.get_counter('frames_total') == 1
+
+
+def test_server_batches_requests(fake_models, tmpdir):
+    filename = str(tmpdir.join('image.jpg'))
+    image = np.zeros((500, 700, 3), np.uint8)
+    image[:50, :50] = 255
+    cv2.imwrite(filename, image)
+
+    server = TargetServer(max_delay=0.5)
+    body = json.dumps({'path': filename}).encode()
+
+    async def requests(port):
+        results = await asyncio.gather(
+            *[_request(port, 'POST', '/targets', body) for _ in range(3)])
+        metrics = await _request(port, 'GET', '/metrics')
+
+        return results, metrics
+
+    results, metrics = _run(server, requests)
+
+    assert [status for status, _ in results] == [200] * 3
+    assert server.metrics.get_counter('server_batches_total') == 1
+    assert server.metrics.get_counter('frames_total') == 3
+    assert b'target_finder_server_batches_total 1' in metrics[1]
+
+
+def test_server_encodes_off_loop(fake_models, monkeypatch):
+    threads = []
+    encode_image = server_module._encode_image
+
+    def spy(image):
+        threads.append(threading.current_thread())
+        return encode_image(image)
+
+    monkeypatch.setattr(server_module, '_encode_image', spy)
+
+    server = TargetServer()
+
+    async def find(image):
+        target = Target(1, 2, 30, 40)
+        target.set_image_view(np.zeros((40, 30, 3), np.uint8))
+        return [target, target]
+
+    server.find = find
+
+    async def requests(port):
+        return await _request(port, 'POST', '/targets',
+                              _jpeg(np.zeros((50, 70, 3), np.uint8)))
+
+    status, content = _run(server, requests)
+    targets = json.loads(content.decode())['targets']
+
+    assert status == 200
+    assert [target['x'] for target in targets] == [1, 1]
+    assert targets[0]['target_image'] is not None
+
+    # The images were encoded off the thread running the event loop.
+    assert len(threads) == 2
+    assert threading.current_thread() not in threads
@@ -0,0 +1,106 @@
+"""Testing the tile result cache."""
+
+import numpy as np
+
+from target_finder import classification
+from target_finder.tile_cache import TileCache
+
+
+class _BoxDetector(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def detect_all(self, images):
+        self.calls += len(images)
+        return [[('circle', 0.75, [100, 120, 30, 40])] for _ in images]
+
+
+def test_lru_eviction():
+    cache = TileCache(max_size=2)
+
+    cache.put('a', True, [])
+    cache.put('b', False, [])
+    cache.get('a')
+    cache.put('c', True, [('A', 0.5, [1, 2, 3, 4])])
+
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == (True, [])
+    assert cache.get('c') == (True, [('A', 0.5, [1, 2, 3, 4])])
+
+
+def test_keys():
+    cache = TileCache(version='1.0.0')
+    tile = np.zeros((4, 4, 3), np.uint8)
+    other = tile.copy()
+    other[0, 0, 0] = 1
+
+    assert cache.key(tile) == cache.key(tile.copy())
+    assert cache.key(tile) != cache.key(other)
+    assert cache.key(tile) != TileCache(version='2.0.0').key(tile)
+    assert cache.key(tile, 'yolo3=a') != cache.key(tile, 'yolo3=b')
+
+
+def test_disk_store(tmpdir):
+    path = str(tmpdir.join('tiles.db'))
+
+    cache = TileCache(path=path)
+    cache.put('a', True, [('circle', 0.75, [1, 2, 3, 4])])
+    cache.close()
+
+    cache = TileCache(path=path)
+    assert cache.get('a') == (True, [('circle', 0.75, [1, 2, 3, 4])])
+    cache.close()
+
+
+def test_disk_eviction(tmpdir):
+    path = str(tmpdir.join('tiles.db'))
+
+    cache = TileCache(path=path, max_rows=2)
+    cache.put('a', True, [])
+    cache.put('b', False, [])
+
+    # Reading 'a' from the database makes 'b' the least recently used.
+    cache.clear()
+    assert cache.get('a') == (True, [])
+
+    cache.put('c', True, [])
+    cache.close()
+
+    cache = TileCache(path=path)
+    assert cache.get('b') is None
+    assert cache.get('a') == (True, [])
+    assert cache.get('c') == (True, [])
+    cache.close()
+
+
+def test_cached_run_models(fake_models):
+    detector = _BoxDetector()
+    classification.set_models({'yolo3': detector})
+
+    image = np.zeros((500, 700, 3), dtype=np.uint8)
+    image[:50, :50] = 1
+
+    expected = classification._run_models(image)
+    calls = detector.calls
+
+    cache = TileCache()
+    first = classification._run_models(image, cache=cache)
+    second = classification._run_models(image, cache=cache)
+
+    def coords(boxes):
+        return [(b.x1, b.y1, b.x2, b.y2, b.meta) for b in boxes]
+
+    assert coords(first) == coords(expected)
+    assert coords(second) == coords(expected)
+
+    # The second run found every tile in the cache.
+    assert detector.calls == calls * 2
+    assert cache.hits == 6
+
+    # Results from other models aren't reused.
+    classification.set_models({'yolo3': _BoxDetector()})
+    classification._run_models(image, cache=cache)
+
+    assert cache.hits == 6
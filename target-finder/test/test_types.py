@@ -1,9 +1,14 @@
 """Testing that the basic types in target_finder/types work."""
 
+import json
+import tracemalloc
+
+import numpy as np
 import PIL.Image
 import pytest
 
-from target_finder import Color, Shape, Target
+from target_finder import Color, Shape, Target, TargetBatch
+from target_finder.types import BBox, BoxArray
 
 
 def test_basic_target():
@@ -50,3 +55,166 @@ def test_target_with_optionals():
                      "shape=Shape.SQUARE, background_color=Color.GREEN, " + \
                      "alphanumeric='A', alphanumeric_color=Color.WHITE)"
     assert repr(eval(repr(t))) == repr(t)
+
+
+def _fields(target):
+    return [getattr(target, name) for name in (
+        'x', 'y', 'width', 'height', 'shape', 'orientation',
+        'background_color', 'alphanumeric', 'alphanumeric_color', 'image',
+        'confidence')]
+
+
+def _batch_targets():
+    return [
+        Target(3, 5, 7, 9, shape=Shape.SQUARE, orientation=74.3,
+               background_color=Color.GREEN, alphanumeric='A',
+               alphanumeric_color=Color.WHITE, confidence=0.97),
+        Target(10.5, 20.25, 30, 40, shape=Shape.STAR, confidence=0.4),
+        Target(1, 2, 3, 4, alphanumeric='B', confidence=0.85)
+    ]
+
+
+def test_target_batch_round_trip():
+    targets = _batch_targets()
+    batch = TargetBatch.from_targets(targets)
+
+    assert len(batch) == 3
+    assert batch['x'].tolist() == [3, 10.5, 1]
+    assert batch['shape'].tolist() == [Shape.SQUARE.value, Shape.STAR.value,
+                                       Shape.NAS.value]
+    # Only the numbers become floats.
+    assert [_fields(t) for t in batch.to_targets()] == \
+        [_fields(t) for t in targets]
+
+    assert len(TargetBatch()) == 0
+    assert TargetBatch.from_targets([]).to_targets() == []
+
+    assert TargetBatch.row(targets[0])[0] == 3
+
+    # Longer alphanumerics would be cut off.
+    with pytest.raises(ValueError):
+        TargetBatch.from_targets([Target(0, 0, 1, 1,
+                                         alphanumeric='ABCDEFGHI')])
+
+
+def test_target_batch_filter():
+    batch = TargetBatch.from_targets(_batch_targets())
+
+    assert batch.filter(0.85)['confidence'].tolist() == [0.97, 0.85]
+    assert len(batch.filter(0.99)) == 0
+    assert batch[1:]['alphanumeric'].tolist() == ['', 'B']
+
+
+def test_target_batch_serialize(tmpdir):
+    batch = TargetBatch.from_targets(_batch_targets())
+
+    dicts = json.loads(batch.to_json())
+
+    assert dicts[0] == {
+        'x': 3, 'y': 5, 'width': 7, 'height': 9, 'orientation': 74.3,
+        'shape': 'square', 'background_color': 'green',
+        'alphanumeric': 'A', 'alphanumeric_color': 'white',
+        'confidence': 0.97
+    }
+
+    filename = str(tmpdir.join('targets.npz'))
+    batch.save_npz(filename, source=np.array(['a.jpg'] * 3))
+
+    loaded = TargetBatch.load_npz(filename)
+
+    assert np.array_equal(loaded.array, batch.array)
+    assert TargetBatch.concatenate([batch, loaded]).to_dicts() == \
+        batch.to_dicts() * 2
+
+
+def test_box_array():
+    boxes = BoxArray([(0, 0, 10, 20), (5, 5, 15, 10), (30, 30, 40, 40)],
+                     confidence=[0.5, 0.6, 0.7])
+
+    assert len(boxes) == 3
+    assert boxes.w.tolist() == [10, 10, 10]
+    assert boxes.h.tolist() == [20, 5, 10]
+
+    box = boxes[1]
+    assert isinstance(box, BBox)
+    assert (box.x1, box.y1, box.x2, box.y2) == (5, 5, 15, 10)
+    assert box.confidence == 0.6
+    assert box.meta == {}
+
+    assert boxes[boxes.confidence > 0.55].x1.tolist() == [5, 30]
+    assert (boxes[:1] + boxes[2:]).x1.tolist() == [0, 30]
+
+    assert boxes.intersects(boxes).tolist() == [
+        [True, True, False],
+        [True, True, False],
+        [False, False, True]
+    ]
+
+    i, j = boxes.intersecting_pairs()
+    assert (i.tolist(), j.tolist()) == ([0], [1])
+
+    again = BoxArray.from_boxes(list(boxes))
+    assert np.array_equal(again.coords, boxes.coords)
+    assert np.array_equal(again.confidence, boxes.confidence)
+
+
+def test_intersecting_pairs_chunks():
+    rng = np.random.RandomState(0)
+    xy = rng.uniform(0, 1000, (500, 2))
+    boxes = BoxArray(np.hstack([xy, xy + rng.uniform(1, 60, (500, 2))]))
+
+    expected = np.argwhere(np.triu(boxes.intersects(boxes), 1))
+
+    for max_pairs in (1, 100, 10 ** 6):
+        pairs = [np.stack(pair, axis=1) for pair in
+                 boxes.iter_intersecting_pairs(max_pairs=max_pairs)]
+        found = np.concatenate(pairs)
+
+        assert sorted(map(tuple, found.tolist())) == \
+            sorted(map(tuple, expected.tolist()))
+
+
+def test_intersecting_pairs_memory():
+    # Each box overlaps the next thousand along the x-axis, which makes
+    # 20M candidate pairs, but only the next one along the y-axis.
+    n = 20000
+    x = np.arange(n, dtype=float)
+    y = 3 * np.arange(n, dtype=float)
+    boxes = BoxArray(np.stack([x, y, x + 1000, y + 4], axis=1))
+
+    tracemalloc.start()
+
+    try:
+        i, j = boxes.intersecting_pairs()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert i.tolist() == list(range(n - 1))
+    assert j.tolist() == list(range(1, n))
+    assert peak < 200 * 2 ** 20
+
+
+def test_slots():
+    with pytest.raises(AttributeError):
+        BBox(0, 0, 1, 1).extra = 1
+
+    with pytest.raises(AttributeError):
+        Target(0, 0, 1, 1).extra = 1
+
+
+def test_target_image_view():
+    view = np.zeros((4, 6, 3), np.uint8)
+    view[..., 0] = 255
+
+    t = Target(0, 0, 6, 4)
+    t.set_image_view(view)
+
+    image = t.image
+
+    assert image.size == (6, 4)
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+    assert t.image is image
+
+    t.image = None
+    assert t.image is None